@@ -12,11 +12,14 @@ from starlette.responses import (
 from werkzeug.utils import secure_filename
 
 from api_response import api_error_response, api_ok_response
-from database import db_session
+from cache_utils import get_cache_stats
+from database import fetch_all, fetch_one, get_db_stats
 from file_validation import build_content_disposition_attachment
+from password_security import get_password_pool_stats
 from FSQR import fsqr_data as fs_data
 from Group import group_data
 from Group.group_storage import collect_room_files, existing_room_folders, room_folder
+import storage_layout
 from session_auth import (
     clear_session_authenticated,
     is_session_authenticated,
@@ -38,9 +41,6 @@ from settings import (
     GROUP_UPLOAD_DIR as SETTINGS_GROUP_UPLOAD_DIR,
 )
 
-fs_db = db_session
-grp_db = db_session
-
 ADMIN_DB_PW = DB_ADMIN_PASSWORD
 DB_ADMIN_SESSION_KEY = "db_admin_authenticated"
 
@@ -58,12 +58,12 @@ def _remove_temp_file(path: str):
 
 
 COUNT_QUERIES = {
-    "fsqr": text("SELECT COUNT(*) FROM fsqr"),
-    "room": text("SELECT COUNT(*) FROM room"),
-    "note_room": text("SELECT COUNT(*) FROM note_room"),
-    "note_content": text("SELECT COUNT(*) FROM note_content"),
-    "task_room": text("SELECT COUNT(*) FROM task_room"),
-    "task_item": text("SELECT COUNT(*) FROM task_item"),
+    "fsqr": text("SELECT COUNT(*) AS cnt FROM fsqr"),
+    "room": text("SELECT COUNT(*) AS cnt FROM room"),
+    "note_room": text("SELECT COUNT(*) AS cnt FROM note_room"),
+    "note_content": text("SELECT COUNT(*) AS cnt FROM note_content"),
+    "task_room": text("SELECT COUNT(*) AS cnt FROM task_room"),
+    "task_item": text("SELECT COUNT(*) AS cnt FROM task_item"),
 }
 
 RECENT_QUERIES = {
@@ -92,48 +92,35 @@ def _validate_recent_limit(limit):
     return limit
 
 
-async def table_exists(sess, table_name):
+# 管理画面の件数・最新行は数秒古くてもよいので、レプリカがあればそちらで読む。
+async def table_exists(table_name):
     q = """
-        SELECT COUNT(*) FROM information_schema.tables
+        SELECT COUNT(*) AS cnt FROM information_schema.tables
         WHERE table_schema = DATABASE() AND table_name = :t
     """
-    result = await sess.execute(text(q), {"t": table_name})
-    exists = bool(result.scalar())
-    try:
-        await sess.rollback()
-    except Exception:  # noqa: S110
-        pass
-    return exists
+    row = await fetch_one(q, {"t": table_name}, replica=True)
+    return bool(row and row["cnt"])
 
 
-async def safe_count(sess, table):
+async def safe_count(table):
     query = COUNT_QUERIES.get(table)
     if query is None:
         return 0
-    if not await table_exists(sess, table):
+    if not await table_exists(table):
         return 0
-    result = await sess.execute(query)
-    count = result.scalar()
-    try:
-        await sess.rollback()
-    except Exception:  # noqa: S110
-        pass
-    return count
+    row = await fetch_one(query, replica=True)
+    return row["cnt"] if row else 0
 
 
-async def safe_recent(sess, table, time_col, limit=10):
+async def safe_recent(table, time_col, limit=10):
     query = RECENT_QUERIES.get((table, time_col))
     if query is None:
         return None
-    if not await table_exists(sess, table):
+    if not await table_exists(table):
         return None
-    result = await sess.execute(query, {"limit": _validate_recent_limit(limit)})
-    rows = result.mappings().all()
-    try:
-        await sess.rollback()
-    except Exception:  # noqa: S110
-        pass
-    return rows
+    return await fetch_all(
+        query, {"limit": _validate_recent_limit(limit)}, replica=True
+    )
 
 
 async def _get_record(secure_id):
@@ -158,7 +145,9 @@ def _resolve_file_path(record):
         display_name = filename
         mimetype = "application/zip"
 
-    path = os.path.join(UPLOAD_DIR, filename)
+    path = storage_layout.find_existing(
+        UPLOAD_DIR, secure_id, filename
+    ) or storage_layout.sharded_path(UPLOAD_DIR, secure_id, filename)
     return path, filename, display_name, mimetype
 
 
@@ -245,21 +234,21 @@ async def dashboard(request: Request):
         return render_template(request, "db_admin.html", authenticated=False)
 
     summary = [
-        {"name": "fsqr", "count": await safe_count(fs_db, "fsqr")},
-        {"name": "room", "count": await safe_count(grp_db, "room")},
-        {"name": "note_room", "count": await safe_count(grp_db, "note_room")},
-        {"name": "task_room", "count": await safe_count(grp_db, "task_room")},
-        {"name": "task_item", "count": await safe_count(grp_db, "task_item")},
-        {"name": "note_content", "count": await safe_count(grp_db, "note_content")},
+        {"name": "fsqr", "count": await safe_count("fsqr")},
+        {"name": "room", "count": await safe_count("room")},
+        {"name": "note_room", "count": await safe_count("note_room")},
+        {"name": "task_room", "count": await safe_count("task_room")},
+        {"name": "task_item", "count": await safe_count("task_item")},
+        {"name": "note_content", "count": await safe_count("note_content")},
     ]
 
     recent_rows = {
-        "fsqr": await safe_recent(fs_db, "fsqr", "time"),
-        "room": await safe_recent(grp_db, "room", "time"),
-        "note_room": await safe_recent(grp_db, "note_room", "time"),
-        "task_room": await safe_recent(grp_db, "task_room", "time"),
-        "task_item": await safe_recent(grp_db, "task_item", "updated_at"),
-        "note_content": await safe_recent(grp_db, "note_content", "updated_at"),
+        "fsqr": await safe_recent("fsqr", "time"),
+        "room": await safe_recent("room", "time"),
+        "note_room": await safe_recent("note_room", "time"),
+        "task_room": await safe_recent("task_room", "time"),
+        "task_item": await safe_recent("task_item", "updated_at"),
+        "note_content": await safe_recent("note_content", "updated_at"),
     }
 
     return render_template(
@@ -405,6 +394,21 @@ async def room_download(request: Request, room_id: str):
     )
 
 
+@router.get("/metrics", name="db_admin.metrics")
+async def runtime_metrics(request: Request):
+    # ワーカー単位の実行時メトリクス。値はこのプロセス内のカウンタのみを表す。
+    if not _is_db_admin_authenticated(request):
+        return api_error_response("forbidden", status_code=403)
+    return api_ok_response(
+        {
+            "pid": os.getpid(),
+            "password_pool": get_password_pool_stats(),
+            "cache": get_cache_stats(),
+            "database": get_db_stats(),
+        }
+    )
+
+
 @router.get("/db/logout", name="db_admin.logout")
 async def db_admin_logout(request: Request):
     clear_session_authenticated(request.session, DB_ADMIN_SESSION_KEY)
@@ -1,14 +1,17 @@
+import asyncio
+import hashlib
+import hmac
 import os
 import re
 import secrets
 import uuid
 from datetime import datetime, timedelta
-import shutil
 import logging
-from typing import List, Optional
+from typing import List
 
-from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
-from starlette.concurrency import run_in_threadpool
+from fastapi import APIRouter, HTTPException, Request, UploadFile
+from pydantic import ValidationError
+from starlette.formparsers import MultiPartException
 from starlette.responses import RedirectResponse
 
 from api_response import api_error_response, api_ok_response
@@ -17,10 +20,9 @@ from file_validation import (
     build_content_disposition_attachment,
     normalize_upload_filename,
     sanitize_download_filename,
-    validate_upload_limits,
 )
 from i18n import is_language_query_only
-from models import FsqrUploadInput
+from models import FsqrUploadInput, FsqrUploadSessionInput
 from rate_limit import (
     SCOPE_QR,
     check_rate_limit,
@@ -31,6 +33,7 @@ from rate_limit import (
 )
 from room_credentials import generate_room_password, validate_room_credentials
 from settings import (
+    FSQR_UPLOAD_CHUNK_SIZE_BYTES,
     FSQR_UPLOAD_DIR,
     UPLOAD_MAX_FILES,
     UPLOAD_MAX_TOTAL_SIZE_BYTES,
@@ -44,9 +47,26 @@ from share_links import (
     resolve_share_link,
     share_link_password,
 )
-from web import build_url, enforce_csrf, render_template, wants_json_response
+from upload_streaming import (
+    UploadLimitError,
+    discard_upload_form,
+    receive_upload_form,
+    upload_temp_path,
+    uploaded_files,
+)
+from web import (
+    build_url,
+    enforce_csrf,
+    enforce_csrf_form_token,
+    get_or_create_csrf_token,
+    has_csrf_header,
+    render_template,
+    wants_json_response,
+)
 import room_access
+import storage_layout
 from . import fsqr_data as fs_data
+from . import fsqr_upload_sessions as upload_sessions
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -57,6 +77,7 @@ os.makedirs(STATIC, exist_ok=True)
 FSQR_UPLOAD_ACCESS_SESSION_KEY = "fsqr_upload_access"
 FSQR_UPLOAD_FILE_TYPES = frozenset({"single", "multiple"})
 SHARE_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{32,256}$")
+CHUNK_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
 
 # FSQR encrypts files in the browser, which adds an IV, authentication tag, and
 # ZIP metadata. Keep a small storage allowance while retaining the 1GiB user limit.
@@ -212,12 +233,6 @@ def _strip_upload_suffix(filename: str, suffix: str) -> str:
     return filename
 
 
-def _write_upload_to_disk(src, temp_path: str) -> None:
-    """アップロードストリームをディスクへ書き出す（同期・スレッドプール実行用）。"""
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(src, buffer)
-
-
 def _validate_fsqr_encrypted_payload(
     file_type: str, files: List[UploadFile]
 ) -> str | None:
@@ -227,7 +242,14 @@ def _validate_fsqr_encrypted_payload(
     if len(files) != 1:
         return "アップロードデータが不正です。ファイルを選び直してください。"
 
-    filename = normalize_upload_filename(files[0].filename or "")
+    return _validate_fsqr_payload_name(file_type, files[0].filename or "")
+
+
+def _validate_fsqr_payload_name(file_type: str, filename: str) -> str | None:
+    if file_type not in FSQR_UPLOAD_FILE_TYPES:
+        return "アップロード形式が不正です。"
+
+    filename = normalize_upload_filename(filename)
     if not filename:
         return "不正なファイル名です"
 
@@ -284,22 +306,90 @@ async def fs_qr_upload(request: Request):
 
 
 @router.post("/upload", name="fsqr.upload")
-async def upload(  # noqa: C901
-    request: Request,
-    name: str = Form(""),
-    download_password: str = Form(""),
-    file_type: str = Form("multiple"),
-    original_filename: str = Form(""),
-    retention_hours: str = Form(""),
-    upfile: Optional[List[UploadFile]] = File(None),
-):
-    await enforce_csrf(request)
-    uid = str(uuid.uuid4())[:10]
-    file_type = file_type or "multiple"
-    original_filename = original_filename or ""
+async def upload(request: Request):
+    # 本文は receive_upload_form が読みながら保存先へ書くため、FastAPI の Form /
+    # File 引数は使わない。CSRF はヘッダーで届いていれば受信前に確かめる。
+    csrf_in_header = has_csrf_header(request)
+    if csrf_in_header:
+        await enforce_csrf(request)
+    try:
+        form = await receive_upload_form(
+            request,
+            upload_dir=STATIC,
+            max_files=UPLOAD_MAX_FILES,
+            max_total_bytes=FSQR_MAX_STORED_PAYLOAD_BYTES,
+            too_many_files_message=f"ファイル数は最大{UPLOAD_MAX_FILES}個までです",
+            too_large_message=(
+                f"ファイルの合計サイズは{UPLOAD_MAX_TOTAL_SIZE_MB}MBまでです"
+            ),
+        )
+    except UploadLimitError as exc:
+        return json_or_msg(request, exc.message)
+    except MultiPartException:
+        return json_or_msg(request, "アップロード失敗")
+    try:
+        if not csrf_in_header:
+            enforce_csrf_form_token(request, form)
+        return await _store_upload(request, form)
+    finally:
+        await discard_upload_form(form)
+
+
+def _form_text(form, key: str, default: str = "") -> str:
+    value = form.get(key, default)
+    return value if isinstance(value, str) else default
+
+
+async def _store_upload(request: Request, form):
+    file_type = _form_text(form, "file_type", "multiple") or "multiple"
+    upfile = uploaded_files(form, "upfile")
 
-    upload_in = FsqrUploadInput(name=name, retention_hours=retention_hours)
-    retention_hours_int = upload_in.retention_hours
+    fields = _resolve_upload_fields(form)
+    if isinstance(fields, str):
+        return json_or_msg(request, fields)
+
+    if not upfile:
+        return json_or_msg(request, "アップロード失敗")
+
+    payload_error = _validate_fsqr_encrypted_payload(file_type, upfile)
+    if payload_error:
+        return json_or_msg(request, payload_error)
+
+    file = upfile[0]
+    filename = normalize_upload_filename(file.filename or "")
+    if not filename:
+        return json_or_msg(request, "不正なファイル名です")
+
+    # 受信時に保存先と同じディレクトリへ書いた一時ファイルを、そのまま確定させる。
+    temp_path = upload_temp_path(file)
+    if temp_path is None:
+        return json_or_msg(request, "アップロード失敗")
+    await file.close()
+
+    result = await _activate_upload(
+        request,
+        temp_path=temp_path,
+        filename=filename,
+        file_type=file_type,
+        original_filename=_form_text(form, "original_filename"),
+        fields=fields,
+    )
+    if result is None:
+        return json_or_msg(request, _UPLOAD_SAVE_FAILED_MESSAGE, status_code=500)
+    return api_ok_response(result)
+
+
+_UPLOAD_SAVE_FAILED_MESSAGE = (
+    "アップロード情報の保存に失敗しました。時間をおいて再度お試しください。"
+)
+
+
+def _resolve_upload_fields(form) -> "str | tuple[str, str, int]":
+    """ID・パスワード・保存期間を決める。不正なら利用者向けの文言を返す。"""
+    upload_in = FsqrUploadInput(
+        name=_form_text(form, "name"),
+        retention_hours=_form_text(form, "retention_hours"),
+    )
     id_val = upload_in.name
 
     if not id_val:
@@ -311,57 +401,44 @@ async def upload(  # noqa: C901
         try:
             upload_in.validate_manual_id()
         except ValueError as exc:
-            return json_or_msg(request, str(exc))
+            return str(exc)
 
-    download_password = (download_password or "").strip()
+    download_password = _form_text(form, "download_password").strip()
     if download_password:
         try:
             _, download_password = validate_room_credentials(id_val, download_password)
         except ValueError:
-            return json_or_msg(
-                request,
-                "アップロード用パスワードの生成に失敗しました。画面を再読み込みして再度お試しください。",
-            )
+            return "アップロード用パスワードの生成に失敗しました。画面を再読み込みして再度お試しください。"
         password = download_password
     else:
         password = generate_room_password()
-    secure_id_base = f"{id_val}-{uid}-"
-
-    if not upfile:
-        return json_or_msg(request, "アップロード失敗")
+    return id_val, password, upload_in.retention_hours
 
-    limits_error = validate_upload_limits(
-        upfile,
-        max_files=UPLOAD_MAX_FILES,
-        max_total_size_bytes=FSQR_MAX_STORED_PAYLOAD_BYTES,
-        max_total_size_mb=UPLOAD_MAX_TOTAL_SIZE_MB,
-        too_many_files_message=f"ファイル数は最大{UPLOAD_MAX_FILES}個までです",
-        too_large_total_size_message=(
-            f"ファイルの合計サイズは{UPLOAD_MAX_TOTAL_SIZE_MB}MBまでです"
-        ),
-    )
-    if limits_error:
-        return json_or_msg(request, limits_error)
-
-    payload_error = _validate_fsqr_encrypted_payload(file_type, upfile)
-    if payload_error:
-        return json_or_msg(request, payload_error)
-
-    file = upfile[0]
-    filename = normalize_upload_filename(file.filename or "")
-    if not filename:
-        return json_or_msg(request, "不正なファイル名です")
 
+async def _activate_upload(
+    request: Request,
+    *,
+    temp_path: str,
+    filename: str,
+    file_type: str,
+    original_filename: str,
+    fields: tuple[str, str, int],
+) -> dict | None:
+    """保存先に書き終えた一時ファイルを公開する。失敗時は後始末して None を返す。
+
+    メタデータと共有リンクを作ってから ``os.replace`` で確定させ、途中で失敗したら
+    作った分を取り消す。通常のアップロードと分割アップロードで共用する。
+    """
+    id_val, password, retention_hours_int = fields
+    uid = str(uuid.uuid4())[:10]
+    secure_id_base = f"{id_val}-{uid}-"
     if file_type == "single":
         secure_id = secure_id_base + _strip_upload_suffix(filename, ".enc")
-        final_path = os.path.join(STATIC, secure_id + ".enc")
     else:
         secure_id = secure_id_base + _strip_upload_suffix(filename, ".zip")
-        final_path = os.path.join(STATIC, secure_id + ".zip")
-
-    temp_path = os.path.join(STATIC, f".{secure_id}.{secrets.token_hex(8)}.uploading")
-    # ブロッキングなディスク書き込みはスレッドプールへ逃がし、イベントループを止めない。
-    await run_in_threadpool(_write_upload_to_disk, file.file, temp_path)
+    final_path = storage_layout.sharded_path(
+        STATIC, secure_id, fs_data.stored_filename(secure_id, file_type)
+    )
 
     metadata_saved = False
     share_token = ""
@@ -382,6 +459,7 @@ async def upload(  # noqa: C901
             password=password,
             retention_hours=retention_hours_int,
         )
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
         os.replace(temp_path, final_path)
     except Exception:
         if metadata_saved:
@@ -402,11 +480,7 @@ async def upload(  # noqa: C901
                     os.remove(orphan_path)
             except OSError:
                 logger.warning("Failed to remove orphaned upload: %s", orphan_path)
-        return json_or_msg(
-            request,
-            "アップロード情報の保存に失敗しました。時間をおいて再度お試しください。",
-            status_code=500,
-        )
+        return None
     _remember_fsqr_access(
         request, secure_id, id_val, password, share_token, can_delete=True
     )
@@ -417,19 +491,186 @@ async def upload(  # noqa: C901
         else ""
     )
 
-    return api_ok_response(
-        {
-            "redirect_url": build_url(
-                request, "fsqr.upload_complete", secure_id=secure_id
-            ),
-            # LPからページ遷移せず共有情報を表示するための公開情報。
-            # 暗号鍵はブラウザ側で生成・保持しており、サーバーから返さない。
-            "share_url": share_url,
-            "id": id_val,
-            "password": password,
-            "retention_hours": retention_hours_int,
-        }
+    return {
+        "redirect_url": build_url(request, "fsqr.upload_complete", secure_id=secure_id),
+        # LPからページ遷移せず共有情報を表示するための公開情報。
+        # 暗号鍵はブラウザ側で生成・保持しており、サーバーから返さない。
+        "share_url": share_url,
+        "id": id_val,
+        "password": password,
+        "retention_hours": retention_hours_int,
+    }
+
+
+def _upload_session_owner(request: Request) -> str:
+    # セッションは作成したブラウザ（CSRF トークン）だけが操作できる。
+    return hashlib.sha256(get_or_create_csrf_token(request).encode()).hexdigest()
+
+
+async def _owned_upload_session(request: Request, session_id: str) -> dict | None:
+    session = await asyncio.to_thread(upload_sessions.load_session, STATIC, session_id)
+    if not session or not hmac.compare_digest(
+        session.get("owner", ""), _upload_session_owner(request)
+    ):
+        return None
+    return session
+
+
+def _upload_session_status(session: dict, received: list[int]) -> dict:
+    return {
+        "session_id": session["session_id"],
+        "size": session["size"],
+        "chunk_size": session["chunk_size"],
+        "chunk_count": upload_sessions.chunk_count(session),
+        "received": received,
+    }
+
+
+@router.post("/upload/sessions", name="fsqr.create_upload_session")
+async def create_upload_session(request: Request):
+    """分割アップロードを始める。以降のチャンクは順不同・並列・再送してよい。"""
+    await enforce_csrf(request)
+    try:
+        payload = FsqrUploadSessionInput.model_validate(await request.json())
+    except (ValidationError, ValueError, TypeError):
+        return api_error_response("アップロード失敗")
+    name_error = _validate_fsqr_payload_name(payload.file_type, payload.filename)
+    if name_error:
+        return api_error_response(name_error)
+    if payload.size > FSQR_MAX_STORED_PAYLOAD_BYTES:
+        return api_error_response(
+            f"ファイルの合計サイズは{UPLOAD_MAX_TOTAL_SIZE_MB}MBまでです",
+            status_code=413,
+        )
+    try:
+        session = await asyncio.to_thread(
+            upload_sessions.create_session,
+            STATIC,
+            filename=normalize_upload_filename(payload.filename),
+            file_type=payload.file_type,
+            size=payload.size,
+            chunk_size=FSQR_UPLOAD_CHUNK_SIZE_BYTES,
+            owner=_upload_session_owner(request),
+        )
+    except OSError:
+        logger.exception("Failed to create FSQR upload session")
+        return api_error_response("アップロード失敗", status_code=500)
+    return api_ok_response(_upload_session_status(session, []), status_code=201)
+
+
+@router.get("/upload/sessions/{session_id}", name="fsqr.upload_session_status")
+async def upload_session_status(request: Request, session_id: str):
+    session = await _owned_upload_session(request, session_id)
+    if not session:
+        return api_error_response("アップロード失敗", status_code=404)
+    received = await asyncio.to_thread(upload_sessions.received_chunks, STATIC, session)
+    return api_ok_response(_upload_session_status(session, received))
+
+
+@router.put(
+    "/upload/sessions/{session_id}/chunks/{index}",
+    name="fsqr.upload_session_chunk",
+)
+async def upload_session_chunk(request: Request, session_id: str, index: int):
+    """チャンクを 1 つ受け取る。X-Chunk-SHA256 と一致しなければ保存しない。"""
+    await enforce_csrf(request)
+    session = await _owned_upload_session(request, session_id)
+    if not session:
+        return api_error_response("アップロード失敗", status_code=404)
+    chunk_range = upload_sessions.chunk_range(session, index)
+    if chunk_range is None:
+        return api_error_response("アップロード失敗")
+    expected_digest = request.headers.get("x-chunk-sha256", "").strip().lower()
+    if not CHUNK_SHA256_RE.match(expected_digest):
+        return api_error_response("アップロード失敗")
+
+    # 受け取った分から本体の所定の位置へ書き、チャンク全体をメモリに溜めない。
+    offset, expected_length = chunk_range
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        writer = await asyncio.to_thread(
+            upload_sessions.open_chunk, STATIC, session, index
+        )
+        if writer is None:
+            # 確定処理が始まったセッション。
+            return api_error_response("アップロード失敗", status_code=409)
+        try:
+            async for part in request.stream():
+                if written + len(part) > expected_length:
+                    return api_error_response("アップロード失敗", status_code=413)
+                digest.update(part)
+                await asyncio.to_thread(writer.write, part, offset + written)
+                written += len(part)
+            if written != expected_length or not hmac.compare_digest(
+                digest.hexdigest(), expected_digest
+            ):
+                # 途中で壊れたチャンク。受信済みにはせず、クライアントに再送させる。
+                return api_error_response(
+                    "アップロード失敗", status_code=422, data={"index": index}
+                )
+            await asyncio.to_thread(writer.mark_received)
+        finally:
+            writer.close()
+    except OSError:
+        logger.exception("Failed to write FSQR upload chunk: %s", session_id)
+        return api_error_response("アップロード失敗", status_code=500)
+    return api_ok_response({"index": index})
+
+
+@router.delete("/upload/sessions/{session_id}", name="fsqr.discard_upload_session")
+async def discard_upload_session(request: Request, session_id: str):
+    await enforce_csrf(request)
+    if await _owned_upload_session(request, session_id):
+        await asyncio.to_thread(upload_sessions.discard_session, STATIC, session_id)
+    return api_ok_response({})
+
+
+@router.post(
+    "/upload/sessions/{session_id}/complete",
+    name="fsqr.complete_upload_session",
+)
+async def complete_upload_session(request: Request, session_id: str):
+    """全チャンクが揃ったセッションを通常のアップロードと同じ手順で公開する。"""
+    await enforce_csrf(request)
+    if not await _owned_upload_session(request, session_id):
+        return api_error_response("アップロード失敗", status_code=404)
+    try:
+        form = await request.json()
+    except ValueError:
+        form = None
+    if not isinstance(form, dict):
+        return api_error_response("アップロード失敗")
+
+    fields = _resolve_upload_fields(form)
+    if isinstance(fields, str):
+        return api_error_response(fields)
+
+    session, missing = await asyncio.to_thread(
+        upload_sessions.claim_complete_session, STATIC, session_id
     )
+    if missing:
+        return api_error_response(
+            "アップロード失敗", status_code=409, data={"missing": missing}
+        )
+    if not session:
+        # 別のリクエストが確定処理中。
+        return api_error_response("アップロード失敗", status_code=409)
+
+    try:
+        result = await _activate_upload(
+            request,
+            temp_path=upload_sessions.data_path(STATIC, session_id),
+            filename=session["filename"],
+            file_type=session["file_type"],
+            original_filename=_form_text(form, "original_filename"),
+            fields=fields,
+        )
+    finally:
+        await asyncio.to_thread(upload_sessions.discard_session, STATIC, session_id)
+    if result is None:
+        return api_error_response(_UPLOAD_SAVE_FAILED_MESSAGE, status_code=500)
+    return api_ok_response(result)
 
 
 @router.get("/upload_complete/{secure_id}", name="fsqr.upload_complete")
@@ -625,16 +866,16 @@ async def _send_file_response(request: Request, secure_id: str):
     file_type = data[0].get("file_type", "multiple")
     original_filename = data[0].get("original_filename", "")
 
+    stored_name = fs_data.stored_filename(secure_id, file_type)
     if file_type == "single":
-        path = os.path.join(STATIC, secure_id + ".enc")
-        download_name = original_filename if original_filename else secure_id + ".enc"
+        download_name = original_filename if original_filename else stored_name
         mimetype = "application/octet-stream"
     else:
-        path = os.path.join(STATIC, secure_id + ".zip")
-        download_name = secure_id + ".zip"
+        download_name = stored_name
         mimetype = "application/zip"
 
-    if not os.path.exists(path):
+    path = storage_layout.find_existing(STATIC, secure_id, stored_name)
+    if path is None:
         return msg(request, "ファイルが存在しません")
 
     headers = {
@@ -5,17 +5,26 @@ import json
 import os
 from datetime import datetime, timezone
 from typing import Optional
-from sqlalchemy import text
+from sql_statements import statement
 import logging
 
 import log_config  # noqa: F401
-from password_security import hash_password, verify_password
-from database import execute_query
+import room_directory
+import storage_layout
+from password_security import (
+    hash_password_async,
+    password_lookup_hash,
+    verify_password_async,
+)
+from database import execute_query, fetch_all
 from cache_utils import (
     cache_data,
-    invalidate_cache_entry,
+    cache_entry,
+    invalidate_cache_entries,
     invalidate_cache_prefix,
     redis_client,
+    resource_tag,
+    tag_results_by,
 )
 from settings import FSQR_UPLOAD_DIR, SECRET_KEY
 
@@ -26,6 +35,20 @@ STATIC = FSQR_UPLOAD_DIR
 EXPIRATION_CLEANUP_STATUS_KEY = "fsqr:expiration_cleanup:last_result"
 
 
+# 用途ごとに読む列を固定する。SELECT * だと password や各種ハッシュまで
+# MySQL から運び、キャッシュ層で捨てることになるため。
+# ダウンロード・情報画面用のメタ情報（秘密の列を含まない）
+_META_COLUMNS = (
+    "time, id, secure_id, file_type, original_filename, retention_hours, expires_at"
+)
+# 管理画面・削除処理用の生レコード（ハッシュ済み password を含む）
+_RECORD_COLUMNS = f"{_META_COLUMNS}, password"
+# 管理画面の一覧用
+_LIST_COLUMNS = "time, id, secure_id, expires_at"
+# ログイン判定用
+_LOGIN_COLUMNS = "secure_id, password"
+
+
 def hash_share_token(share_token: str) -> str:
     secret = (SECRET_KEY or "").encode("utf-8")
     if secret:
@@ -34,11 +57,7 @@ def hash_share_token(share_token: str) -> str:
 
 
 def hash_password_lookup(id_val: str, password: str) -> str:
-    payload = f"fsqr:{id_val}:{password}".encode("utf-8")
-    secret = (SECRET_KEY or "").encode("utf-8")
-    if secret:
-        return hmac.new(secret, payload, hashlib.sha256).hexdigest()
-    return hashlib.sha256(payload).hexdigest()
+    return password_lookup_hash("fsqr", id_val, password)
 
 
 # ファイルを保存
@@ -53,10 +72,10 @@ async def save_file(
     share_token=None,
 ):
     try:
-        hashed_password = hash_password(password)
+        hashed_password = await hash_password_async(password)
         password_lookup_hash = hash_password_lookup(id, password)
         share_token_hash = hash_share_token(share_token) if share_token else None
-        query = text("""
+        query = statement("""
             INSERT INTO fsqr (
                 time, uuid, id, password, password_lookup_hash,
                 secure_id, share_token_hash, file_type, original_filename,
@@ -82,12 +101,23 @@ async def save_file(
                 "retention_hours": retention_hours,
             },
         )
-        await invalidate_cache_entry(try_login, id, password)
-        await invalidate_cache_entry(get_data_by_credentials, id, password)
-        await invalidate_cache_entry(get_data, secure_id)
+        await room_directory.register_room(
+            service_key="fsqr",
+            id_val=id,
+            password=password,
+            hashed_password=hashed_password,
+            resource_id=secure_id,
+            retention_hours=retention_hours,
+        )
+        entries = [
+            cache_entry(try_login, id, password),
+            cache_entry(get_data_by_credentials, id, password),
+            cache_entry(get_data, secure_id),
+            cache_entry(get_all),
+        ]
         if share_token:
-            await invalidate_cache_entry(get_data_by_share_token, share_token)
-        await invalidate_cache_entry(get_all)
+            entries.append(cache_entry(get_data_by_share_token, share_token))
+        await invalidate_cache_entries(*entries)
         logger.info("File saved successfully.")
     except Exception as e:
         logger.error(f"Failed to save file: {e}")
@@ -95,10 +125,10 @@ async def save_file(
 
 
 # ログイン処理
-@cache_data(ttl=60)
+@cache_data(ttl=60, tags=tag_results_by("fsqr", "secure_id"), cache_negative=True)
 async def try_login(id, password) -> Optional[str]:
     try:
-        record = await _find_record_by_credentials(id, password)
+        record = await _find_record_by_credentials(id, password, _LOGIN_COLUMNS)
         if record:
             logger.info("Login successful.")
             return record["secure_id"]
@@ -110,43 +140,54 @@ async def try_login(id, password) -> Optional[str]:
 
 
 # 資格情報でデータを取得
-@cache_data(ttl=60, strip_keys=("password", "password_lookup_hash"))
+@cache_data(
+    ttl=60,
+    strip_keys=("password", "password_lookup_hash"),
+    tags=tag_results_by("fsqr", "secure_id"),
+    cache_negative=True,
+)
 async def get_data_by_credentials(id, password):
     try:
-        record = await _find_record_by_credentials(id, password)
+        record = await _find_record_by_credentials(id, password, _RECORD_COLUMNS)
         return [record] if record else []
     except Exception as e:
         logger.error(f"Failed to fetch data by credentials: {e}")
         raise
 
 
-# データベースから任意のIDのデータを取り出す
-async def get_data_direct(secure_id):
+# データベースから任意のIDのデータを取り出す（既定は password を含む生のレコード）
+async def get_data_direct(secure_id, columns: str = _RECORD_COLUMNS):
     try:
-        query = text("""
-            SELECT * FROM fsqr WHERE secure_id = :secure_id
-        """)
-        result = await execute_query(query, {"secure_id": secure_id}, fetch=True)
+        # 差し込むのは定数の列一覧のみ。 / Only a constant column list is interpolated.
+        query = statement(f"""
+            SELECT {columns} FROM fsqr WHERE secure_id = :secure_id
+        """)  # noqa: S608
+        result = await fetch_all(query, {"secure_id": secure_id})
         return result
     except Exception as e:
         logger.error(f"Failed to fetch data: {e}")
         raise
 
 
-@cache_data(ttl=60, strip_keys=("password", "password_lookup_hash", "share_token_hash"))
+@cache_data(ttl=60, cache_negative=True)
 async def get_data(secure_id):
-    return await get_data_direct(secure_id)
+    return await get_data_direct(secure_id, _META_COLUMNS)
 
 
-@cache_data(ttl=60, strip_keys=("password", "password_lookup_hash", "share_token_hash"))
+@cache_data(
+    ttl=60,
+    tags=tag_results_by("fsqr", "secure_id"),
+    cache_negative=True,
+)
 async def get_data_by_share_token(share_token):
     try:
         token_hash = hash_share_token(share_token)
-        query = text("""
-            SELECT * FROM fsqr WHERE share_token_hash = :share_token_hash
-        """)
-        result = await execute_query(
-            query, {"share_token_hash": token_hash}, fetch=True
+        query = statement(f"""
+            SELECT {_META_COLUMNS} FROM fsqr WHERE share_token_hash = :share_token_hash
+        """)  # noqa: S608
+        result = await fetch_all(
+            query,
+            {"share_token_hash": token_hash},
         )
         return result
     except Exception as e:
@@ -154,25 +195,28 @@ async def get_data_by_share_token(share_token):
         raise
 
 
-# 全てのデータを取得する
-@cache_data(
-    ttl=300, strip_keys=("password", "password_lookup_hash", "share_token_hash")
-)
+# 全てのデータを取得する（60 秒を過ぎたら古い一覧を返しつつ裏で更新する）
+@cache_data(ttl=60, stale_ttl=240)
 async def get_all():
     return await get_all_direct()
 
 
-async def get_all_direct():
+async def get_all_direct(replica=True):
     try:
-        query = text("""
-            SELECT * FROM fsqr ORDER BY suji DESC
-        """)
-        return await execute_query(query, fetch=True)
+        query = statement(f"""
+            SELECT {_LIST_COLUMNS} FROM fsqr ORDER BY suji DESC
+        """)  # noqa: S608
+        return await fetch_all(query, replica=replica)
     except Exception as e:
         logger.error(f"Failed to fetch all data: {e}")
         raise
 
 
+def stored_filename(secure_id: str, file_type: str) -> str:
+    """保存ファイル名。single は暗号化済みの .enc、multiple は .zip。"""
+    return f"{secure_id}.enc" if file_type == "single" else f"{secure_id}.zip"
+
+
 # アップロードされたファイルとメタ情報の削除
 async def remove_data(secure_id):
     try:
@@ -185,35 +229,36 @@ async def remove_data(secure_id):
         if data:
             file_type = data[0].get("file_type", "multiple")
 
-        # ファイルタイプに応じて削除するファイルを決定
-        if file_type == "single":
-            paths = [os.path.join(STATIC, f"{secure_id}.enc")]
-        else:
-            paths = [os.path.join(STATIC, f"{secure_id}.zip")]
+        # 振り分け後の位置と、移行前の直下の両方を確認する
+        paths = storage_layout.candidate_paths(
+            STATIC, secure_id, stored_filename(secure_id, file_type)
+        )
 
         def _delete_files():
+            deleted = False
             for file_path in paths:
                 if os.path.exists(file_path):
                     os.remove(file_path)
+                    deleted = True
                     logger.info(f"Deleted file: {file_path}")
-                else:
-                    logger.warning(f"File not found: {file_path}")
+            if not deleted:
+                logger.warning(f"File not found: {paths[0]}")
 
         await asyncio.to_thread(_delete_files)
 
-        query = text("""
+        query = statement("""
             DELETE FROM fsqr WHERE secure_id = :secure_id
         """)
         await execute_query(query, {"secure_id": secure_id})
 
         # DB削除後の副作用を並列実行して高速化
         async def _invalidate_caches():
-            await invalidate_cache_entry(get_data, secure_id)
-            await invalidate_cache_entry(get_all)
-            if record:
-                await invalidate_cache_prefix(try_login)
-                await invalidate_cache_prefix(get_data_by_credentials)
-                await invalidate_cache_prefix(get_data_by_share_token)
+            # 資格情報や共有トークンをキーにした結果は secure_id のタグで消す。
+            await invalidate_cache_entries(
+                cache_entry(get_data, secure_id),
+                cache_entry(get_all),
+                tags=[resource_tag("fsqr", secure_id)] if record else (),
+            )
 
         async def _revoke_links():
             try:
@@ -227,7 +272,11 @@ async def remove_data(secure_id):
                     exc_info=True,
                 )
 
-        await asyncio.gather(_invalidate_caches(), _revoke_links())
+        await asyncio.gather(
+            _invalidate_caches(),
+            _revoke_links(),
+            room_directory.remove_room("fsqr", secure_id),
+        )
     except Exception as e:
         logger.error(f"Failed to remove data: {e}")
         raise
@@ -236,19 +285,19 @@ async def remove_data(secure_id):
 # 全てのデータを削除
 async def all_remove():
     try:
-        from share_links import ServiceKey, revoke_resource_links
+        from share_links import ServiceKey, revoke_links_for_resources
 
-        rows = await get_all_direct()
-        query = text("""
+        # 削除対象の共有リンクを漏らさないよう、一覧は primary で読む。
+        rows = await get_all_direct(replica=False)
+        query = statement("""
             DELETE FROM fsqr
         """)
         await execute_query(query)
-        for row in rows:
-            secure_id = row.get("secure_id")
-            if secure_id:
-                await revoke_resource_links(
-                    service_key=ServiceKey.FSQR, resource_id=secure_id
-                )
+        await room_directory.remove_service_rooms("fsqr")
+        await revoke_links_for_resources(
+            service_key=ServiceKey.FSQR,
+            resource_ids=[row["secure_id"] for row in rows if row.get("secure_id")],
+        )
         await invalidate_cache_prefix(try_login)
         await invalidate_cache_prefix(get_data_by_credentials)
         await invalidate_cache_prefix(get_data_by_share_token)
@@ -267,12 +316,13 @@ async def remove_expired_files():
         "ran_at": datetime.now(timezone.utc).isoformat(),
     }
     try:
-        query = text("""
+        query = statement("""
             SELECT secure_id
             FROM fsqr
             WHERE expires_at <= NOW()
             """)
-        expired_records = await execute_query(query, fetch=True)
+        # 期限は延長されないので、レプリカが古くても消えた行が混ざるだけで済む。
+        expired_records = await fetch_all(query, replica=True)
         stats["checked"] = len(expired_records)
         for record in expired_records:
             secure_id = record.get("secure_id")
@@ -310,35 +360,53 @@ async def record_expiration_cleanup_status(stats):
         logger.warning("Failed to record FSQR expiration cleanup status", exc_info=True)
 
 
-async def _find_record_by_credentials(id_val: str, password: str):
+async def _find_record_by_credentials(
+    id_val: str, password: str, columns: str = _RECORD_COLUMNS
+):
+    """ID とパスワードに一致するレコードを返す。columns は password と secure_id を含むこと。"""
     lookup_hash = hash_password_lookup(id_val, password)
-    query = text("""
-        SELECT * FROM fsqr
+    query = statement(f"""
+        SELECT {columns} FROM fsqr
         WHERE id = :id
           AND password_lookup_hash = :password_lookup_hash
         LIMIT 1
-    """)
-    rows = await execute_query(
+    """)  # noqa: S608
+    rows = await fetch_all(
         query,
         {"id": id_val, "password_lookup_hash": lookup_hash},
-        fetch=True,
     )
     if rows:
         row = rows[0]
-        if verify_password(row.get("password"), password):
+        if await verify_password_async(row.get("password"), password):
             return row
 
-    legacy_rows = await execute_query(
-        text("""
-            SELECT * FROM fsqr
+    legacy_rows = await fetch_all(
+        statement(f"""
+            SELECT {columns} FROM fsqr
             WHERE id = :id
               AND password_lookup_hash IS NULL
-        """),
+        """),  # noqa: S608
         {"id": id_val},
-        fetch=True,
     )
     for row in legacy_rows:
-        if not verify_password(row.get("password"), password):
+        if not await verify_password_async(row.get("password"), password):
             continue
+        await _backfill_password_lookup_hash(row.get("secure_id"), lookup_hash)
         return row
     return None
+
+
+async def _backfill_password_lookup_hash(secure_id, lookup_hash: str) -> None:
+    # 旧行はログイン成功時にだけ索引用ハッシュを埋め、次回から 1 行の索引検索で済ませる。
+    if not secure_id:
+        return
+    try:
+        await execute_query(
+            statement("""
+                UPDATE fsqr SET password_lookup_hash = :password_lookup_hash
+                WHERE secure_id = :secure_id AND password_lookup_hash IS NULL
+            """),
+            {"password_lookup_hash": lookup_hash, "secure_id": secure_id},
+        )
+    except Exception:
+        logger.warning("Failed to backfill FSQR password lookup hash", exc_info=True)
@@ -0,0 +1,269 @@
+"""FSQR の分割・再開可能アップロードのセッション。
+
+1 つのセッションは FSQR_UPLOAD_DIR に置いた 3 つのファイルで表す。
+
+- ``.<id>.upload.json``: ファイル名・形式・サイズ・チャンク長・所有者（作成時に 1 回だけ書く）
+- ``.<id>.uploading``: 宣言されたサイズで作った本体。各チャンクを自分の位置へ直接書く
+- ``.<id>.chunks``: チャンクごとに 1 バイトの受信済みフラグ
+
+チャンクはそれぞれ別の位置に pwrite するだけなので、並列に届いても、別のワーカーが
+受けても競合しない。状態を Redis に持たないため、本体と同じボリュームを見ている
+プロセスならどこからでも再開できる。完了時は目録を ``.finalizing`` へ rename して
+二重の確定を防ぎ、書き込み中のチャンク（``.chunks`` の共有ロック）が終わるのを
+待ってから、本体を通常のアップロードと同じ経路で確定させる。
+
+放置されたセッションは、最後にチャンクを受けてから FSQR_UPLOAD_SESSION_TTL_SECONDS を
+過ぎたら scheduler が remove_stale_upload_files で消す。
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{32}$")
+
+_MANIFEST_SUFFIX = ".upload.json"
+_CLAIMED_SUFFIX = ".finalizing"
+_CHUNKS_SUFFIX = ".chunks"
+_DATA_SUFFIX = ".uploading"
+# scheduler が掃除する一時ファイル（upload_streaming の .uploading も含む）
+_TEMP_SUFFIXES = (_MANIFEST_SUFFIX, _CLAIMED_SUFFIX, _CHUNKS_SUFFIX, _DATA_SUFFIX)
+
+
+def _path(upload_dir: str, session_id: str, suffix: str) -> str:
+    return os.path.join(upload_dir, f".{session_id}{suffix}")
+
+
+def data_path(upload_dir: str, session_id: str) -> str:
+    return _path(upload_dir, session_id, _DATA_SUFFIX)
+
+
+def chunk_count(session: dict[str, Any]) -> int:
+    return -(-int(session["size"]) // int(session["chunk_size"]))
+
+
+def chunk_range(session: dict[str, Any], index: int) -> Optional[tuple[int, int]]:
+    """チャンク番号の (開始位置, 長さ)。範囲外なら None。"""
+    if index < 0 or index >= chunk_count(session):
+        return None
+    offset = index * int(session["chunk_size"])
+    return offset, min(int(session["chunk_size"]), int(session["size"]) - offset)
+
+
+def create_session(
+    upload_dir: str,
+    *,
+    filename: str,
+    file_type: str,
+    size: int,
+    chunk_size: int,
+    owner: str,
+) -> dict[str, Any]:
+    session_id = secrets.token_urlsafe(24)
+    session = {
+        "session_id": session_id,
+        "filename": filename,
+        "file_type": file_type,
+        "size": size,
+        "chunk_size": chunk_size,
+        "owner": owner,
+        "created_at": int(time.time()),
+    }
+    # 本体は疎なファイルとして確保するだけで、まだディスクを消費しない。
+    with open(data_path(upload_dir, session_id), "wb") as handle:
+        handle.truncate(size)
+    with open(_path(upload_dir, session_id, _CHUNKS_SUFFIX), "wb") as handle:
+        handle.write(bytes(chunk_count(session)))
+    manifest = _path(upload_dir, session_id, _MANIFEST_SUFFIX)
+    with open(manifest + ".tmp", "w", encoding="utf-8") as handle:
+        json.dump(session, handle)
+    os.replace(manifest + ".tmp", manifest)
+    return session
+
+
+def load_session(upload_dir: str, session_id: str) -> Optional[dict[str, Any]]:
+    if not SESSION_ID_RE.match(session_id or ""):
+        return None
+    return _read_manifest(_path(upload_dir, session_id, _MANIFEST_SUFFIX))
+
+
+def _read_manifest(path: str) -> Optional[dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+class ChunkWriter:
+    """1 つのチャンクの書き込み。open_chunk で開き、close まで共有ロックを持つ。
+
+    確定処理（claim_complete_session）は ``.chunks`` の排他ロックを取ってから
+    受信済みの印を確かめるので、書き込み中のチャンクがあれば終わるまで待つ。
+    """
+
+    def __init__(self, lock_fd: int, data_fd: int, index: int):
+        self._lock_fd = lock_fd
+        self._data_fd = data_fd
+        self._index = index
+
+    def write(self, data: bytes, position: int) -> None:
+        os.pwrite(self._data_fd, data, position)
+
+    def mark_received(self) -> None:
+        """本体を書き終え、内容を確認したチャンクに受信済みの印を付ける。"""
+        os.pwrite(self._lock_fd, b"\x01", self._index)
+
+    def close(self) -> None:
+        os.close(self._data_fd)
+        # ロックは fd を閉じると外れる。
+        os.close(self._lock_fd)
+
+
+def open_chunk(
+    upload_dir: str, session: dict[str, Any], index: int
+) -> Optional[ChunkWriter]:
+    """チャンクを書き込むために本体を開く。確定処理が始まっていれば None。
+
+    書き始める前に受信済みの印を外す。再送が途中で壊れても、以前の内容を
+    受信済みのまま上書きしたことにはならない。
+    """
+    session_id = session["session_id"]
+    lock_fd = os.open(_path(upload_dir, session_id, _CHUNKS_SUFFIX), os.O_WRONLY)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        # 共有ロックを取った後に確かめる。目録が .finalizing に移っていれば、
+        # 確定処理が印を読む（か、公開した）後なので書かない。
+        if not os.path.exists(_path(upload_dir, session_id, _MANIFEST_SUFFIX)):
+            os.close(lock_fd)
+            return None
+        os.pwrite(lock_fd, b"\x00", index)
+        data_fd = os.open(data_path(upload_dir, session_id), os.O_WRONLY)
+    except BaseException:
+        os.close(lock_fd)
+        raise
+    return ChunkWriter(lock_fd, data_fd, index)
+
+
+def _wait_for_chunk_writers(upload_dir: str, session_id: str) -> None:
+    """書き込み中のチャンク（open_chunk の共有ロック）が全て閉じるまで待つ。"""
+    try:
+        fd = os.open(_path(upload_dir, session_id, _CHUNKS_SUFFIX), os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    finally:
+        os.close(fd)
+
+
+def received_chunks(upload_dir: str, session: dict[str, Any]) -> list[int]:
+    try:
+        with open(_path(upload_dir, session["session_id"], _CHUNKS_SUFFIX), "rb") as f:
+            flags = f.read()
+    except OSError:
+        return []
+    return [index for index, flag in enumerate(flags) if flag]
+
+
+def missing_chunks(upload_dir: str, session: dict[str, Any]) -> list[int]:
+    received = set(received_chunks(upload_dir, session))
+    return [index for index in range(chunk_count(session)) if index not in received]
+
+
+def claim_session(upload_dir: str, session_id: str) -> Optional[dict[str, Any]]:
+    """確定処理のためにセッションを 1 つの呼び出しだけが取れるよう確保する。"""
+    if not SESSION_ID_RE.match(session_id or ""):
+        return None
+    claimed = _path(upload_dir, session_id, _CLAIMED_SUFFIX)
+    try:
+        os.rename(_path(upload_dir, session_id, _MANIFEST_SUFFIX), claimed)
+    except OSError:
+        return None
+    return _read_manifest(claimed)
+
+
+def release_session(upload_dir: str, session_id: str) -> None:
+    """claim_session した目録を戻し、チャンクの送信を続けられるようにする。"""
+    try:
+        os.rename(
+            _path(upload_dir, session_id, _CLAIMED_SUFFIX),
+            _path(upload_dir, session_id, _MANIFEST_SUFFIX),
+        )
+    except OSError:
+        logger.warning("Failed to release FSQR upload session: %s", session_id)
+
+
+def claim_complete_session(
+    upload_dir: str, session_id: str
+) -> tuple[Optional[dict[str, Any]], list[int]]:
+    """確定のためにセッションを確保し、届いていないチャンクを確認する。
+
+    (確保したセッション, 未着のチャンク) を返す。別の呼び出しが確保済みなら
+    (None, [])。未着のチャンクがあれば確保を戻して (None, 未着) を返す。
+    """
+    session = claim_session(upload_dir, session_id)
+    if not session:
+        return None, []
+    # 確保より前に書き始めたチャンクが終わってから印を読む。確保後に来た
+    # チャンクは open_chunk が断るので、以降は本体が書き換わらない。
+    _wait_for_chunk_writers(upload_dir, session_id)
+    missing = missing_chunks(upload_dir, session)
+    if missing:
+        release_session(upload_dir, session_id)
+        return None, missing
+    return session, []
+
+
+def discard_session(upload_dir: str, session_id: str) -> None:
+    """セッションのファイルを全て消す（確定済みで本体が無い場合も呼んでよい）。"""
+    for suffix in _TEMP_SUFFIXES:
+        _remove(_path(upload_dir, session_id, suffix))
+
+
+def remove_stale_upload_files(
+    upload_dir: str, max_age_seconds: int, now: Optional[float] = None
+) -> int:
+    """最後の更新から max_age_seconds を過ぎた一時ファイルをセッション単位で消す。"""
+    now = time.time() if now is None else now
+    last_activity: dict[str, float] = {}
+    try:
+        entries = list(os.scandir(upload_dir))
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.name.startswith(".") or not entry.name.endswith(_TEMP_SUFFIXES):
+            continue
+        session_id = entry.name[1:].split(".", 1)[0]
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        last_activity[session_id] = max(mtime, last_activity.get(session_id, 0.0))
+    removed = 0
+    for session_id, mtime in last_activity.items():
+        if now - mtime < max_age_seconds:
+            continue
+        discard_session(upload_dir, session_id)
+        removed += 1
+    if removed:
+        logger.info("Removed %d stale FSQR upload session(s)", removed)
+    return removed
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.warning("Failed to remove FSQR upload temp file: %s", path)
@@ -3,6 +3,7 @@ from starlette.responses import RedirectResponse
 
 import room_access
 from i18n import is_language_query_only
+from request_memo import request_memo
 from . import group_data
 
 GROUP_ROOM_ACCESS_SESSION_KEY = "group_room_access"
@@ -19,6 +20,7 @@ async def get_room_if_valid(room_id, password):
     return await group_data.get_data_by_room_credentials(room_id, password)
 
 
+@request_memo
 async def get_room_if_active(room_id):
     rows = await group_data.get_data(room_id)
     return rows[0] if rows else None
@@ -5,11 +5,22 @@ import logging
 from typing import Optional
 
 import log_config  # noqa: F401
-from sqlalchemy import text
-
-from password_security import hash_password, verify_password
-from database import execute_query
-from cache_utils import cache_data, invalidate_cache_entry, invalidate_cache_prefix
+import room_directory
+from sql_statements import statement
+
+from password_security import (
+    hash_password_async,
+    password_lookup_hash,
+    verify_password_async,
+)
+from database import execute_query, fetch_all
+from cache_utils import (
+    cache_data,
+    cache_entry,
+    invalidate_cache_entries,
+    resource_tag,
+    tag_results_by,
+)
 from .group_realtime import notify_group_room_closed
 from .group_storage import iter_room_folders
 
@@ -20,17 +31,30 @@ BASE_DIR = os.path.dirname(__file__)
 QR = os.path.join(BASE_DIR, "static/qrcode")
 STATIC = os.path.join(BASE_DIR, "static/upload")
 
+# 用途ごとに読む列を固定する（SELECT * で password まで運ばないため）。
+# ルーム画面・有効判定用のメタ情報（秘密の列を含まない）
+_META_COLUMNS = "time, id, room_id, retention_hours, expires_at"
+# 管理画面・パスワード照合用の生レコード（ハッシュ済み password を含む）
+_RECORD_COLUMNS = f"{_META_COLUMNS}, password"
+# 一覧・一括削除用
+_LIST_COLUMNS = "time, id, room_id, expires_at"
+
+
+def hash_password_lookup(id_val: str, password: str) -> str:
+    return password_lookup_hash("group", id_val, password)
+
 
 # グループの部屋の作成
 async def create_room(id, password, room_id, retention_hours=24):
-    hashed_password = hash_password(password)
-    query = text("""
+    hashed_password = await hash_password_async(password)
+    query = statement("""
         INSERT INTO room (
-            time, id, password, room_id, retention_days, retention_hours, expires_at
+            time, id, password, password_lookup_hash, room_id,
+            retention_days, retention_hours, expires_at
         )
         VALUES (
-            NOW(), :id, :password, :room_id, 1, :retention_hours,
-            DATE_ADD(NOW(), INTERVAL :retention_hours HOUR)
+            NOW(), :id, :password, :password_lookup_hash, :room_id,
+            1, :retention_hours, DATE_ADD(NOW(), INTERVAL :retention_hours HOUR)
         )
     """)
     await execute_query(
@@ -38,41 +62,82 @@ async def create_room(id, password, room_id, retention_hours=24):
         {
             "id": id,
             "password": hashed_password,
+            "password_lookup_hash": hash_password_lookup(id, password),
             "room_id": room_id,
             "retention_hours": retention_hours,
         },
     )
-    await invalidate_cache_entry(pich_room_id, id, password)
-    await invalidate_cache_entry(get_data, room_id)
-    await invalidate_cache_entry(get_all)
+    await room_directory.register_room(
+        service_key="group",
+        id_val=id,
+        password=password,
+        hashed_password=hashed_password,
+        resource_id=room_id,
+        retention_hours=retention_hours,
+    )
+    await invalidate_cache_entries(
+        cache_entry(pich_room_id, id, password),
+        cache_entry(get_data, room_id),
+        cache_entry(get_all),
+    )
 
 
 # ログイン処理
 async def pich_room_id_direct(id, password) -> Optional[str]:
-    query = text("""
-        SELECT room_id, password FROM room WHERE id = :id
-    """)
-    result = await execute_query(query, {"id": id}, fetch=True)
-    for row in result:
+    lookup_hash = hash_password_lookup(id, password)
+    rows = await fetch_all(
+        statement("""
+            SELECT room_id, password FROM room
+            WHERE id = :id AND password_lookup_hash = :password_lookup_hash
+            LIMIT 1
+        """),
+        {"id": id, "password_lookup_hash": lookup_hash},
+    )
+    if rows and await verify_password_async(rows[0].get("password"), password):
+        return rows[0]["room_id"]
+
+    # 索引用ハッシュ導入前の行だけを従来通り総当たりで検証し、成功したら埋める。
+    legacy_rows = await fetch_all(
+        statement("""
+            SELECT room_id, password FROM room
+            WHERE id = :id AND password_lookup_hash IS NULL
+        """),
+        {"id": id},
+    )
+    for row in legacy_rows:
         stored_password = row.get("password")
-        if not verify_password(stored_password, password):
+        if not await verify_password_async(stored_password, password):
             continue
+        await _backfill_password_lookup_hash(row["room_id"], lookup_hash)
         return row["room_id"]
     return None
 
 
-@cache_data(ttl=60)
+async def _backfill_password_lookup_hash(room_id, lookup_hash: str) -> None:
+    try:
+        await execute_query(
+            statement("""
+                UPDATE room SET password_lookup_hash = :password_lookup_hash
+                WHERE room_id = :room_id AND password_lookup_hash IS NULL
+            """),
+            {"password_lookup_hash": lookup_hash, "room_id": room_id},
+        )
+    except Exception:
+        logger.warning("Failed to backfill Group password lookup hash", exc_info=True)
+
+
+@cache_data(ttl=60, tags=tag_results_by("group", "room_id"), cache_negative=True)
 async def pich_room_id(id, password):
     return await pich_room_id_direct(id, password)
 
 
-# データベースから任意のIDのデータを取り出す
-async def get_data_direct(secure_id):
-    query = text("""
-        SELECT * FROM room WHERE room_id = :secure_id
-    """)
-    result = await execute_query(query, {"secure_id": secure_id}, fetch=True)
-    return result
+# データベースから任意のIDのデータを取り出す（既定は password を含む生のレコード）
+async def get_data_direct(secure_id, columns: str = _RECORD_COLUMNS):
+    # 差し込むのは定数の列一覧のみ。 / Only a constant column list is interpolated.
+    query = statement(f"""
+        SELECT {columns} FROM room WHERE room_id = :secure_id
+    """)  # noqa: S608
+    return await fetch_all(query, {"secure_id": secure_id})
 
 
 async def get_data_by_room_credentials(room_id: str, password: str):
@@ -81,27 +146,27 @@ async def get_data_by_room_credentials(room_id: str, password: str):
         return None
     record = rows[0]
     stored_password = record.get("password")
-    if not verify_password(stored_password, password):
+    if not await verify_password_async(stored_password, password):
         return None
     return record
 
 
-@cache_data(ttl=60, strip_keys=("password",))
+@cache_data(ttl=60, cache_negative=True)
 async def get_data(secure_id):
-    return await get_data_direct(secure_id)
+    return await get_data_direct(secure_id, _META_COLUMNS)
 
 
-# 全てのデータを取得する
-@cache_data(ttl=300, strip_keys=("password",))
+# 全てのデータを取得する（60 秒を過ぎたら古い一覧を返しつつ裏で更新する）
+@cache_data(ttl=60, stale_ttl=240)
 async def get_all():
     return await get_all_direct()
 
 
-async def get_all_direct():
-    query = text("""
-        SELECT * FROM room ORDER BY suji DESC
-    """)
-    return await execute_query(query, fetch=True)
+async def get_all_direct(replica=True):
+    query = statement(f"""
+        SELECT {_LIST_COLUMNS} FROM room ORDER BY suji DESC
+    """)  # noqa: S608
+    return await fetch_all(query, replica=replica)
 
 
 # アップロードされたファイルとメタ情報の削除
@@ -135,7 +200,7 @@ async def remove_data(secure_id):
         return False
 
     # データベースから該当ルームのレコードを削除
-    query = text("""
+    query = statement("""
         DELETE FROM room WHERE room_id = :secure_id
     """)
     await execute_query(query, {"secure_id": secure_id})
@@ -155,23 +220,22 @@ async def remove_data(secure_id):
                 exc_info=True,
             )
 
-    async def _invalidate_caches():
-        await invalidate_cache_entry(get_data, secure_id)
-        await invalidate_cache_entry(get_all)
-        if room_record:
-            await invalidate_cache_prefix(pich_room_id)
-
     await asyncio.gather(
         _revoke_links(),
         notify_group_room_closed(secure_id, code=1001),
-        _invalidate_caches(),
+        invalidate_cache_entries(
+            cache_entry(get_data, secure_id),
+            cache_entry(get_all),
+            tags=[resource_tag("group", secure_id)] if room_record else (),
+        ),
+        room_directory.remove_room("group", secure_id),
     )
     return True
 
 
 # 全てのデータを削除
 async def all_remove():
-    rooms = await get_all_direct()
+    rooms = await get_all_direct(replica=False)
     all_removed = True
 
     for room in rooms:
@@ -186,12 +250,12 @@ async def all_remove():
 # 1週間以上経過したルームを削除する関数
 async def remove_expired_rooms():
     # 1週間以上前のルームを取得するクエリ（MySQLの場合）
-    query = text("""
+    query = statement("""
         SELECT room_id
         FROM room
         WHERE expires_at <= NOW()
     """)
-    expired_rooms = await execute_query(query, fetch=True)
+    expired_rooms = await fetch_all(query, replica=True)
     for room in expired_rooms:
         room_id = room.get("room_id")
         if room_id:
@@ -8,7 +8,6 @@ from fastapi import APIRouter, Request
 from pydantic import ValidationError
 from sqlalchemy.exc import IntegrityError
 from starlette.responses import RedirectResponse
-from werkzeug.utils import secure_filename
 
 from api_response import api_error_response, api_ok_response
 from models import RoomCreateInput
@@ -45,7 +44,7 @@ from .group_common import (
     remember_group_room_access,
 )
 from .group_responses import room_msg
-from .group_storage import UPLOAD_FOLDER
+from .group_storage import UPLOAD_FOLDER, room_folder
 
 logger = logging.getLogger(__name__)
 ROOM_ID_ATTEMPTS = 10
@@ -258,7 +257,7 @@ def register_group_create_room_route(router: APIRouter):  # noqa: C901
 
         password = generate_room_password()
 
-        folder_path = os.path.join(UPLOAD_FOLDER, secure_filename(room_id))
+        folder_path = room_folder(room_id, root=UPLOAD_FOLDER)
         try:
             os.makedirs(folder_path, exist_ok=True)
         except OSError:
@@ -2,6 +2,7 @@ import os
 
 from werkzeug.utils import secure_filename
 
+import storage_layout
 from settings import BASE_DIR, GROUP_UPLOAD_DIR
 
 
@@ -20,21 +21,30 @@ def is_safe_path(base_path, target_path):
 
 
 def room_folder(room_id, *, root=None):
-    return os.path.join(root or UPLOAD_FOLDER, secure_filename(str(room_id)))
+    """ルームのファイルを新しく置くフォルダ（ルーム ID で振り分けた位置）。"""
+    name = secure_filename(str(room_id))
+    return storage_layout.sharded_path(root or UPLOAD_FOLDER, name, name)
 
 
 def iter_room_folders(room_id, *, primary_root=None, include_legacy=True):
-    roots = [primary_root or UPLOAD_FOLDER]
+    # 振り分け後の位置 → 移行前の直下 → 旧保存場所の順に探す。
+    primary_root = primary_root or UPLOAD_FOLDER
+    name = secure_filename(str(room_id))
+    candidates = [
+        (primary_root, room_folder(room_id, root=primary_root)),
+        (primary_root, storage_layout.flat_path(primary_root, name)),
+    ]
     if include_legacy:
-        roots.append(LEGACY_UPLOAD_FOLDER)
+        candidates.append(
+            (LEGACY_UPLOAD_FOLDER, storage_layout.flat_path(LEGACY_UPLOAD_FOLDER, name))
+        )
 
     seen = set()
-    for root in roots:
-        root_abs = os.path.abspath(root)
-        if root_abs in seen:
+    for root, folder in candidates:
+        folder_abs = os.path.abspath(folder)
+        if folder_abs in seen:
             continue
-        seen.add(root_abs)
-        folder = room_folder(room_id, root=root)
+        seen.add(folder_abs)
         if is_safe_path(root, folder):
             yield root, folder
 
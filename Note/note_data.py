@@ -4,11 +4,23 @@ import logging
 from typing import Optional
 
 import log_config  # noqa: F401
-from sqlalchemy import text
-
-from password_security import hash_password, verify_password
-from database import db_session, execute_query
-from cache_utils import cache_data, invalidate_cache_entry, invalidate_cache_prefix
+import room_directory
+from request_memo import request_memo
+from sql_statements import statement
+
+from password_security import (
+    hash_password_async,
+    password_lookup_hash,
+    verify_password_async,
+)
+from database import db_session, execute_query, fetch_all, fetch_one
+from cache_utils import (
+    cache_data,
+    cache_entry,
+    invalidate_cache_entries,
+    resource_tag,
+    tag_results_by,
+)
 
 # ログ設定
 logger = logging.getLogger(__name__)
@@ -24,6 +36,7 @@ CREATE TABLE IF NOT EXISTS note_room(
   time DATETIME NOT NULL,
   id VARCHAR(255) NOT NULL,
   password VARCHAR(255) NOT NULL,
+  password_lookup_hash VARCHAR(64) NULL,
   room_id VARCHAR(255) NOT NULL,
   retention_days INT NOT NULL DEFAULT 1,
   retention_hours INT NOT NULL DEFAULT 24,
@@ -34,6 +47,7 @@ CREATE TABLE IF NOT EXISTS note_room(
   UNIQUE KEY uq_note_room_room_id (room_id),
   UNIQUE KEY uq_note_room_share_token_hash (share_token_hash),
   INDEX idx_note_room_id_password (id, password),
+  INDEX idx_note_room_id_password_lookup (id, password_lookup_hash),
   INDEX idx_note_room_room_id_password (room_id, password),
   INDEX idx_note_room_time (time),
   INDEX idx_note_room_expires_status (status, expires_at)
@@ -62,6 +76,11 @@ ALTER TABLE note_room
 ADD INDEX idx_note_room_room_id_password (room_id, password)
 """  # noqa: S105
 
+ADD_NOTE_ROOM_IDX_ID_PASSWORD_LOOKUP = """
+ALTER TABLE note_room
+ADD INDEX idx_note_room_id_password_lookup (id, password_lookup_hash)
+"""  # noqa: S105
+
 ADD_NOTE_ROOM_IDX_TIME = """
 ALTER TABLE note_room
 ADD INDEX idx_note_room_time (time)
@@ -172,6 +191,11 @@ async def ensure_tables():
         "share_token_hash",
         "ALTER TABLE note_room ADD COLUMN share_token_hash VARCHAR(64) DEFAULT NULL",
     )
+    await ensure_column(
+        "note_room",
+        "password_lookup_hash",
+        "ALTER TABLE note_room ADD COLUMN password_lookup_hash VARCHAR(64) NULL",
+    )
     await ensure_column(
         "note_content",
         "version",
@@ -205,6 +229,11 @@ async def ensure_tables():
         "idx_note_room_room_id_password",
         ADD_NOTE_ROOM_IDX_ROOM_ID_PASSWORD,
     )
+    await ensure_index(
+        "note_room",
+        "idx_note_room_id_password_lookup",
+        ADD_NOTE_ROOM_IDX_ID_PASSWORD_LOOKUP,
+    )
     await ensure_index("note_room", "idx_note_room_time", ADD_NOTE_ROOM_IDX_TIME)
     await ensure_index(
         "note_room",
@@ -223,6 +252,10 @@ def hash_share_token(token: str) -> str:
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
 
+def hash_password_lookup(id_val: str, password: str) -> str:
+    return password_lookup_hash("note", id_val, password)
+
+
 # ────────────────────────────────────────────
 # ノートルーム作成
 # ────────────────────────────────────────────
@@ -239,44 +272,56 @@ async def create_room(
     initial_content を渡すと、ルーム作成と同じトランザクションで本文を保存する。
     LP の下書きをそのまま引き継ぐ用途で使う。
     """
-    hashed_password = hash_password(password)
+    hashed_password = await hash_password_async(password)
     async with db_session.begin():
         await db_session.execute(
-            text("""
+            statement("""
             INSERT INTO note_room(
-                time, id, password, room_id, retention_days, retention_hours,
-                expires_at, status, share_token_hash
+                time, id, password, password_lookup_hash, room_id, retention_days,
+                retention_hours, expires_at, status, share_token_hash
             )
             VALUES(
-                NOW(), :i, :p, :r, 1, :retention,
+                NOW(), :i, :p, :h, :r, 1, :retention,
                 DATE_ADD(NOW(), INTERVAL :retention HOUR), 'active', :share_token_hash
             )
             """),
             {
                 "i": id_,
                 "p": hashed_password,
+                "h": hash_password_lookup(id_, password),
                 "r": room_id,
                 "retention": retention_hours,
                 "share_token_hash": share_token_hash,
             },
         )
         await db_session.execute(
-            text("""
+            statement("""
             INSERT INTO note_content(room_id, content, updated_at, version)
             VALUES(:r, :c, NOW(6), 0)
             """),
             {"r": room_id, "c": initial_content or ""},
         )
-    await invalidate_cache_entry(get_room_meta, room_id)
-    await invalidate_cache_entry(get_room_meta, room_id, password=password)
-    await invalidate_cache_entry(pick_room_id, id_, password)
+    await room_directory.register_room(
+        service_key="note",
+        id_val=id_,
+        password=password,
+        hashed_password=hashed_password,
+        resource_id=room_id,
+        retention_hours=retention_hours,
+    )
+    await invalidate_cache_entries(
+        cache_entry(get_room_meta, room_id),
+        cache_entry(get_room_meta, room_id, password=password),
+        cache_entry(pick_room_id, id_, password),
+    )
 
 
 # ────────────────────────────────────────────
 # ルームメタ情報取得
 # ────────────────────────────────────────────
+@request_memo
 async def get_room_meta_direct(room_id, password=None):
-    rows = await execute_query(
+    row = await fetch_one(
         """
         SELECT room_id, id, password, time, retention_hours, expires_at, status, deleted_at
         FROM note_room
@@ -285,26 +330,24 @@ async def get_room_meta_direct(room_id, password=None):
           AND expires_at > NOW()
         """,
         {"r": room_id},
-        fetch=True,
     )
-    if not rows:
+    if not row:
         return None
-    row = rows[0]
     if password is None:
         return row
     stored_password = row.get("password")
-    if not verify_password(stored_password, password):
+    if not await verify_password_async(stored_password, password):
         return None
     return row
 
 
-@cache_data(ttl=60, strip_keys=("password",))
+@cache_data(ttl=60, strip_keys=("password",), tags=tag_results_by("note", "room_id"))
 async def get_room_meta(room_id, password=None):
     return await get_room_meta_direct(room_id, password=password)
 
 
 async def get_room_meta_by_share_token_hash(share_token_hash: str):
-    rows = await execute_query(
+    return await fetch_one(
         """
         SELECT room_id, id, time, retention_hours, expires_at, status, deleted_at
         FROM note_room
@@ -313,29 +356,49 @@ async def get_room_meta_by_share_token_hash(share_token_hash: str):
           AND expires_at > NOW()
         """,
         {"h": share_token_hash},
-        fetch=True,
     )
-    return rows[0] if rows else None
 
 
 # ────────────────────────────────────────────
 # ID とパスワードで room_id を取得
 # ────────────────────────────────────────────
 async def pick_room_id_direct(id_, password) -> Optional[str]:
-    rows = await execute_query(
-        "SELECT room_id, password FROM note_room WHERE id=:i",
+    lookup_hash = hash_password_lookup(id_, password)
+    rows = await fetch_all(
+        "SELECT room_id, password FROM note_room WHERE id=:i AND password_lookup_hash=:h "
+        "LIMIT 1",
+        {"i": id_, "h": lookup_hash},
+    )
+    if rows and await verify_password_async(rows[0].get("password"), password):
+        return rows[0]["room_id"]
+
+    # 索引用ハッシュ導入前の行だけを従来通り総当たりで検証し、成功したら埋める。
+    legacy_rows = await fetch_all(
+        "SELECT room_id, password FROM note_room WHERE id=:i "
+        "AND password_lookup_hash IS NULL",
         {"i": id_},
-        fetch=True,
     )
-    for row in rows:
+    for row in legacy_rows:
         stored_password = row.get("password")
-        if not verify_password(stored_password, password):
+        if not await verify_password_async(stored_password, password):
             continue
+        await _backfill_password_lookup_hash(row["room_id"], lookup_hash)
         return row["room_id"]
     return None
 
 
-@cache_data(ttl=60)
+async def _backfill_password_lookup_hash(room_id, lookup_hash: str) -> None:
+    try:
+        await execute_query(
+            "UPDATE note_room SET password_lookup_hash=:h "
+            "WHERE room_id=:r AND password_lookup_hash IS NULL",
+            {"h": lookup_hash, "r": room_id},
+        )
+    except Exception:
+        logger.warning("Failed to backfill Note password lookup hash", exc_info=True)
+
+
+@cache_data(ttl=60, tags=tag_results_by("note", "room_id"), cache_negative=True)
 async def pick_room_id(id_, password):
     return await pick_room_id_direct(id_, password)
 
@@ -347,8 +410,9 @@ pich_room_id = pick_room_id
 # ────────────────────────────────────────────
 # コンテンツ取得 or 初期レコード作成
 # ────────────────────────────────────────────
+@request_memo
 async def get_row(room_id):
-    rows = await execute_query(
+    return await fetch_one(
         """
         SELECT nc.room_id, nc.content, nc.updated_at, nc.version
         FROM note_content nc
@@ -358,11 +422,7 @@ async def get_row(room_id):
           AND nr.expires_at > NOW()
         """,
         {"r": room_id},
-        fetch=True,
     )
-    if rows:
-        return rows[0]
-    return None
 
 
 # get_row のエイリアス（他プログラム互換）
@@ -373,7 +433,7 @@ fetch_note = get_row
 # コンテンツ保存
 # ────────────────────────────────────────────
 async def save_content(room_id, content, expected_version):
-    query = text("""
+    query = statement("""
         UPDATE note_content nc
         JOIN note_room nr ON nr.room_id = nc.room_id
         SET nc.content=:c, nc.updated_at=NOW(6), nc.version=nc.version + 1
@@ -416,12 +476,14 @@ async def remove_room(room_id: str, status: str = "deleted") -> None:
                 exc_info=True,
             )
 
-    async def _invalidate_caches():
-        await invalidate_cache_entry(get_room_meta, room_id)
-        await invalidate_cache_prefix(get_room_meta)
-        await invalidate_cache_prefix(pick_room_id)
-
-    await asyncio.gather(_revoke_links(), _invalidate_caches())
+    await asyncio.gather(
+        _revoke_links(),
+        invalidate_cache_entries(
+            cache_entry(get_room_meta, room_id),
+            tags=[resource_tag("note", room_id)],
+        ),
+        room_directory.remove_room("note", room_id),
+    )
 
 
 # ────────────────────────────────────────────
@@ -430,20 +492,20 @@ async def remove_room(room_id: str, status: str = "deleted") -> None:
 async def remove_expired_rooms():
     expired_room_ids = []
     try:
-        rows = await execute_query(
+        rows = await fetch_all(
             """
             SELECT room_id
             FROM note_room
             WHERE status = 'active'
               AND expires_at <= NOW()
             """,
-            fetch=True,
+            replica=True,
         )
         for r in rows:
             rid = r["room_id"]
             async with db_session.begin():
                 await db_session.execute(
-                    text("""
+                    statement("""
                     UPDATE note_room
                     SET status = 'expired', deleted_at = NOW()
                     WHERE room_id = :r AND status = 'active'
@@ -451,7 +513,7 @@ async def remove_expired_rooms():
                     {"r": rid},
                 )
                 await db_session.execute(
-                    text("DELETE FROM note_content WHERE room_id = :r"), {"r": rid}
+                    statement("DELETE FROM note_content WHERE room_id = :r"), {"r": rid}
                 )
             try:
                 from share_links import ServiceKey, revoke_resource_links
@@ -465,11 +527,12 @@ async def remove_expired_rooms():
                     rid,
                     exc_info=True,
                 )
-            await invalidate_cache_entry(get_room_meta, rid)
+            await room_directory.remove_room("note", rid)
+            await invalidate_cache_entries(
+                cache_entry(get_room_meta, rid), tags=[resource_tag("note", rid)]
+            )
             expired_room_ids.append(rid)
             logger.info(f"Expired note room removed: {rid}")
-        await invalidate_cache_prefix(get_room_meta)
-        await invalidate_cache_prefix(pick_room_id)
         return {
             "expired_count": len(expired_room_ids),
             "expired_room_ids": expired_room_ids,
@@ -3,13 +3,36 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Any
-
-from sqlalchemy import text
+import logging
+from typing import Any, Mapping
+
+from request_memo import request_memo
+from sql_statements import statement
+
+import room_directory
+from cache_utils import (
+    cache_data,
+    cache_entry,
+    invalidate_cache_entries,
+    invalidate_cache_tag,
+    resource_tag,
+    tag_results_by,
+)
+from database import (
+    db_session,
+    execute_batches,
+    execute_query,
+    fetch_all,
+    fetch_one,
+    fetch_rows,
+)
+from password_security import (
+    hash_password_async,
+    password_lookup_hash,
+    verify_password_async,
+)
 
-from cache_utils import cache_data, invalidate_cache_prefix
-from database import db_session, execute_query
-from password_security import hash_password, verify_password
+logger = logging.getLogger(__name__)
 
 
 class InvalidTaskDateRange(ValueError):
@@ -37,63 +60,108 @@ def validate_task_date_range(start_date: Any, due_date: Any) -> None:
         raise InvalidTaskDateRange("開始日は期限日以前の日付を指定してください。")
 
 
+def hash_password_lookup(id_: str, password: str) -> str:
+    return password_lookup_hash("task", id_, password)
+
+
 async def create_room(
     id_: str, password: str, room_id: str, retention_hours: int = 24
 ) -> None:
+    hashed_password = await hash_password_async(password)
     await execute_query(
-        text("""
-        INSERT INTO task_room (time, id, password, room_id, retention_days, retention_hours, expires_at, status)
-        VALUES (NOW(), :id, :password, :room_id, 1, :retention_hours,
+        statement("""
+        INSERT INTO task_room (time, id, password, password_lookup_hash, room_id, retention_days, retention_hours, expires_at, status)
+        VALUES (NOW(), :id, :password, :password_lookup_hash, :room_id, 1, :retention_hours,
                 DATE_ADD(NOW(), INTERVAL :retention_hours HOUR), 'active')
     """),
         {
             "id": id_,
-            "password": hash_password(password),
+            "password": hashed_password,
+            "password_lookup_hash": hash_password_lookup(id_, password),
             "room_id": room_id,
             "retention_hours": retention_hours,
         },
     )
-    await invalidate_cache_prefix(get_room_meta)
-    await invalidate_cache_prefix(pick_room_id)
+    await room_directory.register_room(
+        service_key="task",
+        id_val=id_,
+        password=password,
+        hashed_password=hashed_password,
+        resource_id=room_id,
+        retention_hours=retention_hours,
+    )
+    await invalidate_cache_entries(
+        cache_entry(get_room_meta, room_id),
+        cache_entry(pick_room_id, id_, password),
+    )
 
 
+@request_memo
 async def get_room_meta_direct(
     room_id: str, password: str | None = None
 ) -> dict[str, Any] | None:
-    rows = await execute_query(
+    found = await fetch_one(
         """
         SELECT room_id, id, password, time, retention_hours, expires_at, status, deleted_at
         FROM task_room WHERE room_id = :room_id AND status = 'active' AND expires_at > NOW()
     """,
         {"room_id": room_id},
-        fetch=True,
     )
-    if not rows:
+    if not found:
         return None
-    row = dict(rows[0])
-    if password is not None and not verify_password(row.get("password"), password):
+    row = dict(found)
+    if password is not None and not await verify_password_async(
+        row.get("password"), password
+    ):
         return None
     return row
 
 
-@cache_data(ttl=60, strip_keys=("password",))
+@cache_data(
+    ttl=60,
+    stale_ttl=30,
+    strip_keys=("password",),
+    tags=tag_results_by("task", "room_id"),
+)
 async def get_room_meta(room_id: str, password: str | None = None):
     return await get_room_meta_direct(room_id, password)
 
 
 async def pick_room_id_direct(id_: str, password: str) -> str | None:
-    rows = await execute_query(
-        "SELECT room_id, password FROM task_room WHERE id = :id",
+    lookup_hash = hash_password_lookup(id_, password)
+    rows = await fetch_all(
+        "SELECT room_id, password FROM task_room "
+        "WHERE id = :id AND password_lookup_hash = :password_lookup_hash LIMIT 1",
+        {"id": id_, "password_lookup_hash": lookup_hash},
+    )
+    if rows and await verify_password_async(rows[0].get("password"), password):
+        return rows[0]["room_id"]
+
+    # 索引用ハッシュ導入前の行だけを総当たりで検証し、成功した行は次回のために埋める。
+    legacy_rows = await fetch_all(
+        "SELECT room_id, password FROM task_room "
+        "WHERE id = :id AND password_lookup_hash IS NULL",
         {"id": id_},
-        fetch=True,
     )
-    for row in rows:
-        if verify_password(row.get("password"), password):
+    for row in legacy_rows:
+        if await verify_password_async(row.get("password"), password):
+            await _backfill_password_lookup_hash(row["room_id"], lookup_hash)
             return row["room_id"]
     return None
 
 
-@cache_data(ttl=60)
+async def _backfill_password_lookup_hash(room_id: str, lookup_hash: str) -> None:
+    try:
+        await execute_query(
+            "UPDATE task_room SET password_lookup_hash = :password_lookup_hash "
+            "WHERE room_id = :room_id AND password_lookup_hash IS NULL",
+            {"password_lookup_hash": lookup_hash, "room_id": room_id},
+        )
+    except Exception:
+        logger.warning("Failed to backfill Task password lookup hash", exc_info=True)
+
+
+@cache_data(ttl=60, tags=tag_results_by("task", "room_id"), cache_negative=True)
 async def pick_room_id(id_: str, password: str) -> str | None:
     return await pick_room_id_direct(id_, password)
 
@@ -106,8 +174,15 @@ _ITEM_COLUMNS = (
 )
 
 
+_ITEM_FIELDS = tuple(name.strip() for name in _ITEM_COLUMNS.split(","))
+
+
 def _serialize_item(row: Any) -> dict[str, Any]:
-    item = dict(row)
+    # fetch_rows の Row（_ITEM_COLUMNS 順のタプル）はそのまま列名と組にする。
+    if isinstance(row, Mapping):
+        item = dict(row)
+    else:
+        item = dict(zip(_ITEM_FIELDS, row))
     for key in ("created_at", "updated_at"):
         value = item.get(key)
         if value is not None and hasattr(value, "isoformat"):
@@ -122,24 +197,13 @@ def _serialize_item(row: Any) -> dict[str, Any]:
     return item
 
 
-def _named_params(prefix: str, values: list[int]) -> tuple[str, dict[str, Any]]:
-    """IN 句用のプレースホルダを生成する。値は必ずバインドパラメータで渡す。
-
-    Builds ``:prefix_0, :prefix_1`` placeholders so IN clauses stay parameterized.
-    """
-    names = [f"{prefix}_{index}" for index in range(len(values))]
-    placeholders = ", ".join(f":{name}" for name in names)
-    return placeholders, dict(zip(names, values))
-
-
 def _serialize_tag(row: Any) -> dict[str, Any]:
-    tag = dict(row)
-    return {"tag_id": int(tag["tag_id"]), "name": str(tag["name"])}
+    return {"tag_id": int(row["tag_id"]), "name": str(row["name"])}
 
 
 async def list_tags(room_id: str) -> list[dict[str, Any]]:
     """ルームのタグ一覧を、利用中のタスク数付きで返す。"""
-    rows = await execute_query(
+    rows = await fetch_rows(
         """
         SELECT t.tag_id, t.name, COUNT(it.item_id) AS item_count
         FROM task_tag t
@@ -149,11 +213,10 @@ async def list_tags(room_id: str) -> list[dict[str, Any]]:
         ORDER BY t.name
     """,
         {"room_id": room_id},
-        fetch=True,
     )
     return [
-        dict(_serialize_tag(row), item_count=int(dict(row).get("item_count") or 0))
-        for row in (rows or [])
+        {"tag_id": int(tag_id), "name": str(name), "item_count": int(item_count or 0)}
+        for tag_id, name, item_count in (rows or [])
     ]
 
 
@@ -161,26 +224,24 @@ async def _load_item_tags(room_id: str, item_ids: list[int]) -> dict[int, list[d
     """タスク ID ごとのタグ一覧をまとめて取得する（N+1 クエリを避ける）。"""
     if not item_ids:
         return {}
-    placeholders, params = _named_params("item", item_ids)
-    params["room_id"] = room_id
-    rows = await execute_query(
-        # 差し込むのは _named_params が生成したプレースホルダ名だけで、値はバインドで渡す。
-        # Only generated placeholder names are interpolated; values stay bound.
-        f"""
+    rows = await fetch_rows(
+        statement(
+            """
         SELECT it.item_id, t.tag_id, t.name
         FROM task_item_tag it
         JOIN task_tag t ON t.tag_id = it.tag_id
-        WHERE t.room_id = :room_id AND it.item_id IN ({placeholders})
+        WHERE t.room_id = :room_id AND it.item_id IN :item_ids
         ORDER BY t.name
-    """,  # noqa: S608
-        params,
-        fetch=True,
+    """,
+            "item_ids",
+        ),
+        {"room_id": room_id, "item_ids": item_ids},
+        replica=True,
     )
     tags_by_item: dict[int, list[dict]] = {}
-    for row in rows or []:
-        mapping = dict(row)
-        tags_by_item.setdefault(int(mapping["item_id"]), []).append(
-            _serialize_tag(mapping)
+    for item_id, tag_id, name in rows or []:
+        tags_by_item.setdefault(int(item_id), []).append(
+            {"tag_id": int(tag_id), "name": str(name)}
         )
     return tags_by_item
 
@@ -202,7 +263,7 @@ async def create_tag(
     """タグを追加する。同名タグがあれば既存のタグをそのまま返す。"""
     async with db_session.begin():
         result = await db_session.execute(
-            text("""
+            statement("""
             SELECT tag_id, name FROM task_tag WHERE room_id = :room_id AND name = :name
         """),
             {"room_id": room_id, "name": name},
@@ -215,13 +276,15 @@ async def create_tag(
             # ルーム行をロックして同時追加でも上限を超えないようにする。
             # Lock the room row so concurrent creates cannot exceed the limit.
             await db_session.execute(
-                text(
+                statement(
                     "SELECT room_id FROM task_room WHERE room_id = :room_id FOR UPDATE"
                 ),
                 {"room_id": room_id},
             )
             result = await db_session.execute(
-                text("SELECT COUNT(*) AS count FROM task_tag WHERE room_id = :room_id"),
+                statement(
+                    "SELECT COUNT(*) AS count FROM task_tag WHERE room_id = :room_id"
+                ),
                 {"room_id": room_id},
             )
             count_row = result.mappings().first()
@@ -229,7 +292,7 @@ async def create_tag(
                 raise TaskTagLimitReached
 
         result = await db_session.execute(
-            text("""
+            statement("""
             INSERT INTO task_tag (room_id, name, created_at) VALUES (:room_id, :name, NOW(6))
         """),
             {"room_id": room_id, "name": name},
@@ -240,10 +303,9 @@ async def create_tag(
 
 async def rename_tag(room_id: str, tag_id: int, name: str) -> dict[str, Any] | None:
     """タグ名を変更する。同名タグが既にある場合は None を返す。"""
-    rows = await execute_query(
+    rows = await fetch_all(
         "SELECT tag_id FROM task_tag WHERE room_id = :room_id AND name = :name AND tag_id <> :tag_id",
         {"room_id": room_id, "name": name, "tag_id": tag_id},
-        fetch=True,
     )
     if rows:
         return None
@@ -290,45 +352,63 @@ async def _replace_item_tags(room_id: str, item_id: int, tag_ids: list[int]) ->
     ルームをまたいだ紐づけは発生しない。
     """
     await db_session.execute(
-        text("DELETE FROM task_item_tag WHERE item_id = :item_id"),
+        statement("DELETE FROM task_item_tag WHERE item_id = :item_id"),
         {"item_id": item_id},
     )
     if not tag_ids:
         return
-    placeholders, params = _named_params("tag", tag_ids)
-    params.update({"item_id": item_id, "room_id": room_id})
     await db_session.execute(
-        # 同上：プレースホルダ名のみを差し込み、タグ ID はバインドで渡す。
-        # Same as above: only placeholder names are interpolated.
-        text(f"""
+        statement(
+            """
         INSERT INTO task_item_tag (item_id, tag_id)
         SELECT :item_id, tag_id FROM task_tag
-        WHERE room_id = :room_id AND tag_id IN ({placeholders})
-    """),  # noqa: S608
-        params,
+        WHERE room_id = :room_id AND tag_id IN :tag_ids
+    """,
+            "tag_ids",
+        ),
+        {"item_id": item_id, "room_id": room_id, "tag_ids": tag_ids},
     )
 
 
 async def list_items(room_id: str) -> list[dict[str, Any]]:
-    rows = await execute_query(
+    rows = await fetch_rows(
         # 差し込むのは定数の列一覧のみ。 / Only the constant column list is interpolated.
         f"""
         SELECT {_ITEM_COLUMNS}
         FROM task_item WHERE room_id = :room_id ORDER BY FIELD(board_status, 'todo', 'doing', 'done'), position, item_id
     """,  # noqa: S608
         {"room_id": room_id},
-        fetch=True,
+        # 同じリクエストで書き込んだ後は database 側で primary に固定される。
+        replica=True,
     )
     return await _attach_tags(room_id, [_serialize_item(row) for row in (rows or [])])
 
 
 async def count_items(room_id: str) -> int:
-    rows = await execute_query(
+    row = await fetch_one(
         "SELECT COUNT(*) AS count FROM task_item WHERE room_id = :room_id",
         {"room_id": room_id},
-        fetch=True,
     )
-    return int(rows[0]["count"]) if rows else 0
+    return int(row["count"]) if row else 0
+
+
+_INSERT_ITEM = """
+    INSERT INTO task_item (room_id, title, note, board_status, priority, start_date, due_date, position, created_at, updated_at)
+    VALUES (:room_id, :title, :note, :board_status, :priority, :start_date, :due_date, :position, NOW(6), NOW(6))
+"""
+
+
+def _item_row(room_id: str, values: dict[str, Any], position: int) -> dict[str, Any]:
+    return {
+        "room_id": room_id,
+        "title": values["title"],
+        "note": values.get("note") or "",
+        "board_status": values["board_status"],
+        "priority": values.get("priority") or "normal",
+        "start_date": values.get("start_date") or None,
+        "due_date": values.get("due_date") or None,
+        "position": position,
+    }
 
 
 async def create_item(
@@ -341,13 +421,13 @@ async def create_item(
             # Serialize concurrent creates per room so the application limit is
             # enforced atomically. ルーム行をロックして同時追加の上限超過を防ぐ。
             await db_session.execute(
-                text("""
+                statement("""
                 SELECT room_id FROM task_room WHERE room_id = :room_id FOR UPDATE
             """),
                 {"room_id": room_id},
             )
             result = await db_session.execute(
-                text("""
+                statement("""
                 SELECT COUNT(*) AS count FROM task_item WHERE room_id = :room_id
             """),
                 {"room_id": room_id},
@@ -357,7 +437,7 @@ async def create_item(
                 raise TaskItemLimitReached
 
         result = await db_session.execute(
-            text("""
+            statement("""
             SELECT COALESCE(MAX(position), 0) AS last_position FROM task_item
             WHERE room_id = :room_id AND board_status = :board_status FOR UPDATE
         """),
@@ -365,20 +445,7 @@ async def create_item(
         )
         position = int(result.mappings().first()["last_position"]) + 100
         result = await db_session.execute(
-            text("""
-            INSERT INTO task_item (room_id, title, note, board_status, priority, start_date, due_date, position, created_at, updated_at)
-            VALUES (:room_id, :title, :note, :board_status, :priority, :start_date, :due_date, :position, NOW(6), NOW(6))
-        """),
-            {
-                "room_id": room_id,
-                "title": values["title"],
-                "note": values.get("note") or "",
-                "board_status": status,
-                "priority": values.get("priority") or "normal",
-                "start_date": values.get("start_date") or None,
-                "due_date": values.get("due_date") or None,
-                "position": position,
-            },
+            statement(_INSERT_ITEM), _item_row(room_id, values, position)
         )
         item_id = int(result.lastrowid)
         # タグの紐づけも同じ transaction で確定させ、タグだけ欠けた状態を作らない。
@@ -387,19 +454,110 @@ async def create_item(
     return await get_item(room_id, item_id)
 
 
+async def create_items(
+    room_id: str, values_list: list[dict[str, Any]], max_items: int | None = None
+) -> int:
+    """インポート用。複数のタスクを 1 transaction でまとめて追加し、追加件数を返す。
+
+    上限を超える分は追加せずに捨てる。INSERT と タグの紐づけはそれぞれ
+    複数行の VALUES で送るため、件数によらず往復回数は一定になる。
+    """
+    for values in values_list:
+        validate_task_date_range(values.get("start_date"), values.get("due_date"))
+    async with db_session.begin():
+        if max_items is not None:
+            await db_session.execute(
+                statement("""
+                SELECT room_id FROM task_room WHERE room_id = :room_id FOR UPDATE
+            """),
+                {"room_id": room_id},
+            )
+            result = await db_session.execute(
+                statement("""
+                SELECT COUNT(*) AS count FROM task_item WHERE room_id = :room_id
+            """),
+                {"room_id": room_id},
+            )
+            count_row = result.mappings().first()
+            count = int(count_row["count"]) if count_row else 0
+            values_list = values_list[: max(max_items - count, 0)]
+        if not values_list:
+            return 0
+
+        result = await db_session.execute(
+            statement("""
+            SELECT board_status, COALESCE(MAX(position), 0) AS last_position FROM task_item
+            WHERE room_id = :room_id GROUP BY board_status FOR UPDATE
+        """),
+            {"room_id": room_id},
+        )
+        last_positions = {
+            str(row["board_status"]): int(row["last_position"])
+            for row in result.mappings()
+        }
+        # 追加する行はどれも、この位置より後ろに並ぶ。
+        floor = min(
+            last_positions.get(values["board_status"], 0) for values in values_list
+        )
+        rows = []
+        for values in values_list:
+            status = values["board_status"]
+            last_positions[status] = last_positions.get(status, 0) + 100
+            rows.append(_item_row(room_id, values, last_positions[status]))
+        await execute_batches(_INSERT_ITEM, rows)
+        await _link_created_item_tags(room_id, rows, values_list, floor)
+    return len(rows)
+
+
+async def _link_created_item_tags(
+    room_id: str,
+    rows: list[dict[str, Any]],
+    values_list: list[dict[str, Any]],
+    floor: int,
+) -> None:
+    """create_items で追加したタスクへタグを紐づける。同じ transaction 内で使う。
+
+    複数行 INSERT の ID は連番とは限らないため、ロック中に割り当てた
+    (board_status, position) から引き直す。タグ ID は resolve_tag_names で
+    このルームから解決したものだけが渡される。
+    """
+    if not any(values.get("tag_ids") for values in values_list):
+        return
+    result = await db_session.execute(
+        statement("""
+        SELECT item_id, board_status, position FROM task_item
+        WHERE room_id = :room_id AND position > :floor
+    """),
+        {"room_id": room_id, "floor": floor},
+    )
+    item_ids = {
+        (str(row["board_status"]), int(row["position"])): int(row["item_id"])
+        for row in result.mappings()
+    }
+    links = [
+        {"item_id": item_ids[(row["board_status"], row["position"])], "tag_id": tag_id}
+        for row, values in zip(rows, values_list)
+        for tag_id in dict.fromkeys(values.get("tag_ids") or [])
+        if (row["board_status"], row["position"]) in item_ids
+    ]
+    await execute_batches(
+        "INSERT INTO task_item_tag (item_id, tag_id) VALUES (:item_id, :tag_id)",
+        links,
+    )
+
+
 async def get_item(room_id: str, item_id: int) -> dict[str, Any] | None:
-    rows = await execute_query(
+    row = await fetch_one(
         # 差し込むのは定数の列一覧のみ。 / Only the constant column list is interpolated.
         f"""
         SELECT {_ITEM_COLUMNS}
         FROM task_item WHERE room_id = :room_id AND item_id = :item_id
     """,  # noqa: S608
         {"room_id": room_id, "item_id": item_id},
-        fetch=True,
     )
-    if not rows:
+    if not row:
         return None
-    items = await _attach_tags(room_id, [_serialize_item(rows[0])])
+    items = await _attach_tags(room_id, [_serialize_item(row)])
     return items[0]
 
 
@@ -427,10 +585,10 @@ async def update_item(
     if "due_date" in fields:
         fields["due_date"] = fields["due_date"] or None
 
-    # 競合時に返す現在値。タグの付与は transaction の外で行う（execute_query が
-    # 自前で commit / rollback するため、begin() の中からは呼べない）。
+    # 競合時に返す現在値。タグの付与は transaction の外で行う（fetch_all は
+    # 別の接続で読むため、begin() の中から呼ぶと未コミットの変更が見えない）。
     # Holds the current row on a version conflict; tags are attached after the
-    # transaction because execute_query commits on its own.
+    # transaction because fetch_all reads on its own connection.
     conflict: dict[str, Any] | None = None
 
     # Lock the current row so a partial date update is checked against the same
@@ -439,7 +597,7 @@ async def update_item(
     async with db_session.begin():
         result = await db_session.execute(
             # 差し込むのは定数の列一覧のみ。 / Only the constant column list is interpolated.
-            text(f"""
+            statement(f"""
             SELECT {_ITEM_COLUMNS}
             FROM task_item
             WHERE room_id = :room_id AND item_id = :item_id
@@ -465,7 +623,7 @@ async def update_item(
                 params[f"has_{key}"] = key in fields
                 params[key] = fields.get(key)
             await db_session.execute(
-                text("""
+                statement("""
                 UPDATE task_item SET
                   title = CASE WHEN :has_title THEN :title ELSE title END,
                   note = CASE WHEN :has_note THEN :note ELSE note END,
@@ -504,7 +662,7 @@ async def reorder_items(
         return None
     async with db_session.begin():
         result = await db_session.execute(
-            text("""
+            statement("""
             SELECT item_id FROM task_item WHERE room_id = :room_id AND board_status = :board_status FOR UPDATE
         """),
             {"room_id": room_id, "board_status": board_status},
@@ -512,14 +670,23 @@ async def reorder_items(
         existing = {int(row["item_id"]) for row in result.mappings()}
         if existing != set(item_ids):
             return None
-        for index, item_id in enumerate(item_ids, start=1):
-            await db_session.execute(
-                text("""
-                UPDATE task_item SET position = :position, updated_at = NOW(6), version = version + 1
-                WHERE room_id = :room_id AND item_id = :item_id
-            """),
-                {"position": index * 100, "room_id": room_id, "item_id": item_id},
-            )
+        # FIND_IN_SET() が並び順（1 始まり）を返すので、カード数によらず 1 文で更新する。
+        await db_session.execute(
+            statement(
+                """
+            UPDATE task_item
+            SET position = FIND_IN_SET(item_id, :ordered_ids) * 100, updated_at = NOW(6), version = version + 1
+            WHERE room_id = :room_id AND item_id IN :item_ids
+        """,
+                "item_ids",
+            ),
+            {
+                # 整数 ID だけをカンマでつなぐ。
+                "ordered_ids": ",".join(str(int(item_id)) for item_id in item_ids),
+                "room_id": room_id,
+                "item_ids": item_ids,
+            },
+        )
     return [
         item
         for item in await list_items(room_id)
@@ -532,19 +699,19 @@ async def remove_room(room_id: str, status: str = "deleted") -> None:
         "UPDATE task_room SET status = :status, deleted_at = NOW() WHERE room_id = :room_id",
         {"status": status, "room_id": room_id},
     )
+    await room_directory.remove_room("task", room_id)
     try:
         from share_links import ServiceKey, revoke_resource_links
 
         await revoke_resource_links(service_key=ServiceKey.TASK, resource_id=room_id)
     finally:
-        await invalidate_cache_prefix(get_room_meta)
-        await invalidate_cache_prefix(pick_room_id)
+        await invalidate_cache_tag(resource_tag("task", room_id))
 
 
 async def remove_expired_rooms() -> list[str]:
-    rows = await execute_query(
+    rows = await fetch_all(
         "SELECT room_id FROM task_room WHERE status = 'active' AND expires_at <= NOW()",
-        fetch=True,
+        replica=True,
     )
     room_ids = [str(row["room_id"]) for row in rows]
     await asyncio.gather(*(remove_room(room_id, "expired") for room_id in room_ids))
@@ -129,22 +129,35 @@ def register_task_io_routes(router: APIRouter) -> None:  # noqa: C901
                 max=TASK_MAX_ITEMS_PER_ROOM,
             )
 
-        imported_count = 0
         skipped_count = 0
-
+        valid_items = []
         for task_data_raw in tasks:
             try:
                 payload = TaskItemInput.model_validate(_with_tags(task_data_raw))
-                item_values = payload.model_dump(exclude={"tags"})
-                item_values["tag_ids"] = await task_data.resolve_tag_names(
-                    room_id, payload.tags, max_tags=TASK_MAX_TAGS_PER_ROOM
-                )
-                await task_data.create_item(
-                    room_id, item_values, max_items=TASK_MAX_ITEMS_PER_ROOM
-                )
-                imported_count += 1
+                task_data.validate_task_date_range(payload.start_date, payload.due_date)
             except (ValidationError, ValueError, TypeError):
                 skipped_count += 1
+                continue
+            valid_items.append((payload.model_dump(exclude={"tags"}), payload.tags))
+
+        # タグ名はファイル全体でまとめて 1 回だけ解決し、タスクは一括で追加する。
+        tag_names = list(
+            dict.fromkeys(name for _, tags in valid_items for name in tags)
+        )
+        tag_ids: dict[str, int] = {}
+        if tag_names:
+            resolved = await task_data.resolve_tag_names(
+                room_id, tag_names, max_tags=TASK_MAX_TAGS_PER_ROOM
+            )
+            tag_ids = dict(zip(tag_names, resolved))
+        values_list = []
+        for item_values, tags in valid_items:
+            item_values["tag_ids"] = [tag_ids[name] for name in tags if name in tag_ids]
+            values_list.append(item_values)
+        imported_count = await task_data.create_items(
+            room_id, values_list, max_items=TASK_MAX_ITEMS_PER_ROOM
+        )
+        skipped_count += len(values_list) - imported_count
 
         return api_ok_response(
             {"imported_count": imported_count, "skipped_count": skipped_count}
@@ -0,0 +1,83 @@
+"""add password lookup hash to Group / Note / Task rooms
+
+Revision ID: 20261018_0014
+Revises: 20260821_0013
+Create Date: 2026-10-18 00:00:00
+
+FSQR と同じく ID+パスワードの HMAC を索引用に持たせ、ログイン時の scrypt 検証を
+1 回に抑える。既存行は NULL のまま残し、ログイン成功時にアプリ側で埋める
+（expand-only のため Blue-Green 中の旧コードとも共存できる）。
+
+Existing rows stay NULL and are backfilled lazily on successful logins, so the
+migration is expand-only and safe while old and new code run side by side.
+"""
+
+from alembic import op
+
+revision = "20261018_0014"
+down_revision = "20260821_0013"
+branch_labels = None
+depends_on = None
+
+_ALLOWED_TABLES = {"room", "note_room", "task_room"}
+
+
+def upgrade() -> None:
+    for table_name in ("room", "note_room", "task_room"):
+        if not _table_exists(table_name):
+            continue
+        if not _column_exists(table_name, "password_lookup_hash"):
+            op.execute(
+                f"ALTER TABLE {table_name} "
+                "ADD COLUMN password_lookup_hash VARCHAR(64) NULL AFTER password"
+            )
+        index_name = f"idx_{table_name}_id_password_lookup"
+        if not _index_exists(table_name, index_name):
+            op.execute(
+                f"ALTER TABLE {table_name} "
+                f"ADD INDEX {index_name} (id, password_lookup_hash)"
+            )
+
+
+def downgrade() -> None:
+    for table_name in ("task_room", "note_room", "room"):
+        if not _table_exists(table_name):
+            continue
+        index_name = f"idx_{table_name}_id_password_lookup"
+        if _index_exists(table_name, index_name):
+            op.execute(f"ALTER TABLE {table_name} DROP INDEX {index_name}")
+        if _column_exists(table_name, "password_lookup_hash"):
+            op.execute(f"ALTER TABLE {table_name} DROP COLUMN password_lookup_hash")
+
+
+def _table_exists(table_name: str) -> bool:
+    if table_name not in _ALLOWED_TABLES:
+        raise ValueError(f"Unsupported table name: {table_name}")
+    query = (
+        "SELECT COUNT(*) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        f"AND TABLE_NAME = '{table_name}'"
+    )
+    return bool(op.get_bind().exec_driver_sql(query).scalar())
+
+
+def _column_exists(table_name: str, column_name: str) -> bool:
+    if table_name not in _ALLOWED_TABLES or not column_name.isidentifier():
+        raise ValueError("Unsupported table or column")
+    query = (
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        f"AND TABLE_NAME = '{table_name}' AND COLUMN_NAME = '{column_name}'"
+    )
+    return bool(op.get_bind().exec_driver_sql(query).scalar())
+
+
+def _index_exists(table_name: str, index_name: str) -> bool:
+    if table_name not in _ALLOWED_TABLES or not index_name.isidentifier():
+        raise ValueError("Unsupported table or index")
+    query = (
+        "SELECT COUNT(*) FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        f"AND TABLE_NAME = '{table_name}' AND INDEX_NAME = '{index_name}'"
+    )
+    return bool(op.get_bind().exec_driver_sql(query).scalar())
@@ -0,0 +1,79 @@
+"""add cross-service room directory
+
+Revision ID: 20261018_0015
+Revises: 20261018_0014
+Create Date: 2026-10-18 00:00:00
+
+トップページ検索用に、全サービスの有効なルームを 1 つの表にまとめる。
+既存の有効なルームは password_lookup_hash = NULL のまま写し、検索で一致した
+時点でアプリ側が埋める。
+
+Existing active rooms are copied with a NULL lookup hash; the application fills
+it in on the first successful search, as with the per-service lookup columns.
+"""
+
+from alembic import op
+
+revision = "20261018_0015"
+down_revision = "20261018_0014"
+branch_labels = None
+depends_on = None
+
+_ALLOWED_TABLES = {"room_directory", "fsqr", "room", "note_room", "task_room"}
+
+# (service_key, 元テーブル, resource_id 列, 追加の WHERE 条件)
+_BACKFILL_SOURCES = (
+    ("fsqr", "fsqr", "secure_id", ""),
+    ("group", "room", "room_id", ""),
+    ("note", "note_room", "room_id", "AND status = 'active'"),
+    ("task", "task_room", "room_id", "AND status = 'active'"),
+)
+
+
+def upgrade() -> None:
+    if not _table_exists("room_directory"):
+        op.execute("""
+            CREATE TABLE room_directory (
+                suji BIGINT AUTO_INCREMENT PRIMARY KEY,
+                service_key VARCHAR(20) NOT NULL,
+                id VARCHAR(255) NOT NULL,
+                password VARCHAR(255) NOT NULL,
+                password_lookup_hash VARCHAR(64) NULL,
+                resource_id VARCHAR(255) NOT NULL,
+                expires_at DATETIME NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'active',
+                UNIQUE KEY uq_room_directory_resource (service_key, resource_id),
+                INDEX idx_room_directory_lookup (id, password_lookup_hash),
+                INDEX idx_room_directory_expires_at (expires_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+
+    for service_key, table_name, resource_column, extra_where in _BACKFILL_SOURCES:
+        if not _table_exists(table_name):
+            continue
+        op.execute(f"""
+            INSERT IGNORE INTO room_directory (
+                service_key, id, password, password_lookup_hash,
+                resource_id, expires_at, status
+            )
+            SELECT '{service_key}', id, password, NULL,
+                   {resource_column}, expires_at, 'active'
+            FROM {table_name}
+            WHERE expires_at > NOW() {extra_where}
+        """)
+
+
+def downgrade() -> None:
+    if _table_exists("room_directory"):
+        op.execute("DROP TABLE room_directory")
+
+
+def _table_exists(table_name: str) -> bool:
+    if table_name not in _ALLOWED_TABLES:
+        raise ValueError(f"Unsupported table name: {table_name}")
+    query = (
+        "SELECT COUNT(*) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        f"AND TABLE_NAME = '{table_name}'"
+    )
+    return bool(op.get_bind().exec_driver_sql(query).scalar())
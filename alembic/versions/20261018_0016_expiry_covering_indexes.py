@@ -0,0 +1,72 @@
+"""cover FSQR / Group expiry scans with (expires_at, resource id) indexes
+
+Revision ID: 20261018_0016
+Revises: 20261018_0015
+Create Date: 2026-10-18 00:00:00
+
+期限切れの走査は ``SELECT secure_id / room_id ... WHERE expires_at <= NOW()``
+だけを読むため、(expires_at, ID) の索引にすると本体の行を引かずに済む。
+旧来の (expires_at) 単独の索引は新しい索引の先頭と重なるので外す。
+
+The expiry scans only read the resource id, so a composite index answers them
+from the index alone. The single-column index is a prefix of it and is dropped.
+"""
+
+from alembic import op
+
+revision = "20261018_0016"
+down_revision = "20261018_0015"
+branch_labels = None
+depends_on = None
+
+_ALLOWED_TABLES = {"fsqr", "room"}
+
+# (テーブル, 旧索引, 新索引, 新索引の列)
+_INDEXES = (
+    ("fsqr", "idx_fsqr_expires_at", "idx_fsqr_expires_at_secure_id", "secure_id"),
+    ("room", "idx_room_expires_at", "idx_room_expires_at_room_id", "room_id"),
+)
+
+
+def upgrade() -> None:
+    for table_name, old_index, new_index, column in _INDEXES:
+        if not _table_exists(table_name):
+            continue
+        if not _index_exists(table_name, new_index):
+            op.execute(
+                f"ALTER TABLE {table_name} ADD INDEX {new_index} (expires_at, {column})"
+            )
+        if _index_exists(table_name, old_index):
+            op.execute(f"ALTER TABLE {table_name} DROP INDEX {old_index}")
+
+
+def downgrade() -> None:
+    for table_name, old_index, new_index, _ in _INDEXES:
+        if not _table_exists(table_name):
+            continue
+        if not _index_exists(table_name, old_index):
+            op.execute(f"ALTER TABLE {table_name} ADD INDEX {old_index} (expires_at)")
+        if _index_exists(table_name, new_index):
+            op.execute(f"ALTER TABLE {table_name} DROP INDEX {new_index}")
+
+
+def _table_exists(table_name: str) -> bool:
+    if table_name not in _ALLOWED_TABLES:
+        raise ValueError(f"Unsupported table name: {table_name}")
+    query = (
+        "SELECT COUNT(*) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        f"AND TABLE_NAME = '{table_name}'"
+    )
+    return bool(op.get_bind().exec_driver_sql(query).scalar())
+
+
+def _index_exists(table_name: str, index_name: str) -> bool:
+    if table_name not in _ALLOWED_TABLES or not index_name.isidentifier():
+        raise ValueError("Unsupported table or index")
+    query = (
+        "SELECT COUNT(*) FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() "
+        f"AND TABLE_NAME = '{table_name}' AND INDEX_NAME = '{index_name}'"
+    )
+    return bool(op.get_bind().exec_driver_sql(query).scalar())
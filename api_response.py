@@ -6,6 +6,28 @@ from starlette.responses import JSONResponse
 
 from i18n import current_language_ctx, get_frontend_messages, get_translator
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency guard
+    orjson = None  # type: ignore[assignment]
+
+
+class ApiJSONResponse(JSONResponse):
+    """API 応答を orjson で直接 UTF-8 のバイト列にする JSONResponse。
+
+    標準の json.dumps は str を作ってから encode するため、一覧のように大きい
+    応答では本文をもう 1 度コピーする。orjson で表せない値（64bit を超える整数
+    など）や orjson が無い環境では、これまでどおり JSONResponse の出力に落とす。
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            try:
+                return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                pass
+        return super().render(content)
+
 
 def _normalize_data(data: Mapping[str, Any] | None) -> dict[str, Any]:
     if data is None:
@@ -39,7 +61,7 @@ def api_error_payload(
 def api_ok_response(
     data: Mapping[str, Any] | None = None, *, status_code: int = 200
 ) -> JSONResponse:
-    return JSONResponse(api_ok_payload(data), status_code=status_code)
+    return ApiJSONResponse(api_ok_payload(data), status_code=status_code)
 
 
 def api_error_response(
@@ -48,4 +70,4 @@ def api_error_response(
     status_code: int = 400,
     data: Mapping[str, Any] | None = None,
 ) -> JSONResponse:
-    return JSONResponse(api_error_payload(error, data), status_code=status_code)
+    return ApiJSONResponse(api_error_payload(error, data), status_code=status_code)
@@ -1,6 +1,7 @@
 import asyncio
 import contextlib
 import inspect
+import json
 import logging
 import os
 import re
@@ -8,6 +9,7 @@ import subprocess
 from datetime import datetime, timezone
 from functools import lru_cache
 import log_config  # Initialize logging configuration  # noqa: F401
+from log_config import redact_sensitive_paths
 
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
@@ -26,12 +28,23 @@ try:
 except ImportError:  # pragma: no cover - fallback for older Starlette
     from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
-from database import db_session
+from database import (
+    DatabaseUnavailableError,
+    begin_request_db_scope,
+    db_session,
+    end_request_db_scope,
+    warm_up_pools,
+)
 from migration_runner import run_migrations
+from query_profiler import begin_request_profile, end_request_profile
+from request_memo import begin_request_memo, end_request_memo
 from settings import (
     ADMIN_KEY,
     ALLOW_START_WITHOUT_DB,
     BASE_DIR,
+    DB_POOL_WARMUP,
+    DB_PROFILE_LOG,
+    DB_SERVER_TIMING,
     GEOIP_AUTO_UPDATE,
     SECRET_KEY,
     REDIS_URL,
@@ -48,6 +61,13 @@ from i18n import (
 from security_headers import apply_security_headers
 from web import render_cached_template, render_template, wants_json_response
 from api_response import api_error_response
+from cache_utils import (
+    begin_request_cache_status,
+    end_request_cache_status,
+    start_cache_invalidation_listener,
+    stop_cache_invalidation_listener,
+)
+from password_security import PasswordHashBusyError, shutdown_password_pool
 from geoip_update import geoip_update_loop, update_geoip_database_async
 
 from Group.group_app import router as group_router
@@ -143,14 +163,40 @@ async def redirect_paused_language_queries(request: Request, call_next):
     return await call_next(request)
 
 
+def _report_query_profile(request: Request, response: Response, profile) -> None:
+    if profile is None or not profile.count:
+        return
+    if DB_SERVER_TIMING:
+        response.headers.append("Server-Timing", profile.server_timing())
+    if DB_PROFILE_LOG:
+        # パスには認証情報が入りうるので、ルートの定義（無ければ伏せたパス）を書く。
+        route = getattr(request.scope.get("route"), "path", None)
+        fields = profile.as_log_fields()
+        fields["path"] = route or redact_sensitive_paths(request.url.path)
+        fields["method"] = request.method
+        fields["status"] = response.status_code
+        logger.info("db_profile %s", json.dumps(fields, ensure_ascii=False))
+
+
 @app.middleware("http")
 async def db_session_middleware(request: Request, call_next):
     if request.url.path.startswith("/static/group_uploads"):
         return Response(status_code=404)
+    cache_status_token = begin_request_cache_status()
+    db_scope_token = begin_request_db_scope()
+    profile_token = begin_request_profile()
+    memo_token = begin_request_memo()
     try:
         response = await call_next(request)
+        # stale-while-revalidate 対象のキャッシュを使った場合だけ状態を返す。
+        cache_status = end_request_cache_status(cache_status_token)
+        if cache_status:
+            response.headers["X-Cache-Status"] = cache_status
+        _report_query_profile(request, response, end_request_profile(profile_token))
         return response
     finally:
+        end_request_memo(memo_token)
+        end_request_db_scope(db_scope_token)
         await db_session.remove()
 
 
@@ -189,6 +235,10 @@ async def startup():
         else:
             logger.critical(message)
             raise RuntimeError(message)
+    if ready and DB_POOL_WARMUP:
+        # Blue/Green 切替直後の最初のリクエストが接続確立を待たないようにする。
+        opened = await warm_up_pools(DB_POOL_WARMUP)
+        logger.info("Database pools warmed up: %s", opened)
     try:
         fsqr_cleanup_stats = await fsqr_cleanup_data.remove_expired_files()
         logger.info("FSQR startup expiration cleanup completed: %s", fsqr_cleanup_stats)
@@ -196,6 +246,7 @@ async def startup():
         logger.exception("FSQR startup expiration cleanup failed")
     await group_realtime_startup()
     await note_realtime_startup()
+    await start_cache_invalidation_listener()
     await db_session.remove()
 
 
@@ -211,6 +262,8 @@ async def shutdown():
         _geoip_update_stop_event = None
     await group_realtime_shutdown()
     await note_realtime_shutdown()
+    await stop_cache_invalidation_listener()
+    shutdown_password_pool()
 
 
 @app.exception_handler(StarletteHTTPException)
@@ -228,6 +281,30 @@ async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     return api_error_response(str(exc.detail), status_code=exc.status_code)
 
 
+@app.exception_handler(PasswordHashBusyError)
+async def password_hash_busy_handler(request: Request, exc: PasswordHashBusyError):
+    # ログイン集中で scrypt の待ち行列が溢れた場合は 500 ではなく 503 で再試行を促す。
+    logger.warning("Password hashing queue full during %s", request.url.path)
+    message = "ただいま混み合っています。時間をおいて再度お試しください。"
+    if request.url.path.startswith("/api") or wants_json_response(request):
+        return api_error_response(message, status_code=503)
+    response = render_template(request, "error.html", message=message)
+    response.status_code = 503
+    return response
+
+
+@app.exception_handler(DatabaseUnavailableError)
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailableError):
+    # DB 障害中は遮断器が即座に断るため、500 ではなく 503 で再試行を促す。
+    logger.warning("Database circuit open during %s", request.url.path)
+    message = "ただいまサービスが混み合っています。時間をおいて再度お試しください。"
+    if request.url.path.startswith("/api") or wants_json_response(request):
+        return api_error_response(message, status_code=503)
+    response = render_template(request, "error.html", message=message)
+    response.status_code = 503
+    return response
+
+
 @app.exception_handler(Exception)
 async def unhandled_exception_handler(request: Request, exc: Exception):
     logger.exception("Unhandled error during %s %s", request.method, request.url.path)
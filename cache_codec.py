@@ -0,0 +1,121 @@
+"""cache_data が Redis / L1 に保存する値のコーデック。
+
+保存形式は JSON 文字列のまま（Redis クライアントは decode_responses=True）で、
+datetime / date / time / timedelta / Decimal は型付きの小さな dict に包んで
+保存し、読み出し時に元の型へ戻す。これによりキャッシュヒット時もミス時と同じ型を
+返す。orjson があれば C 実装で、無ければ標準の json で同じ形式を読み書きするため、
+バックエンドが混在しても互いの値を読める。
+
+形式を変えるときは ``FORMAT_VERSION`` を上げる。キー名に含まれるので、
+Blue/Green の旧スロットが書いた値と新形式の値は別のキーに共存する。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency guard
+    orjson = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = "v2"
+
+_TYPE_KEY = "__db_cache_type__"
+# 型付きの値を含まない保存値は、復元のための走査を丸ごと省く。
+_TYPE_MARKER = f'"{_TYPE_KEY}"'
+
+
+def _encode_typed(obj: Any) -> dict[str, Any]:
+    # datetime は date のサブクラスなので先に判定する。
+    if isinstance(obj, datetime):
+        return {_TYPE_KEY: "datetime", "v": obj.isoformat()}
+    if isinstance(obj, date):
+        return {_TYPE_KEY: "date", "v": obj.isoformat()}
+    if isinstance(obj, time):
+        return {_TYPE_KEY: "time", "v": obj.isoformat()}
+    if isinstance(obj, timedelta):
+        return {_TYPE_KEY: "timedelta", "v": [obj.days, obj.seconds, obj.microseconds]}
+    if isinstance(obj, Decimal):
+        return {_TYPE_KEY: "decimal", "v": str(obj)}
+    raise TypeError(f"Object of type {type(obj).__name__} is not cache serializable")
+
+
+_TYPE_DECODERS: dict[str, Callable[[Any], Any]] = {
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "timedelta": lambda v: timedelta(days=v[0], seconds=v[1], microseconds=v[2]),
+    "decimal": Decimal,
+}
+
+
+def _decode_typed(obj: dict[str, Any]) -> Any:
+    if len(obj) == 2 and _TYPE_KEY in obj and "v" in obj:
+        decoder = _TYPE_DECODERS.get(obj[_TYPE_KEY])
+        if decoder is not None:
+            return decoder(obj["v"])
+    return obj
+
+
+def _revive(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_revive(item) for item in value]
+    if isinstance(value, dict):
+        decoded = _decode_typed(value)
+        if decoded is not value:
+            return decoded
+        return {key: _revive(item) for key, item in value.items()}
+    return value
+
+
+class JsonCodec:
+    """標準ライブラリの json による実装（orjson が無い環境向け）。"""
+
+    name = "json"
+
+    def encode(self, value: Any) -> str:
+        return json.dumps(
+            value, default=_encode_typed, ensure_ascii=False, separators=(",", ":")
+        )
+
+    def decode(self, payload: str) -> Any:
+        if _TYPE_MARKER not in payload:
+            return json.loads(payload)
+        return json.loads(payload, object_hook=_decode_typed)
+
+
+class OrjsonCodec:
+    """orjson による実装。日時型も default で包み、JsonCodec と同じ形式にする。"""
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise RuntimeError("orjson is not installed")
+        self._options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def encode(self, value: Any) -> str:
+        return orjson.dumps(value, default=_encode_typed, option=self._options).decode()
+
+    def decode(self, payload: str) -> Any:
+        value = orjson.loads(payload)
+        if _TYPE_MARKER not in payload:
+            return value
+        return _revive(value)
+
+
+def get_codec(name: str = "auto"):
+    """CACHE_CODEC の値からコーデックを選ぶ。使えない指定は json に落とす。"""
+    name = (name or "auto").strip().lower()
+    if name in ("auto", "orjson") and orjson is not None:
+        return OrjsonCodec()
+    if name not in ("auto", "json"):
+        logger.warning("Cache codec %r is unavailable; falling back to json", name)
+    return JsonCodec()
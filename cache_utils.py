@@ -1,20 +1,47 @@
+import asyncio
+import copy
 import json
 import functools
 import hashlib
 import logging
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
 from datetime import datetime, date, timedelta
 from decimal import Decimal
-from typing import Iterable, Optional
+from typing import Any, Callable, Iterable, Optional
 
 import redis.asyncio as redis
-from settings import REDIS_URL
+from cache_codec import FORMAT_VERSION, get_codec
+from settings import (
+    CACHE_CODEC,
+    CACHE_L1_MAX_BYTES,
+    CACHE_L1_MAX_ENTRIES,
+    CACHE_FILL_LOCK_MS,
+    CACHE_FILL_WAIT_MS,
+    CACHE_LEGACY_PREFIX_SCAN,
+    CACHE_L1_TTL_SECONDS,
+    CACHE_NEGATIVE_TTL_SECONDS,
+    REDIS_URL,
+)
 
 logger = logging.getLogger(__name__)
 
 # Initialize Redis client
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+INSTANCE_ID = uuid.uuid4().hex
+INVALIDATION_CHANNEL = "db_cache:invalidate"
+PUBSUB_RETRY_SECONDS = 5
+# キー名に保存形式のバージョンを含め、旧形式の値と混ざらないようにする。
+CACHE_KEY_NAMESPACE = f"db_cache:{FORMAT_VERSION}"
 
+codec = get_codec(CACHE_CODEC)
+
+
+# 旧形式（バージョン無しのキー）の保存値で使っていたエンコーダ。
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, (datetime, date)):
@@ -26,7 +53,174 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
-def cache_data(ttl=60, key_prefix="", strip_keys: Optional[Iterable[str]] = None):
+class LocalCache:
+    """ワーカー内の LRU。値は Redis と同じエンコード済み文字列で持つ。
+
+    取り出すたびにデコードするため、呼び出し側が結果を書き換えても
+    キャッシュには影響しない。件数と合計バイト数の両方で古い順に追い出す。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, max_ttl: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        # cache_key -> (monotonic expires_at, payload)
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._bytes = 0
+        # 無効化のたびに進める。Redis 読み込み中に無効化が届いた値は保存しない。
+        self.generation = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return payload
+
+    def set(self, key: str, payload: str, ttl: int, generation: int) -> None:
+        if generation != self.generation:
+            return
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        self._pop(key)
+        expires_at = time.monotonic() + min(ttl, self.max_ttl)
+        self._entries[key] = (expires_at, payload)
+        self._bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._pop(oldest)
+            self.stats["evictions"] += 1
+
+    def delete(self, keys: Iterable[str]) -> None:
+        self.generation += 1
+        self.stats["invalidations"] += 1
+        for key in keys:
+            self._pop(key)
+
+    def delete_prefix(self, key_prefix: str) -> None:
+        self.generation += 1
+        self.stats["invalidations"] += 1
+        for key in [k for k in self._entries if k.startswith(key_prefix)]:
+            self._pop(key)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+        self._bytes = 0
+
+    def snapshot(self) -> dict[str, Any]:
+        data: dict[str, Any] = dict(self.stats)
+        data["entries"] = len(self._entries)
+        data["bytes"] = self._bytes
+        data["max_entries"] = self.max_entries
+        data["max_bytes"] = self.max_bytes
+        return data
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+local_cache = LocalCache(CACHE_L1_MAX_ENTRIES, CACHE_L1_MAX_BYTES, CACHE_L1_TTL_SECONDS)
+
+# 無効化通知を購読できている間だけ L1 を使う（取りこぼしで古い値を返さないため）。
+_listener_ready = False
+_listener_task: Optional[asyncio.Task] = None
+_listener_stop_event: Optional[asyncio.Event] = None
+
+
+def _local_cache_active() -> bool:
+    return local_cache.enabled and _listener_ready
+
+
+# ────────────────────────────────────────────
+# キャッシュミスの合流（single-flight）
+# ────────────────────────────────────────────
+# 人気キーの期限切れや prefix 無効化の直後に同じクエリが一斉に走らないよう、
+# ワーカー内では進行中の Future を共有し、ワーカー間では短い Redis ロックを取った
+# 1 者だけが DB を引く。ロックを取れなかった側は Redis の値が入るのを少し待つ。
+_inflight: dict[str, asyncio.Future] = {}
+_single_flight_stats = {
+    "loads": 0,
+    "coalesced_local": 0,
+    "coalesced_remote": 0,
+    "lock_wait_timeouts": 0,
+}
+_FILL_POLL_SECONDS = 0.05
+# 先行呼び出しが取り消されたときに待ち手へ渡す印。待ち手は自分で読み直す。
+_LEADER_CANCELLED = object()
+
+
+def _cached_text(value: object) -> Optional[str]:
+    """GET の結果を保存値として扱う。
+
+    decode_responses=True なので実際は str が返る（型の上では bytes | str）。
+    """
+    return value if isinstance(value, str) and value else None
+
+
+def _fill_lock_key(cache_key: str) -> str:
+    return f"db_cache_lock:{cache_key}"
+
+
+async def _acquire_fill_lock(cache_key: str) -> Optional[bool]:
+    """True=取得, False=他のワーカーが読み込み中, None=ロックを使わない。"""
+    if CACHE_FILL_LOCK_MS <= 0:
+        return None
+    try:
+        acquired = await redis_client.set(
+            _fill_lock_key(cache_key), INSTANCE_ID, nx=True, px=CACHE_FILL_LOCK_MS
+        )
+    except Exception as e:
+        logger.warning(f"Cache fill lock error: {e}")
+        return None
+    return bool(acquired)
+
+
+async def _release_fill_lock(cache_key: str) -> None:
+    try:
+        await redis_client.delete(_fill_lock_key(cache_key))
+    except Exception as e:
+        logger.warning(f"Cache fill unlock error: {e}")
+
+
+async def _wait_for_fill(cache_key: str) -> Optional[str]:
+    deadline = time.monotonic() + CACHE_FILL_WAIT_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(_FILL_POLL_SECONDS)
+        try:
+            payload = _cached_text(await redis_client.get(cache_key))
+        except Exception:
+            return None
+        if payload is not None:
+            return payload
+    return None
+
+
+def cache_data(
+    ttl=60,
+    key_prefix="",
+    strip_keys: Optional[Iterable[str]] = None,
+    tags: Optional[Callable[[Any], Iterable[str]]] = None,
+    cache_negative: bool = False,
+    stale_ttl: int = 0,
+):
     """
     Decorator to cache the result of an async function in Redis.
     It handles SQLAlchemy RowMapping conversion to dict for serialization.
@@ -37,37 +231,63 @@ def cache_data(ttl=60, key_prefix="", strip_keys: Optional[Iterable[str]] = None
     ``strip_keys`` removes the specified keys from dict/row results before
     they are cached AND before they are returned, so sensitive columns
     (e.g. ``password``) never enter Redis or reach unintended callers.
+
+    ``tags`` receives the cached value and returns resource tags (see
+    ``tag_results_by``); ``invalidate_cache_tag`` then drops every entry
+    registered under a tag without scanning the keyspace.
+
+    ``cache_negative=True`` also caches ``None`` and empty-list results for
+    ``CACHE_NEGATIVE_TTL_SECONDS`` (never longer than ``ttl``), so repeated
+    failed lookups stop reaching MySQL. Create paths must then invalidate the
+    exact entry (``invalidate_cache_entry``) that a new record would satisfy.
+
+    ``stale_ttl`` enables stale-while-revalidate: after ``ttl`` seconds the
+    value is still served for up to ``stale_ttl`` more seconds while one
+    background task per key reloads it. Such calls report fresh/stale/miss
+    through ``X-Cache-Status`` and the counters in ``get_cache_stats``.
     """
 
     strip_set = frozenset(strip_keys or ())
 
     def decorator(func):
         prefix = key_prefix or f"{func.__module__}.{func.__qualname__}"
+        global _max_entry_ttl
+        _max_entry_ttl = max(_max_entry_ttl, ttl + stale_ttl)
+        spec = _CacheSpec(
+            prefix=prefix,
+            ttl=ttl,
+            strip_set=strip_set,
+            tags=tags,
+            negative_ttl=min(CACHE_NEGATIVE_TTL_SECONDS, ttl) if cache_negative else 0,
+            stale_ttl=stale_ttl,
+        )
 
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
+            use_local = _local_cache_active()
+            generation = local_cache.generation
+            cache_key = _build_cache_key(prefix, args, kwargs)
             try:
-                cache_key = _build_cache_key(prefix, args, kwargs)
-
-                cached_data = await redis_client.get(cache_key)
+                cached_data = await _read_cached(spec, cache_key, use_local, generation)
                 if cached_data:
-                    return json.loads(cached_data)
+                    payload, fresh = _split_stale(cached_data)
+                    if payload == NEGATIVE_SENTINEL:
+                        _negative_stats["hits"] += 1
+                    if not fresh:
+                        _schedule_refresh(spec, func, args, kwargs, cache_key)
+                    _record_status(spec, "fresh" if fresh else "stale")
+                    return _decode_payload(payload)
             except Exception as e:
                 logger.warning(f"Cache get error: {e}")
 
-            result = await func(*args, **kwargs)
+            _record_status(spec, "miss")
 
-            to_cache = _normalize_for_cache(result, strip_set)
-            if to_cache is not None:
-                try:
-                    await redis_client.setex(
-                        cache_key, ttl, json.dumps(to_cache, cls=CustomJSONEncoder)
-                    )
-                except Exception as e:
-                    logger.warning(f"Cache set error: {e}")
-                return to_cache
+            async def _load():
+                return await _load_and_fill(
+                    spec, func, args, kwargs, cache_key, use_local, generation
+                )
 
-            return result
+            return await _single_flight(cache_key, _load)
 
         wrapper._cache_prefix = prefix  # type: ignore[attr-defined]
         return wrapper
@@ -75,33 +295,281 @@ def cache_data(ttl=60, key_prefix="", strip_keys: Optional[Iterable[str]] = None
     return decorator
 
 
+@dataclass(frozen=True)
+class _CacheSpec:
+    prefix: str
+    ttl: int
+    strip_set: frozenset
+    tags: Optional[Callable[[Any], Iterable[str]]]
+    negative_ttl: int = 0
+    stale_ttl: int = 0
+
+
+# cache_data を付けた関数の保存期間の最大値（タグの SET の TTL に使う）。
+_max_entry_ttl = 0
+
+# 「該当なし」を表す保存値。コーデックの出力（JSON）とは衝突しない。
+NEGATIVE_SENTINEL = "__db_cache_none__"
+_negative_stats = {"stored": 0, "hits": 0}
+
+
+def _decode_payload(payload: str):
+    if payload == NEGATIVE_SENTINEL:
+        return None
+    return codec.decode(payload)
+
+
+def _payload_ttl(spec: _CacheSpec, payload: str) -> int:
+    if spec.negative_ttl and payload in (NEGATIVE_SENTINEL, "[]"):
+        return spec.negative_ttl
+    return spec.ttl + spec.stale_ttl
+
+
+# ────────────────────────────────────────────
+# stale-while-revalidate
+# ────────────────────────────────────────────
+# stale_ttl を指定した関数は、Redis に ttl + stale_ttl の間だけ値を残し、
+# 保存値の先頭に「新鮮な期限」を付ける。期限を過ぎた値はそのまま返しつつ、
+# キーごとに 1 つだけ背景タスクで再取得する。
+_STALE_MARK = "swr:"
+_refresh_tasks: dict[str, asyncio.Task] = {}
+_status_stats = {
+    "fresh": 0,
+    "stale": 0,
+    "miss": 0,
+    "refreshes": 0,
+    "refresh_failures": 0,
+}
+# リクエスト内で stale_ttl 付きの関数が返した状態（X-Cache-Status 用）。
+_request_cache_statuses: ContextVar[Optional[list[str]]] = ContextVar(
+    "request_cache_statuses", default=None
+)
+_STATUS_PRIORITY = ("miss", "stale", "fresh")
+
+
+def _wrap_stale(spec: _CacheSpec, payload: str) -> str:
+    if not spec.stale_ttl:
+        return payload
+    return f"{_STALE_MARK}{time.time() + spec.ttl:.3f}:{payload}"
+
+
+def _split_stale(stored: str) -> tuple[str, bool]:
+    """保存値から (エンコード済み文字列, 新鮮かどうか) を取り出す。"""
+    if not stored.startswith(_STALE_MARK):
+        return stored, True
+    fresh_until, _, payload = stored[len(_STALE_MARK) :].partition(":")
+    try:
+        return payload, time.time() < float(fresh_until)
+    except ValueError:
+        return payload, False
+
+
+def _record_status(spec: _CacheSpec, status: str) -> None:
+    _status_stats[status] += 1
+    if not spec.stale_ttl:
+        return
+    statuses = _request_cache_statuses.get()
+    if statuses is not None:
+        statuses.append(status)
+
+
+def begin_request_cache_status() -> Token:
+    """リクエストの開始時に呼び、終了時に end_request_cache_status へ渡す。"""
+    return _request_cache_statuses.set([])
+
+
+def end_request_cache_status(token: Token) -> Optional[str]:
+    """リクエスト中に最も悪かった状態（miss > stale > fresh）を返す。"""
+    statuses = _request_cache_statuses.get() or []
+    _request_cache_statuses.reset(token)
+    for status in _STATUS_PRIORITY:
+        if status in statuses:
+            return status
+    return None
+
+
+def _schedule_refresh(spec: _CacheSpec, func, args, kwargs, cache_key: str) -> None:
+    if cache_key in _refresh_tasks:
+        return
+    task = asyncio.create_task(_refresh(spec, func, args, kwargs, cache_key))
+    _refresh_tasks[cache_key] = task
+    task.add_done_callback(lambda _task: _refresh_tasks.pop(cache_key, None))
+
+
+async def _refresh(spec: _CacheSpec, func, args, kwargs, cache_key: str) -> None:
+    from database import remove_db_session
+
+    lock = await _acquire_fill_lock(cache_key)
+    if lock is False:
+        # 他のワーカーが更新中。
+        return
+    use_local = _local_cache_active()
+    generation = local_cache.generation
+    try:
+        # 直前に別のワーカーが更新を終えていれば、その値を L1 に入れるだけにする
+        # （L1 の古い値を持つワーカーごとに DB を読み直さない）。
+        stored = _cached_text(await redis_client.get(cache_key))
+        if stored and _split_stale(stored)[1]:
+            if use_local:
+                local_cache.set(
+                    cache_key, stored, _payload_ttl(spec, stored), generation
+                )
+            return
+        result = await func(*args, **kwargs)
+        await _store_result(spec, cache_key, result, use_local, generation)
+        _status_stats["refreshes"] += 1
+    except Exception as e:
+        _status_stats["refresh_failures"] += 1
+        logger.warning(f"Cache refresh error: {e}")
+    finally:
+        if lock:
+            await _release_fill_lock(cache_key)
+        # 背景タスクは独自の DB セッションを持つため、ここで返却する。
+        await remove_db_session()
+
+
+async def _read_cached(
+    spec: _CacheSpec, cache_key: str, use_local: bool, generation: int
+) -> Optional[str]:
+    if use_local:
+        local_data = local_cache.get(cache_key)
+        if local_data:
+            return local_data
+    cached_data = _cached_text(await redis_client.get(cache_key))
+    if cached_data and use_local:
+        local_cache.set(
+            cache_key, cached_data, _payload_ttl(spec, cached_data), generation
+        )
+    return cached_data
+
+
+async def _single_flight(cache_key: str, load):
+    """同じキーの読み込みが進行中なら、その結果を待って共有する。"""
+    inflight = _inflight.get(cache_key)
+    if inflight is not None:
+        _single_flight_stats["coalesced_local"] += 1
+        outcome = await asyncio.shield(inflight)
+        if outcome is _LEADER_CANCELLED:
+            # 先行呼び出しが取り消された（接続断など）。巻き込まれずに読み直す。
+            return await _single_flight(cache_key, load)
+        payload, result = outcome
+        # 先行呼び出しの返り値は共有せず、保存値から作り直して渡す。
+        if payload is not None:
+            return _decode_payload(payload)
+        return copy.deepcopy(result)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        payload, result = await load()
+    except BaseException as exc:
+        if isinstance(exc, asyncio.CancelledError):
+            future.set_result(_LEADER_CANCELLED)
+        else:
+            future.set_exception(exc)
+            # 待ち手がいない場合に "exception was never retrieved" を出さない。
+            future.exception()
+        raise
+    else:
+        future.set_result((payload, result))
+        return result
+    finally:
+        if _inflight.get(cache_key) is future:
+            del _inflight[cache_key]
+
+
+async def _load_and_fill(spec, func, args, kwargs, cache_key, use_local, generation):
+    """関数を実行して Redis（と L1）へ保存する。
+
+    返り値は (エンコード済み文字列, 呼び出し元へ返す値)。他のワーカーが同じキーを
+    読み込み中なら、まずその結果が Redis に入るのを待つ。
+    """
+    lock = await _acquire_fill_lock(cache_key)
+    if lock is False:
+        stored = await _wait_for_fill(cache_key)
+        if stored is not None:
+            _single_flight_stats["coalesced_remote"] += 1
+            if use_local:
+                local_cache.set(
+                    cache_key, stored, _payload_ttl(spec, stored), generation
+                )
+            payload, _ = _split_stale(stored)
+            return payload, _decode_payload(payload)
+        _single_flight_stats["lock_wait_timeouts"] += 1
+    try:
+        result = await func(*args, **kwargs)
+        _single_flight_stats["loads"] += 1
+        return await _store_result(spec, cache_key, result, use_local, generation)
+    finally:
+        if lock:
+            await _release_fill_lock(cache_key)
+
+
+async def _store_result(spec, cache_key, result, use_local, generation):
+    to_cache = _normalize_for_cache(result, spec.strip_set)
+    if to_cache is None and not spec.negative_ttl:
+        return None, result
+    negative = bool(spec.negative_ttl) and to_cache in (None, [])
+    payload = None
+    try:
+        if to_cache is None:
+            payload = NEGATIVE_SENTINEL
+        else:
+            payload = codec.encode(to_cache)
+        if negative:
+            stored, ttl = payload, spec.negative_ttl
+            # 該当なしの結果はリソースを持たないため、prefix のタグにだけ登録する。
+            tags = [_prefix_tag(spec.prefix)]
+            _negative_stats["stored"] += 1
+        else:
+            stored, ttl = _wrap_stale(spec, payload), spec.ttl + spec.stale_ttl
+            tags = _entry_tags(spec, to_cache)
+        await _store_cached(cache_key, stored, ttl, tags)
+        if use_local:
+            local_cache.set(cache_key, stored, ttl, generation)
+    except Exception as e:
+        logger.warning(f"Cache set error: {e}")
+    return payload, to_cache
+
+
 def _normalize_for_cache(result, strip_set: frozenset):
     if result is None:
         return None
     if isinstance(result, list):
-        return [_strip_dict(_to_dict(r), strip_set) for r in result]
+        return [_row_for_cache(r, strip_set) for r in result]
     if hasattr(result, "keys"):
-        return _strip_dict(_to_dict(result), strip_set)
+        return _row_for_cache(result, strip_set)
     return result
 
 
-def _to_dict(row):
-    if hasattr(row, "keys") and not isinstance(row, dict):
-        return dict(row)
-    return row
+def _row_for_cache(row, strip_set: frozenset):
+    """RowMapping を保存用の dict にする。strip_keys の除外も同じ 1 回のコピーで行う。"""
+    if not hasattr(row, "keys"):
+        return row
+    if strip_set:
+        return {k: v for k, v in row.items() if k not in strip_set}
+    if isinstance(row, dict):
+        return row
+    return dict(row)
 
 
-def _strip_dict(value, strip_set: frozenset):
-    if not strip_set or not isinstance(value, dict):
-        return value
-    return {k: v for k, v in value.items() if k not in strip_set}
+def _build_cache_key(key_prefix: str, args, kwargs) -> str:
+    return f"{_key_namespace(key_prefix)}{_args_hash(args, kwargs)}"
 
 
-def _build_cache_key(key_prefix: str, args, kwargs) -> str:
+def _args_hash(args, kwargs) -> str:
     arg_data = [args, kwargs]
     arg_str = json.dumps(arg_data, sort_keys=True, default=str)
-    key_hash = hashlib.md5(arg_str.encode()).hexdigest()  # noqa: S324
-    return f"db_cache:{key_prefix}:{key_hash}"
+    return hashlib.md5(arg_str.encode()).hexdigest()  # noqa: S324
+
+
+def _key_namespace(key_prefix: str) -> str:
+    return f"{CACHE_KEY_NAMESPACE}:{key_prefix}:"
+
+
+def _legacy_cache_key(key_prefix: str, args, kwargs) -> str:
+    """バージョン無しの旧形式キー。Blue/Green で旧スロットが残る間も消すために使う。"""
+    return f"db_cache:{key_prefix}:{_args_hash(args, kwargs)}"
 
 
 def _resolve_prefix(func_or_prefix) -> str:
@@ -114,21 +582,299 @@ def _resolve_prefix(func_or_prefix) -> str:
     return str(func_or_prefix)
 
 
-async def invalidate_cache_entry(key_prefix, *args, **kwargs) -> None:
+# ────────────────────────────────────────────
+# タグ索引
+# ────────────────────────────────────────────
+# 保存したキーを「関数 prefix」と「リソース」のタグごとの SET に登録しておき、
+# 無効化は SET を読んで UNLINK するだけにする（SCAN で全キーを舐めない）。
+# SET の寿命は登録済みキーの最長 TTL に合わせて延ばすため、放置しても消える。
+TAG_KEY_PREFIX = "db_cache_tag:"
+
+
+def resource_tag(namespace: str, resource_id: Any) -> str:
+    return f"{namespace}:{resource_id}"
+
+
+def tag_results_by(namespace: str, field: str) -> Callable[[Any], list[str]]:
+    """結果（文字列・dict・dict のリスト）の ``field`` からリソースタグを作る。"""
+
+    def _tags(value: Any) -> list[str]:
+        items = value if isinstance(value, list) else [value]
+        tags = []
+        for item in items:
+            resource_id = item.get(field) if isinstance(item, dict) else item
+            if isinstance(resource_id, str) and resource_id:
+                tags.append(resource_tag(namespace, resource_id))
+        return tags
+
+    return _tags
+
+
+def _prefix_tag(prefix: str) -> str:
+    return f"prefix:{prefix}"
+
+
+def _tag_key(tag: str) -> str:
+    return f"{TAG_KEY_PREFIX}{tag}"
+
+
+def _entry_tags(spec: _CacheSpec, value: Any) -> list[str]:
+    tags = [_prefix_tag(spec.prefix)]
+    if spec.tags is not None:
+        try:
+            tags.extend(spec.tags(value))
+        except Exception as e:
+            logger.warning(f"Cache tag error: {e}")
+    return tags
+
+
+async def _store_cached(
+    cache_key: str, payload: str, ttl: int, tags: Iterable[str]
+) -> None:
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.setex(cache_key, ttl, payload)
+        for tag in tags:
+            tag_key = _tag_key(tag)
+            pipe.sadd(tag_key, cache_key)
+            # SET は登録されたどのキーよりも長く残す。EXPIRE の NX / GT は Redis 7
+            # 以降にしか無いため、全関数で最長の TTL を毎回付け直す。
+            pipe.expire(tag_key, max(ttl, _max_entry_ttl))
+        await pipe.execute()
+
+
+async def _unlink_tagged(tag: str) -> list[str]:
+    tag_key = _tag_key(tag)
+    # SET の読み出しと削除を同時に行い、その後に登録されたキーは次回に回す。
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.smembers(tag_key)
+        pipe.unlink(tag_key)
+        members, _ = await pipe.execute()
+    keys = sorted(members or ())
+    if keys:
+        await redis_client.unlink(*keys)
+    return keys
+
+
+async def invalidate_cache_tag(tag: str) -> None:
+    """タグに登録されたキャッシュをまとめて削除する。"""
+    keys: list[str] = []
+    try:
+        keys = await _unlink_tagged(tag)
+    except Exception as e:
+        logger.warning(f"Cache tag delete error: {e}")
+    if keys:
+        local_cache.delete(keys)
+        await _publish_invalidation({"keys": keys})
+
+
+def cache_entry(key_prefix, *args, **kwargs) -> tuple[str, ...]:
+    """invalidate_cache_entries に渡す 1 件分のキー（現形式と旧形式）を作る。"""
     prefix = _resolve_prefix(key_prefix)
-    cache_key = _build_cache_key(prefix, args, kwargs)
+    return (
+        _build_cache_key(prefix, args, kwargs),
+        _legacy_cache_key(prefix, args, kwargs),
+    )
+
+
+async def invalidate_cache_entry(key_prefix, *args, **kwargs) -> None:
+    await invalidate_cache_entries(cache_entry(key_prefix, *args, **kwargs))
+
+
+async def invalidate_cache_entries(
+    *entries: Iterable[str], tags: Iterable[str] = ()
+) -> None:
+    """複数のキャッシュ（cache_entry で指定）とタグをまとめて削除する。
+
+    キーの UNLINK・タグ SET の読み出し・L1 の無効化通知を 1 つのパイプラインで
+    送るため、書き込み処理に加わる Redis の往復はタグが無ければ 1 回で済む
+    （タグに登録されたキーがあれば、その UNLINK にもう 1 回）。
+    """
+    keys = list(dict.fromkeys(key for entry in entries for key in entry))
+    tag_list = list(dict.fromkeys(tags))
+    if not keys and not tag_list:
+        return
+    local_cache.delete(keys)
+    members: list[str] = []
+    published = False
     try:
-        await redis_client.delete(cache_key)
+        members, published = await _unlink_entries(keys, tag_list)
     except Exception as e:
-        logger.warning(f"Cache delete error: {e}")
+        logger.warning(f"Cache batch delete error: {e}")
+    if members:
+        local_cache.delete(members)
+    if not published:
+        await _publish_invalidation({"keys": keys + members})
+
+
+async def _unlink_entries(keys: list[str], tags: list[str]) -> tuple[list[str], bool]:
+    """返り値は (タグから見つかったキー, 無効化通知を送り終えたか)。"""
+    tag_keys = [_tag_key(tag) for tag in tags]
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if keys:
+            pipe.unlink(*keys)
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        if tag_keys:
+            pipe.unlink(*tag_keys)
+        else:
+            _queue_invalidation(pipe, {"keys": keys})
+        results = await pipe.execute()
+    if not tag_keys:
+        return [], True
+    start = 1 if keys else 0
+    found: set[str] = set()
+    for tag_members in results[start : start + len(tag_keys)]:
+        found.update(tag_members or ())
+    members = sorted(found.difference(keys))
+    if members:
+        await redis_client.unlink(*members)
+    return members, False
+
+
+async def _unlink_untagged_prefix(prefix: str) -> None:
+    """タグ導入前の書き方のキーを SCAN で消す。
+
+    Blue/Green の旧スロットはバージョン無し（``db_cache:<prefix>:``）のキーを書き、
+    タグにも登録しない。旧スロットを撤去したら CACHE_LEGACY_PREFIX_SCAN で止める。
+    """
+    keys = [
+        key
+        async for key in redis_client.scan_iter(match=f"db_cache:{prefix}:*", count=500)
+    ]
+    if keys:
+        await redis_client.unlink(*keys)
 
 
 async def invalidate_cache_prefix(key_prefix) -> None:
     prefix = _resolve_prefix(key_prefix)
-    pattern = f"db_cache:{prefix}:*"
+    local_cache.delete_prefix(_key_namespace(prefix))
     try:
-        keys = [key async for key in redis_client.scan_iter(match=pattern)]
-        if keys:
-            await redis_client.delete(*keys)
+        await _unlink_tagged(_prefix_tag(prefix))
+        if CACHE_LEGACY_PREFIX_SCAN:
+            await _unlink_untagged_prefix(prefix)
     except Exception as e:
         logger.warning(f"Cache prefix delete error: {e}")
+    # "prefix" は旧形式のキーを持つワーカー向け、"function" は受け手が自分の
+    # 保存形式のキー名を組み立てるためのもの。
+    await _publish_invalidation({"prefix": f"db_cache:{prefix}:", "function": prefix})
+
+
+# ────────────────────────────────────────────
+# L1 の無効化通知（Redis pub/sub）
+# ────────────────────────────────────────────
+# 他のワーカーや Blue/Green のもう一方のスロットも同じ Redis を見ているため、
+# 無効化は必ず全員に配信する。スケジューラなど購読していないプロセスからも送る。
+async def _publish_invalidation(message: dict[str, Any]) -> None:
+    if not local_cache.enabled:
+        return
+    try:
+        await redis_client.publish(INVALIDATION_CHANNEL, _invalidation_message(message))
+    except Exception as e:
+        logger.warning(f"Cache invalidation publish error: {e}")
+
+
+def _queue_invalidation(pipe, message: dict[str, Any]) -> None:
+    """パイプラインに無効化通知を積む（他のコマンドと同じ往復で送る）。"""
+    if local_cache.enabled:
+        pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(message))
+
+
+def _invalidation_message(message: dict[str, Any]) -> str:
+    return json.dumps({**message, "source": INSTANCE_ID})
+
+
+def _apply_invalidation(data) -> None:
+    try:
+        event = json.loads(data)
+    except (TypeError, json.JSONDecodeError):
+        return
+    if not isinstance(event, dict) or event.get("source") == INSTANCE_ID:
+        return
+    keys = event.get("keys")
+    if isinstance(keys, list):
+        local_cache.delete(str(key) for key in keys)
+    key_prefix = event.get("prefix")
+    if isinstance(key_prefix, str) and key_prefix.startswith("db_cache:"):
+        local_cache.delete_prefix(key_prefix)
+    function = event.get("function")
+    if isinstance(function, str) and function:
+        local_cache.delete_prefix(_key_namespace(function))
+
+
+async def _invalidation_loop():
+    global _listener_ready
+    pubsub = redis_client.pubsub()
+    try:
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        # 購読開始前の値は信用しない。
+        local_cache.clear()
+        _listener_ready = True
+        async for message in pubsub.listen():
+            if message is None or message.get("type") != "message":
+                continue
+            _apply_invalidation(message.get("data"))
+    finally:
+        _listener_ready = False
+        local_cache.clear()
+        try:
+            await pubsub.close()
+        except Exception:  # noqa: S110
+            pass
+
+
+async def _invalidation_supervisor():
+    while _listener_stop_event is not None and not _listener_stop_event.is_set():
+        try:
+            await _invalidation_loop()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("Cache invalidation listener stopped: %s", exc)
+        try:
+            await asyncio.wait_for(
+                _listener_stop_event.wait(), timeout=PUBSUB_RETRY_SECONDS
+            )
+        except TimeoutError:
+            continue
+
+
+async def start_cache_invalidation_listener() -> None:
+    global _listener_task, _listener_stop_event
+    if not local_cache.enabled:
+        return
+    if _listener_task is None or _listener_task.done():
+        _listener_stop_event = asyncio.Event()
+        _listener_task = asyncio.create_task(_invalidation_supervisor())
+
+
+async def stop_cache_invalidation_listener() -> None:
+    global _listener_task, _listener_stop_event
+    if _listener_stop_event is not None:
+        _listener_stop_event.set()
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+    _listener_stop_event = None
+
+
+def get_cache_stats() -> dict[str, Any]:
+    """L1 キャッシュと single-flight の利用状況を返す（/admin/metrics 用）。"""
+    data = local_cache.snapshot()
+    data["listener_ready"] = _listener_ready
+    data["codec"] = codec.name
+    data["format"] = FORMAT_VERSION
+    single_flight: dict[str, Any] = dict(_single_flight_stats)
+    single_flight["in_flight"] = len(_inflight)
+    single_flight["db_calls_saved"] = (
+        single_flight["coalesced_local"] + single_flight["coalesced_remote"]
+    )
+    data["single_flight"] = single_flight
+    data["negative"] = dict(_negative_stats)
+    status: dict[str, Any] = dict(_status_stats)
+    status["refreshing"] = len(_refresh_tasks)
+    data["status"] = status
+    return data
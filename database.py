@@ -2,15 +2,37 @@ import asyncio
 import logging
 import os
 import re
+import time
+from contextlib import AsyncExitStack
+from contextvars import ContextVar, Token
+from typing import Any, Optional
 
 from dotenv import load_dotenv
-from sqlalchemy import text
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import (
     async_scoped_session,
     async_sessionmaker,
     create_async_engine,
 )
 from sqlalchemy.exc import DBAPIError, OperationalError, TimeoutError as SATimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from settings import (
+    DB_BREAKER_FAILURE_THRESHOLD,
+    DB_BULK_CHUNK_SIZE,
+    DB_BREAKER_RESET_SECONDS,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_READ_MAX_OVERFLOW,
+    DB_READ_POOL_SIZE,
+    DB_REPLICA_LAG_CHECK_SECONDS,
+    DB_REPLICA_MAX_LAG_SECONDS,
+)
+from request_memo import clear_request_memo
+from sql_statements import statement
+import query_profiler  # noqa: F401  (Engine に計測イベントを張る)
 
 logger = logging.getLogger(__name__)
 
@@ -20,18 +42,139 @@ host = os.getenv("SQL_HOST")
 user = os.getenv("SQL_USER")
 pw = os.getenv("SQL_PW")
 db = os.getenv("SQL_DB")
+# 読み取り専用レプリカ（任意）。カンマ区切りで複数指定でき、未設定なら全て primary で読む。
+replica_hosts = [
+    item.strip()
+    for item in os.getenv("SQL_REPLICA_HOSTS", "").split(",")
+    if item.strip()
+]
+
+
+def _database_url(db_host) -> str:
+    return f"mysql+aiomysql://{user}:{pw}@{db_host}/{db}?charset=utf8mb4"
+
+
+DATABASE_URL = _database_url(host)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """接続の取り出しを待っている数と、待った時間を数える QueuePool。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = {
+            "waiting": 0,
+            "checkouts": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
 
+    def _do_get(self):
+        stats = self.wait_stats
+        stats["waiting"] += 1
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats["waiting"] -= 1
+            stats["checkouts"] += 1
+            stats["wait_ms_total"] += elapsed_ms
+            stats["wait_ms_max"] = max(stats["wait_ms_max"], elapsed_ms)
+
+    def gauges(self) -> dict[str, Any]:
+        stats = self.wait_stats
+        checkouts = stats["checkouts"]
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            # QueuePool は常駐分を負の値で数えるので、超過した数だけを出す。
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "waiting": stats["waiting"],
+            "checkouts": checkouts,
+            "wait_ms_avg": round(stats["wait_ms_total"] / checkouts, 2)
+            if checkouts
+            else 0.0,
+            "wait_ms_max": round(stats["wait_ms_max"], 2),
+        }
+
+
+# 大きさは settings.db_pool_sizes が WEB_CONCURRENCY と max_connections から決める。
 engine = create_async_engine(
-    f"mysql+aiomysql://{user}:{pw}@{host}/{db}?charset=utf8mb4",
+    DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
     pool_recycle=280,
-    pool_size=10,
+    pool_size=DB_POOL_SIZE,
     pool_pre_ping=True,
-    max_overflow=5,
-    pool_timeout=10,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
     echo=False,
 )
 
-async_session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+# 読み取り専用の問い合わせ（fetch_all / fetch_one）用のプール。
+# AUTOCOMMIT で暗黙のトランザクションを張らず、返却時の ROLLBACK も送らない。
+# 読み取りは再実行しても安全なので、pre_ping の代わりに切断時の再試行に任せる。
+def _create_read_engine(url: str):
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        isolation_level="AUTOCOMMIT",
+        skip_autocommit_rollback=True,
+        pool_recycle=280,
+        pool_size=DB_READ_POOL_SIZE,
+        pool_pre_ping=False,
+        max_overflow=DB_READ_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        echo=False,
+    )
+
+
+read_engine = _create_read_engine(DATABASE_URL)
+replica_engines = [_create_read_engine(_database_url(item)) for item in replica_hosts]
+
+
+# リクエスト内で primary へ書き込んだかどうか。書き込んだ後の読み取りは
+# レプリカの遅延で自分の変更が見えなくならないよう primary に固定する。
+# 子タスクにも同じ dict が引き継がれるので、そちらの書き込みも記録される。
+_request_db_writes: ContextVar[Optional[dict[str, bool]]] = ContextVar(
+    "request_db_writes", default=None
+)
+
+
+def begin_request_db_scope() -> Token:
+    """リクエストの開始時に呼び、終了時に end_request_db_scope へ渡す。"""
+    return _request_db_writes.set({"wrote": False})
+
+
+def end_request_db_scope(token: Token) -> None:
+    _request_db_writes.reset(token)
+
+
+def mark_primary_write() -> None:
+    scope = _request_db_writes.get()
+    if scope is not None:
+        scope["wrote"] = True
+    # 書き込み前に覚えたルーム参照などは古くなっているので捨てる。
+    clear_request_memo()
+
+
+def wrote_in_request() -> bool:
+    scope = _request_db_writes.get()
+    return bool(scope and scope["wrote"])
+
+
+class _PrimarySession(Session):
+    """db_session 用。コミットをリクエスト内の書き込みとして記録する。"""
+
+
+event.listen(_PrimarySession, "after_commit", lambda _session: mark_primary_write())
+
+async_session_factory = async_sessionmaker(
+    bind=engine, expire_on_commit=False, sync_session_class=_PrimarySession
+)
 db_session = async_scoped_session(async_session_factory, scopefunc=asyncio.current_task)
 
 
@@ -59,7 +202,243 @@ def is_retryable_db_error(exc) -> bool:
     )
 
 
+class DatabaseUnavailableError(RuntimeError):
+    """遮断器が開いている間、DB に問い合わせずに即座に返すエラー。"""
+
+
+class CircuitBreaker:
+    """MySQL 障害時に、各タスクが個別に再接続と再試行を繰り返さないための遮断器。
+
+    - closed: 通常。再試行可能なエラーが続けて ``failure_threshold`` 回起きたら open。
+    - open: ``reset_seconds`` の間は問い合わせずに DatabaseUnavailableError を返す。
+    - half_open: 経過後に 1 件だけ試行を通し、成功で closed、失敗で open に戻す。
+
+    再試行前の疎通確認（``recover``）はワーカー内で 1 つだけ走らせ、同時に失敗した
+    呼び出しはその結果を共有する。
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_started_at: Optional[float] = None
+        self._recovery: Optional[asyncio.Future] = None
+        self.stats = {"opened": 0, "rejected": 0, "recoveries": 0}
+
+    def before_call(self) -> None:
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < self.reset_seconds:
+                self._reject()
+            self.state = "half_open"
+        if self.state == "half_open":
+            # 試行中のタスクがキャンセルされても詰まらないよう、古い試行は無視する。
+            trial = self._trial_started_at
+            if trial is not None and now - trial < self.reset_seconds:
+                self._reject()
+            self._trial_started_at = now
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._trial_started_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_started_at = None
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self._open()
+
+    async def recover(self, probe, delay: float) -> bool:
+        """疎通確認を 1 回だけ行い、同時に待つ呼び出しへ結果を共有する。"""
+        if self.state == "open":
+            return False
+        loop = asyncio.get_running_loop()
+        recovery = self._recovery
+        if recovery is None or recovery.done() or recovery.get_loop() is not loop:
+            recovery = loop.create_task(self._run_recovery(probe, delay))
+            self._recovery = recovery
+        return await asyncio.shield(recovery)
+
+    def reset(self) -> None:
+        self.record_success()
+        self._recovery = None
+
+    def snapshot(self) -> dict[str, Any]:
+        data: dict[str, Any] = dict(self.stats)
+        data["state"] = self.state
+        data["failures"] = self.failures
+        return data
+
+    async def _run_recovery(self, probe, delay: float) -> bool:
+        await asyncio.sleep(delay)
+        try:
+            await probe()
+        except Exception as e:
+            logger.warning("Database probe failed: %s", _sanitize_db_exception(e))
+            self._open()
+            return False
+        self.stats["recoveries"] += 1
+        self.record_success()
+        return True
+
+    def _open(self) -> None:
+        if self.state != "open":
+            self.stats["opened"] += 1
+            logger.error("Database circuit opened after %s failures", self.failures)
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    def _reject(self) -> None:
+        self.stats["rejected"] += 1
+        raise DatabaseUnavailableError("database is temporarily unavailable")
+
+
+db_breaker = CircuitBreaker(DB_BREAKER_FAILURE_THRESHOLD, DB_BREAKER_RESET_SECONDS)
+
+_REPLICA_STATUS = text("SHOW REPLICA STATUS")
+_REPLICA_CHECK_TIMEOUT_SECONDS = 2.0
+
+
+class ReplicaRouter:
+    """replica=True の読み取りを、遅延が許容内のレプリカへ順番に振り分ける。
+
+    遅延（Seconds_Behind_Source）は ``check_interval`` 秒ごとにだけ確認し、
+    結果はワーカー内で共有する。レプリケーション停止・確認失敗・遅延超過の
+    レプリカは次の確認まで使わず、全滅なら呼び出し側が primary で読む。
+    """
+
+    def __init__(self, engines, max_lag_seconds: float, check_interval: float):
+        self.engines = list(engines)
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self._next = 0
+        self._checked: dict[int, tuple[float, bool]] = {}
+        self.stats = {"replica_reads": 0, "primary_reads": 0, "unhealthy": 0}
+
+    async def pick(self):
+        """使えるレプリカのエンジンを返す。無ければ None。"""
+        for _ in range(len(self.engines)):
+            index = self._next % len(self.engines)
+            self._next += 1
+            if await self._is_healthy(index):
+                return self.engines[index]
+        return None
+
+    def mark_unhealthy(self, replica) -> None:
+        """読み取り中に接続が切れたレプリカを次の確認まで外す。"""
+        for index, candidate in enumerate(self.engines):
+            if candidate is replica:
+                self._checked[index] = (time.monotonic(), False)
+                self.stats["unhealthy"] += 1
+
+    def reset(self) -> None:
+        self._checked.clear()
+
+    def snapshot(self) -> dict[str, Any]:
+        data: dict[str, Any] = dict(self.stats)
+        data["configured"] = len(self.engines)
+        data["healthy"] = sum(1 for _, healthy in self._checked.values() if healthy)
+        return data
+
+    async def _is_healthy(self, index: int) -> bool:
+        now = time.monotonic()
+        checked = self._checked.get(index)
+        if checked and now - checked[0] < self.check_interval:
+            return checked[1]
+        # 確認中に来た呼び出しは前回の結果（初回は primary）で進め、確認を重ねない。
+        self._checked[index] = (now, checked[1] if checked else False)
+        healthy = await self._check_lag(self.engines[index])
+        if not healthy:
+            self.stats["unhealthy"] += 1
+        self._checked[index] = (time.monotonic(), healthy)
+        return healthy
+
+    async def _check_lag(self, replica) -> bool:
+        try:
+            row = await asyncio.wait_for(
+                self._replica_status(replica), _REPLICA_CHECK_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            logger.warning("Replica status check failed: %s", _sanitize_db_exception(e))
+            return False
+        # 行が無いのはレプリカとして動いていない、None はレプリケーション停止。
+        lag = row.get("Seconds_Behind_Source") if row else None
+        if lag is None or lag > self.max_lag_seconds:
+            logger.warning("Replica skipped: Seconds_Behind_Source=%s", lag)
+            return False
+        return True
+
+    async def _replica_status(self, replica):
+        async with replica.connect() as conn:
+            return (await conn.execute(_REPLICA_STATUS)).mappings().first()
+
+
+replica_router = ReplicaRouter(
+    replica_engines, DB_REPLICA_MAX_LAG_SECONDS, DB_REPLICA_LAG_CHECK_SECONDS
+)
+
+
+def _named_engines() -> dict[str, Any]:
+    engines = {"primary": engine, "read": read_engine}
+    for index, replica in enumerate(replica_engines):
+        engines[f"replica_{index}"] = replica
+    return engines
+
+
+def get_pool_stats() -> dict[str, Any]:
+    """プールごとの使用中・超過・待ち行列・取り出し待ち時間。"""
+    stats = {}
+    for name, pool_engine in _named_engines().items():
+        gauges = getattr(pool_engine.pool, "gauges", None)
+        if callable(gauges):
+            stats[name] = gauges()
+    return stats
+
+
+def get_db_stats() -> dict[str, Any]:
+    """/admin/metrics 用。遮断器・レプリカの振り分け・プールの状況。"""
+    return {
+        "circuit": db_breaker.snapshot(),
+        "replicas": replica_router.snapshot(),
+        "pools": get_pool_stats(),
+    }
+
+
+async def warm_up_pools(connections: int) -> dict[str, int]:
+    """各プールに ``connections`` 本（pool_size まで）の接続を先に張っておく。
+
+    起動直後の最初のリクエストが接続確立を待たないようにするためのもので、
+    失敗しても起動は止めない。プールごとに張れた本数を返す。
+    """
+    opened: dict[str, int] = {}
+    for name, pool_engine in _named_engines().items():
+        target = min(connections, pool_engine.pool.size())
+        opened[name] = 0
+        if target <= 0:
+            continue
+        try:
+            # 同時に借りておかないと、同じ 1 本を使い回すだけになる。
+            async with AsyncExitStack() as stack:
+                for _ in range(target):
+                    conn = await stack.enter_async_context(pool_engine.connect())
+                    await conn.execute(text("SELECT 1"))
+                    opened[name] += 1
+        except Exception as e:
+            logger.warning(
+                "Pool warm-up for %s stopped after %s connection(s): %s",
+                name,
+                opened[name],
+                _sanitize_db_exception(e),
+            )
+    return opened
+
+
 async def reset_db_connection():
+    """プールを丸ごと破棄する。イベントループごと終わる場合（scheduler の
+    asyncio.run）専用で、リクエスト中の再試行には使わない。"""
     try:
         await db_session.rollback()
     except Exception:  # noqa: S110
@@ -68,15 +447,48 @@ async def reset_db_connection():
         await db_session.remove()
     except Exception:  # noqa: S110
         pass
+    for pool_engine in (engine, read_engine, *replica_engines):
+        try:
+            await pool_engine.dispose()
+        except Exception:  # noqa: S110
+            pass
+    db_breaker.reset()
+    replica_router.reset()
+
+
+async def _discard_session_connection():
+    # 失敗した接続だけを無効化してプールへ返す。他のタスクの接続には触れない。
     try:
-        await engine.dispose()
+        await db_session.invalidate()
     except Exception:  # noqa: S110
         pass
+    try:
+        await db_session.remove()
+    except Exception:  # noqa: S110
+        pass
+
+
+async def _ping():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def _should_retry(exc: Exception, attempt: int, retries: int) -> bool:
+    if not is_retryable_db_error(exc):
+        # DB には届いている（構文・制約違反など）。
+        db_breaker.record_success()
+        return False
+    db_breaker.record_failure()
+    if attempt >= retries:
+        return False
+    logger.warning("Database connection lost, retrying (%s/%s)", attempt + 1, retries)
+    return await db_breaker.recover(_ping, 0.5 * (2**attempt))
 
 
 async def execute_query(query, params=None, fetch=False, retries=2):
-    stmt = query if hasattr(query, "bindparams") else text(query)
+    stmt = query if hasattr(query, "bindparams") else statement(query)
     for attempt in range(retries + 1):
+        db_breaker.before_call()
         try:
             result = await db_session.execute(stmt, params or {})
             if fetch:
@@ -85,16 +497,15 @@ async def execute_query(query, params=None, fetch=False, retries=2):
                     await db_session.rollback()
                 except Exception:  # noqa: S110
                     pass
+                db_breaker.record_success()
                 return rows
             await db_session.commit()
+            db_breaker.record_success()
             return result.rowcount  # type: ignore[attr-defined]
         except Exception as e:
-            if is_retryable_db_error(e) and attempt < retries:
-                logger.warning(
-                    "Database connection lost, retrying (%s/%s)", attempt + 1, retries
-                )
-                await reset_db_connection()
-                await asyncio.sleep(0.5 * (2**attempt))
+            if is_retryable_db_error(e):
+                await _discard_session_connection()
+            if await _should_retry(e, attempt, retries):
                 continue
             logger.error("Database query failed: %s", _sanitize_db_exception(e))
             try:
@@ -104,6 +515,132 @@ async def execute_query(query, params=None, fetch=False, retries=2):
             raise
 
 
+async def execute_batches(query, params_list, chunk_size=None) -> int:
+    """同じ文をパラメータのリストで executemany し、影響行数の合計を返す。
+
+    呼び出し側の transaction（``async with db_session.begin()``）の中で使い、
+    コミットはしない。INSERT ... VALUES はドライバが複数行の VALUES にまとめるので、
+    ``chunk_size`` 件ごとに 1 往復で済む。
+    """
+    rows = list(params_list)
+    stmt = query if hasattr(query, "bindparams") else statement(query)
+    size = chunk_size or DB_BULK_CHUNK_SIZE
+    total = 0
+    for start in range(0, len(rows), size):
+        result = await db_session.execute(stmt, rows[start : start + size])
+        total += max(result.rowcount or 0, 0)  # type: ignore[attr-defined]
+    return total
+
+
+async def execute_many(query, params_list, chunk_size=None, retries=2) -> int:
+    """execute_batches を 1 トランザクションで実行してコミットする。
+
+    再試行は execute_query と同じで、接続断ならトランザクションごとやり直す。
+    """
+    rows = list(params_list)
+    if not rows:
+        return 0
+    for attempt in range(retries + 1):
+        db_breaker.before_call()
+        try:
+            total = await execute_batches(query, rows, chunk_size)
+            await db_session.commit()
+            db_breaker.record_success()
+            return total
+        except Exception as e:
+            if is_retryable_db_error(e):
+                await _discard_session_connection()
+            if await _should_retry(e, attempt, retries):
+                continue
+            logger.error("Database batch failed: %s", _sanitize_db_exception(e))
+            try:
+                await db_session.rollback()
+            except Exception:  # noqa: S110
+                pass
+            raise
+    # _should_retry は最後の試行で False を返すため、ここには来ない。
+    raise RuntimeError("execute_many: retries exhausted")
+
+
+async def fetch_all(query, params=None, retries=2, replica=False):
+    """SELECT を読み取り専用プールで実行し、行（RowMapping）のリストを返す。
+
+    db_session のトランザクションには参加しないため、同じトランザクション内の
+    未コミットの変更は見えない。transaction 内の読み取りは db_session を使う。
+
+    ``replica=True`` は数秒古くてもよい読み取り（一覧・集計・期限切れの走査）に付ける。
+    レプリカが使えて、このリクエストでまだ書き込んでいなければレプリカで読む。
+    """
+    return await _run_read(query, params, retries, first=False, replica=replica)
+
+
+async def fetch_one(query, params=None, retries=2, replica=False):
+    """fetch_all と同じ経路で先頭の 1 行だけを返す。該当なしなら None。"""
+    return await _run_read(query, params, retries, first=True, replica=replica)
+
+
+async def fetch_rows(query, params=None, retries=2, replica=False):
+    """fetch_all と同じ経路で、行を RowMapping に包まずタプル（Row）のまま返す。
+
+    Row は列名の索引を結果全体で共有するタプルで、``row.title`` や
+    ``for item_id, name in rows`` で読める。件数の多い一覧を自前の dict へ
+    詰め直す箇所では、RowMapping → dict のコピーを挟まずに済む。
+    """
+    return await _run_read(
+        query, params, retries, first=False, replica=replica, mappings=False
+    )
+
+
+async def _read_on(pool_engine, stmt, params, first, mappings=True):
+    # 切断を検知した接続は SQLAlchemy がその場で無効化してプールから外す。
+    async with pool_engine.connect() as conn:
+        result = await conn.execute(stmt, params or {})
+        if mappings:
+            result = result.mappings()
+        return result.first() if first else result.all()
+
+
+async def _read_replica(stmt, params, first, mappings=True):
+    """レプリカで読めたら (True, 結果)、primary で読むべきなら (False, None)。"""
+    replica = None
+    if replica_router.engines and not wrote_in_request():
+        replica = await replica_router.pick()
+    if replica is None:
+        replica_router.stats["primary_reads"] += 1
+        return False, None
+    try:
+        rows = await _read_on(replica, stmt, params, first, mappings)
+    except Exception as e:
+        if not is_retryable_db_error(e):
+            raise
+        # レプリカの障害は primary の遮断器に数えず、primary で読み直す。
+        logger.warning("Replica read failed: %s", _sanitize_db_exception(e))
+        replica_router.mark_unhealthy(replica)
+        replica_router.stats["primary_reads"] += 1
+        return False, None
+    replica_router.stats["replica_reads"] += 1
+    return True, rows
+
+
+async def _run_read(query, params, retries, first, replica=False, mappings=True):
+    stmt = query if hasattr(query, "bindparams") else statement(query)
+    if replica:
+        served, rows = await _read_replica(stmt, params, first, mappings)
+        if served:
+            return rows
+    for attempt in range(retries + 1):
+        db_breaker.before_call()
+        try:
+            rows = await _read_on(read_engine, stmt, params, first, mappings)
+            db_breaker.record_success()
+            return rows
+        except Exception as e:
+            if await _should_retry(e, attempt, retries):
+                continue
+            logger.error("Database read failed: %s", _sanitize_db_exception(e))
+            raise
+
+
 def _sanitize_db_exception(exc: Exception) -> str:
     msg = str(exc)
     msg = re.sub(r"(?i)(password\s*=\s*)([^,\s;]+)", r"\1***", msg)
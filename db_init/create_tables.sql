@@ -17,7 +17,7 @@ CREATE TABLE fsqr (
     INDEX idx_fsqr_id_password_lookup (id, password_lookup_hash),
     INDEX idx_fsqr_secure_id (secure_id),
     INDEX idx_fsqr_time (time),
-    INDEX idx_fsqr_expires_at (expires_at)
+    INDEX idx_fsqr_expires_at_secure_id (expires_at, secure_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE TABLE share_links (
@@ -41,15 +41,17 @@ CREATE TABLE room (
     time DATETIME NOT NULL,               -- レコードの挿入時間
     id VARCHAR(255) NOT NULL,             -- ユーザーID
     password VARCHAR(255) NOT NULL,       -- パスワード
+    password_lookup_hash VARCHAR(64) NULL, -- 検索用パスワードHMAC
     room_id VARCHAR(255) NOT NULL,        -- 部屋ID
     retention_days INT NOT NULL DEFAULT 1, -- 旧互換用の日数（常に1日）
     retention_hours INT NOT NULL DEFAULT 24, -- 自動削除までの時間
     expires_at DATETIME NOT NULL,         -- 自動削除対象日時
     UNIQUE KEY uq_room_room_id (room_id),
     INDEX idx_room_id_password (id, password),
+    INDEX idx_room_id_password_lookup (id, password_lookup_hash),
     INDEX idx_room_room_id (room_id),
     INDEX idx_room_time (time),
-    INDEX idx_room_expires_at (expires_at)
+    INDEX idx_room_expires_at_room_id (expires_at, room_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 
@@ -63,6 +65,7 @@ CREATE TABLE note_room (
     time DATETIME NOT NULL,
     id VARCHAR(255) NOT NULL,
     password VARCHAR(255) NOT NULL,
+    password_lookup_hash VARCHAR(64) NULL,
     room_id VARCHAR(255) NOT NULL,
     retention_days INT NOT NULL DEFAULT 1,
     retention_hours INT NOT NULL DEFAULT 24,
@@ -73,6 +76,7 @@ CREATE TABLE note_room (
     UNIQUE KEY uq_note_room_room_id (room_id),
     UNIQUE KEY uq_note_room_share_token_hash (share_token_hash),
     INDEX idx_note_room_id_password (id, password),
+    INDEX idx_note_room_id_password_lookup (id, password_lookup_hash),
     INDEX idx_note_room_room_id_password (room_id, password),
     INDEX idx_note_room_time (time),
     INDEX idx_note_room_expires_status (status, expires_at)
@@ -99,6 +103,7 @@ CREATE TABLE task_room (
     time DATETIME NOT NULL,
     id VARCHAR(255) NOT NULL,
     password VARCHAR(255) NOT NULL,
+    password_lookup_hash VARCHAR(64) NULL,
     room_id VARCHAR(255) NOT NULL,
     retention_days INT NOT NULL DEFAULT 1,
     retention_hours INT NOT NULL DEFAULT 24,
@@ -109,6 +114,7 @@ CREATE TABLE task_room (
     UNIQUE KEY uq_task_room_room_id (room_id),
     UNIQUE KEY uq_task_room_share_token_hash (share_token_hash),
     INDEX idx_task_room_id_password (id, password),
+    INDEX idx_task_room_id_password_lookup (id, password_lookup_hash),
     INDEX idx_task_room_time (time),
     INDEX idx_task_room_expires_status (status, expires_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -156,3 +162,20 @@ CREATE TABLE task_item_tag (
     CONSTRAINT fk_task_item_tag_tag
         FOREIGN KEY (tag_id) REFERENCES task_tag(tag_id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- =======================
+--  トップページ検索用のサービス横断索引
+-- =======================
+CREATE TABLE room_directory (
+    suji BIGINT AUTO_INCREMENT PRIMARY KEY,
+    service_key VARCHAR(20) NOT NULL,       -- fsqr / group / note / task
+    id VARCHAR(255) NOT NULL,               -- ユーザーID
+    password VARCHAR(255) NOT NULL,         -- 各サービスと同じパスワードハッシュ
+    password_lookup_hash VARCHAR(64) NULL,  -- 検索用パスワードHMAC（サービス共通）
+    resource_id VARCHAR(255) NOT NULL,      -- secure_id / room_id
+    expires_at DATETIME NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'active',
+    UNIQUE KEY uq_room_directory_resource (service_key, resource_id),
+    INDEX idx_room_directory_lookup (id, password_lookup_hash),
+    INDEX idx_room_directory_expires_at (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
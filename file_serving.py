@@ -6,19 +6,36 @@
 認可だけをアプリが行い、実ファイルのバイト送出は nginx に委譲する。
 
 ``X_ACCEL_REDIRECT_ENABLED`` が無効な環境（ローカル開発・テスト・nginx を介さない
-起動）では従来どおり :class:`starlette.responses.FileResponse` で配信するため、
-挙動は完全に後方互換となる。
+起動）や、保存ルートの外にあるファイルは :class:`ConditionalFileResponse` で配信する。
+nginx の静的配信と同じく Range（複数範囲・If-Range を含む）と ETag /
+Last-Modified による条件付き GET に対応し、途中で切れたダウンロードの再開や、
+変わっていないファイルの再取得の省略ができる。
+
+ASGI サーバーが ``http.response.pathsend`` を提供すればファイル全体の送出は
+サーバーに任せ（FileResponse のまま）、無い場合（uvicorn）は大きめのチャンクで
+読み出して送る。
 """
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import logging
 import os
+import stat
 import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
 from typing import Mapping, Optional
 
 from starlette.background import BackgroundTask
-from starlette.responses import FileResponse, Response
+from starlette.datastructures import Headers
+from starlette.responses import (
+    FileResponse,
+    MalformedRangeHeader,
+    RangeNotSatisfiable,
+    Response,
+)
+from starlette.types import Receive, Scope, Send
 
 from settings import X_ACCEL_LOCATIONS, X_ACCEL_REDIRECT_ENABLED
 
@@ -43,6 +60,110 @@ def _build_accel_uri(internal_prefix: str, fs_root: str, path: str) -> Optional[
     return internal_prefix.rstrip("/") + "/" + quoted
 
 
+# 304 応答に引き継ぐヘッダー（本文を表すヘッダーは送らない）。
+_NOT_MODIFIED_HEADERS = ("cache-control", "etag", "expires", "last-modified", "vary")
+# これより多い範囲指定は、細切れ要求による負荷を避けるため無視して全体を返す。
+MAX_RANGES = 16
+
+
+class ConditionalFileResponse(FileResponse):
+    """Range と条件付き GET に対応したファイル配信レスポンス。
+
+    - ETag は inode・サイズ・更新時刻（ナノ秒）から作る強い検証子。置き換えられた
+      ファイルは別の値になるため、If-Range で古い断片を継ぎ足すことはない。
+    - If-None-Match（優先）/ If-Modified-Since が一致すれば GET / HEAD に 304 を返す。
+    - Range は FSQR のように POST で配信する経路でも受け付ける。解釈できない
+      指定や範囲が多すぎる指定は無視して全体を 200 で返す。
+    """
+
+    # Python で読み出す場合のチャンク長。スレッドとの往復回数を Starlette 既定
+    # （64KiB）の 1/4 に減らす。
+    chunk_size = 256 * 1024
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        etag_base = (
+            f"{stat_result.st_ino}-{stat_result.st_size}-{stat_result.st_mtime_ns}"
+        )
+        etag = hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()
+        self.headers["content-length"] = str(stat_result.st_size)
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["etag"] = f'"{etag}"'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            try:
+                stat_result = await asyncio.to_thread(os.stat, self.path)
+            except FileNotFoundError:
+                raise RuntimeError(f"File at path {self.path} does not exist.")
+            if not stat.S_ISREG(stat_result.st_mode):
+                raise RuntimeError(f"File at path {self.path} is not a file.")
+            # 親クラスが同じ stat を使い、検証子と本文がずれないようにする。
+            self.stat_result = stat_result
+            self.set_stat_headers(stat_result)
+
+        request_headers = Headers(scope=scope)
+        if scope["method"].upper() in ("GET", "HEAD") and self._is_not_modified(
+            request_headers
+        ):
+            headers = {
+                key: self.headers[key]
+                for key in _NOT_MODIFIED_HEADERS
+                if key in self.headers
+            }
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            if self.background is not None:
+                await self.background()
+            return
+
+        http_range = request_headers.get("range")
+        if http_range is not None and not self._is_usable_range(http_range):
+            scope = {
+                **scope,
+                "headers": [
+                    (key, value)
+                    for key, value in scope["headers"]
+                    if key.lower() != b"range"
+                ],
+            }
+        await super().__call__(scope, receive, send)
+
+    def _is_not_modified(self, request_headers: Headers) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            # 弱い比較（W/ を外して比べる）。If-Modified-Since より優先する。
+            if if_none_match.strip() == "*":
+                return True
+            etag = self.headers["etag"]
+            return any(
+                _strip_weak_prefix(tag.strip()) == etag
+                for tag in if_none_match.split(",")
+            )
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        return int(self.stat_result.st_mtime) <= since
+
+    def _is_usable_range(self, http_range: str) -> bool:
+        if http_range.count(",") >= MAX_RANGES:
+            return False
+        try:
+            self._parse_range_header(http_range, self.stat_result.st_size)
+        except MalformedRangeHeader:
+            return False
+        except RangeNotSatisfiable:
+            # 416 の応答は親クラスに任せる。
+            return True
+        return True
+
+
+def _strip_weak_prefix(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
 def build_file_response(
     path: str,
     *,
@@ -55,9 +176,15 @@ def build_file_response(
 
     ``X_ACCEL_REDIRECT_ENABLED`` かつ ``accel_scope`` が設定済みで、対象ファイルが
     そのスコープの保存ルート配下にある場合は ``X-Accel-Redirect`` で nginx に委譲する。
-    それ以外は :class:`FileResponse` を返す。
+    それ以外は :class:`ConditionalFileResponse` を返す。
     """
-    response_headers = dict(headers or {})
+    # Content-Length は配信時の stat（または nginx）が実体から決める。呼び出し側の
+    # 値は stat との間にファイルが変わると不整合になり、Range 応答とも合わない。
+    response_headers = {
+        key: value
+        for key, value in (headers or {}).items()
+        if key.lower() != "content-length"
+    }
 
     if X_ACCEL_REDIRECT_ENABLED and accel_scope:
         location = X_ACCEL_LOCATIONS.get(accel_scope)
@@ -65,11 +192,6 @@ def build_file_response(
             internal_prefix, fs_root = location
             accel_uri = _build_accel_uri(internal_prefix, fs_root, path)
             if accel_uri is not None:
-                # nginx が実体ファイルから Content-Length を再計算するため、
-                # アプリ側の値を残すと不整合になる。削除して nginx に任せる。
-                for key in list(response_headers):
-                    if key.lower() == "content-length":
-                        del response_headers[key]
                 response_headers["X-Accel-Redirect"] = accel_uri
                 # nginx 側のロケーションで Content-Type を確定させるが、保険として
                 # アプリの意図する型も渡しておく。
@@ -81,7 +203,7 @@ def build_file_response(
                 )
             logger.debug("X-Accel offload skipped (path outside scope root): %s", path)
 
-    return FileResponse(
+    return ConditionalFileResponse(
         path,
         media_type=media_type,
         headers=response_headers,
@@ -24,8 +24,8 @@ bind = "0.0.0.0:5000"
 worker_class = "uvicorn.workers.UvicornWorker"
 
 # 非同期ワーカーのため少数で多数の同時接続を捌ける。既定は従来同様 4。
-# CPU コア数の多いホストでは WEB_CONCURRENCY で引き上げる（DB の max_connections
-# とプール設定の整合を必ず確認すること）。
+# CPU コア数の多いホストでは WEB_CONCURRENCY で引き上げる。DB 接続プールは
+# settings.db_pool_sizes がこの値と DB_MAX_CONNECTIONS から大きさを決める。
 workers = _int_env("WEB_CONCURRENCY", 4)
 
 # 一定リクエストごとにワーカーを入れ替え、長時間稼働によるメモリ肥大を防ぐ。
@@ -231,6 +231,18 @@ class FsqrUploadInput(BaseModel):
         return v
 
 
+class FsqrUploadSessionInput(BaseModel):
+    """FSQR 分割アップロードのセッション作成 API の入力。
+
+    使用箇所: FSQR /upload/sessions
+    size は暗号化後のペイロードのバイト数。上限はルート側で確かめる。
+    """
+
+    filename: str = Field(min_length=1, max_length=255)
+    file_type: Literal["single", "multiple"] = "multiple"
+    size: int = Field(gt=0)
+
+
 class NoteExportInput(BaseModel):
     """ノートの TXT / PDF 出力 API の POST ボディ。"""
 
@@ -1,9 +1,28 @@
+import asyncio
+import hashlib
 import hmac
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, TypeVar
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from settings import PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WORKERS, SECRET_KEY
+
+logger = logging.getLogger(__name__)
+
 _HASH_PREFIXES = ("scrypt:", "pbkdf2:", "argon2:", "bcrypt:")
 
+_T = TypeVar("_T")
+
+
+class PasswordHashBusyError(RuntimeError):
+    """scrypt 用プロセスプールの待ち行列が上限に達したことを示す。"""
+
 
 def hash_password(password: str) -> str:
     return generate_password_hash(password, method="scrypt")
@@ -28,3 +47,131 @@ def verify_password(stored_password: str | None, provided_password: str | None)
 
 def needs_hash_upgrade(stored_password: str | None) -> bool:
     return isinstance(stored_password, str) and not is_password_hashed(stored_password)
+
+
+def password_lookup_hash(scope: str, id_val: str, password: str) -> str:
+    """ID とパスワードから索引用の HMAC を作る。
+
+    scrypt のハッシュは salt 付きで検索に使えないため、ログイン時はこの値で
+    対象行を 1 件に絞り込んでから verify_password で本検証する。``scope`` は
+    サービス名（``fsqr`` / ``group`` / ``note`` / ``task``）で、同じ ID と
+    パスワードでもサービスごとに異なる値になる。
+    """
+    payload = f"{scope}:{id_val}:{password}".encode("utf-8")
+    secret = (SECRET_KEY or "").encode("utf-8")
+    if secret:
+        return hmac.new(secret, payload, hashlib.sha256).hexdigest()
+    return hashlib.sha256(payload).hexdigest()
+
+
+# ────────────────────────────────────────────
+# scrypt の非同期実行
+# ────────────────────────────────────────────
+# scrypt は 1 回で数十ミリ秒の CPU を使うため、イベントループ上で直接実行すると
+# 同じワーカーのダウンロードや WebSocket まで止まる。ワーカーごとに小さな
+# ProcessPoolExecutor を持ち、待ち行列の深さを PASSWORD_HASH_MAX_PENDING で抑える。
+# PASSWORD_HASH_WORKERS=0 のときはプロセスを作らずスレッドで実行する。
+_pool_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+_pending = 0
+_stats: dict[str, Any] = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "rejected": 0,
+    "pool_restarts": 0,
+    "max_pending": 0,
+    "total_seconds": 0.0,
+}
+
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # fork だとイベントループや Redis 接続を抱えたまま複製されるため spawn を使う。
+            _pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _discard_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+            _stats["pool_restarts"] += 1
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_password_pool() -> None:
+    """ワーカー終了時にプロセスプールを閉じる。"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_password_pool_stats() -> dict[str, Any]:
+    """プロセスプールの利用状況のスナップショットを返す。"""
+    with _pool_lock:
+        snapshot = dict(_stats)
+        snapshot["pending"] = _pending
+        snapshot["workers"] = PASSWORD_HASH_WORKERS
+        snapshot["max_queue"] = PASSWORD_HASH_MAX_PENDING
+    return snapshot
+
+
+async def _run_offloaded(func: Callable[..., _T], *args: Any) -> _T:
+    global _pending
+    with _pool_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise PasswordHashBusyError("password hashing queue is full")
+        _pending += 1
+        _stats["submitted"] += 1
+        _stats["max_pending"] = max(_stats["max_pending"], _pending)
+
+    started = time.perf_counter()
+    succeeded = False
+    try:
+        pool = _get_pool()
+        if pool is None:
+            result = await asyncio.to_thread(func, *args)
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(pool, func, *args)
+            except BrokenProcessPool:
+                # 子プロセスが落ちた場合はプールを作り直し、この呼び出しはスレッドで完了させる。
+                logger.warning("Password hashing pool is broken; recreating it")
+                _discard_pool(pool)
+                result = await asyncio.to_thread(func, *args)
+        succeeded = True
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        with _pool_lock:
+            _pending -= 1
+            _stats["completed" if succeeded else "failed"] += 1
+            _stats["total_seconds"] += elapsed
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_offloaded(hash_password, password)
+
+
+async def verify_password_async(
+    stored_password: str | None, provided_password: str | None
+) -> bool:
+    # 平文の旧形式や型不一致は定数時間比較だけで済むため、プールを使わない。
+    if not is_password_hashed(stored_password) or not isinstance(
+        provided_password, str
+    ):
+        return verify_password(stored_password, provided_password)
+    return await _run_offloaded(verify_password, stored_password, provided_password)
@@ -0,0 +1,125 @@
+"""リクエスト単位の DB 問い合わせ計測と、遅いクエリのログ。
+
+SQLAlchemy の Engine に cursor 実行前後のイベントを張るので、execute_query /
+fetch_all だけでなく ``db_session.execute`` を直接使う箇所も同じように数える。
+結果は db_session_middleware が ``Server-Timing: db;dur=...`` として返し、
+DB_PROFILE_LOG を有効にすると 1 リクエスト 1 行のログにも書く。
+
+SQL は値を ``?`` に置き換えた指紋（fingerprint）で扱うため、ログにパラメータは
+残らない。IN 句の長さ違いも同じ指紋にまとめる。
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import time
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import DB_SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("database.slow_query")
+
+_START_KEY = "query_profiler_started"
+
+_FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%\(\w+\)s|%s|:\w+"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?+)"),
+    (re.compile(r"\s+"), " "),
+)
+
+
+def fingerprint(sql: str) -> str:
+    """値とホワイトスペースを正規化した SQL を返す（ログ・集計用）。"""
+    for pattern, replacement in _FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+@dataclass
+class QueryProfile:
+    count: int = 0
+    total_ms: float = 0.0
+    slowest_ms: float = 0.0
+    slowest_sql: str = ""
+
+    def add(self, statement: str, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms >= self.slowest_ms:
+            self.slowest_ms = elapsed_ms
+            self.slowest_sql = statement
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.total_ms:.1f};desc="{self.count} queries"'
+
+    def as_log_fields(self) -> dict[str, object]:
+        return {
+            "queries": self.count,
+            "db_ms": round(self.total_ms, 1),
+            "slowest_ms": round(self.slowest_ms, 1),
+            "slowest": fingerprint(self.slowest_sql) if self.slowest_sql else "",
+        }
+
+
+# 子タスクにも同じオブジェクトが引き継がれるので、gather した問い合わせも数える。
+_request_profile: ContextVar[Optional[QueryProfile]] = ContextVar(
+    "request_query_profile", default=None
+)
+
+
+def begin_request_profile() -> Token:
+    """リクエストの開始時に呼び、終了時に end_request_profile へ渡す。"""
+    return _request_profile.set(QueryProfile())
+
+
+def end_request_profile(token: Token) -> Optional[QueryProfile]:
+    profile = _request_profile.get()
+    _request_profile.reset(token)
+    return profile
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_START_KEY, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get(_START_KEY)
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+    profile = _request_profile.get()
+    if profile is not None:
+        profile.add(statement, elapsed_ms)
+    if DB_SLOW_QUERY_MS and elapsed_ms >= DB_SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            "Slow query %.1fms: %s", elapsed_ms, fingerprint(statement)
+        )
+
+
+def _handle_error(exception_context) -> None:
+    # 失敗した実行は after_cursor_execute が呼ばれないので、開始時刻を捨てる。
+    conn = exception_context.connection
+    started = conn.info.get(_START_KEY) if conn is not None else None
+    if started:
+        started.pop()
+
+
+def install() -> None:
+    """すべての Engine に計測用のイベントを張る（何度呼んでも 1 回だけ）。"""
+    if event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+
+
+install()
@@ -0,0 +1,61 @@
+"""1 リクエストの中だけ有効な、ルーム参照などの結果のメモ。
+
+認可ヘルパーとハンドラーが同じルームを続けて引くと、そのたびに L1 / Redis /
+MySQL へ問い合わせることになる。``@request_memo`` を付けた関数は、
+db_session_middleware が開いたリクエストの中では (関数, 引数) ごとに 1 回だけ
+実行し、以降は同じ結果を返す。
+
+- リクエストの外（scheduler・WebSocket など）では何もせずに毎回実行する。
+- db_session のコミット（database.mark_primary_write）で全て捨てるので、
+  書き込んだ後の参照は最新の値になる。
+- 例外は覚えない。返り値は呼び出し元の間で共有されるので書き換えないこと。
+"""
+
+from __future__ import annotations
+
+import functools
+from contextvars import ContextVar, Token
+from typing import Any, Optional
+
+# 子タスクにも同じ dict が引き継がれるので、gather した呼び出しとも共有する。
+_request_memo: ContextVar[Optional[dict[tuple, Any]]] = ContextVar(
+    "request_memo", default=None
+)
+
+
+def begin_request_memo() -> Token:
+    """リクエストの開始時に呼び、終了時に end_request_memo へ渡す。"""
+    return _request_memo.set({})
+
+
+def end_request_memo(token: Token) -> None:
+    _request_memo.reset(token)
+
+
+def clear_request_memo() -> None:
+    memo = _request_memo.get()
+    if memo is not None:
+        memo.clear()
+
+
+def request_memo(func):
+    """非同期関数の結果を、リクエストの間だけ引数ごとに覚える。"""
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        memo = _request_memo.get()
+        if memo is None:
+            return await func(*args, **kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            if key in memo:
+                return memo[key]
+        except TypeError:
+            # ハッシュできない引数は覚えない。
+            return await func(*args, **kwargs)
+        result = await func(*args, **kwargs)
+        memo[key] = result
+        return result
+
+    return wrapper
@@ -0,0 +1,165 @@
+"""サービス横断のルーム索引（トップページ検索用）。
+
+FSQR / Group / Note / Task の各サービスは作成・削除のたびに ``room_directory``
+へ 1 行を登録・削除する。トップページの一括検索はこの表を ID と索引用 HMAC で
+1 回引くだけで済み、候補ごとに scrypt を 1 回だけ検証する。
+
+索引は補助的な写しなので、書き込みに失敗してもルーム本体の作成・削除は止めない
+（警告ログのみ）。検索側は一致したルームが各サービスで有効かを確かめ、消し損ねた
+行を外す。登録し損ねた行は ROOM_DIRECTORY_FALLBACK を有効にすると拾える。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any
+
+from sql_statements import statement
+
+from database import execute_query, fetch_all
+from password_security import password_lookup_hash, verify_password_async
+
+logger = logging.getLogger(__name__)
+
+# 各サービスの password_lookup_hash とは別のスコープにし、サービスをまたいで
+# 同じ値になるようにする（1 回の HMAC 計算で全サービスを引ける）。
+LOOKUP_SCOPE = "directory"
+
+
+def hash_directory_lookup(id_val: str, password: str) -> str:
+    return password_lookup_hash(LOOKUP_SCOPE, id_val, password)
+
+
+async def register_room(
+    *,
+    service_key: str,
+    id_val: str,
+    password: str,
+    hashed_password: str,
+    resource_id: str,
+    retention_hours: int,
+) -> None:
+    """作成したルームを索引へ登録する。``hashed_password`` はサービス側と同じ値。"""
+    try:
+        await execute_query(
+            statement("""
+            INSERT INTO room_directory (
+                service_key, id, password, password_lookup_hash,
+                resource_id, expires_at, status
+            )
+            VALUES (
+                :service_key, :id, :password, :password_lookup_hash,
+                :resource_id, DATE_ADD(NOW(), INTERVAL :retention_hours HOUR),
+                'active'
+            )
+            ON DUPLICATE KEY UPDATE
+                id = VALUES(id),
+                password = VALUES(password),
+                password_lookup_hash = VALUES(password_lookup_hash),
+                expires_at = VALUES(expires_at),
+                status = 'active'
+            """),
+            {
+                "service_key": str(service_key),
+                "id": id_val,
+                "password": hashed_password,
+                "password_lookup_hash": hash_directory_lookup(id_val, password),
+                "resource_id": resource_id,
+                "retention_hours": retention_hours,
+            },
+        )
+    except Exception:
+        logger.warning(
+            "Failed to register room in directory: service=%s resource_id=%s",
+            service_key,
+            resource_id,
+            exc_info=True,
+        )
+
+
+async def remove_room(service_key: str, resource_id: str) -> None:
+    """削除・期限切れになったルームを索引から外す。"""
+    try:
+        await execute_query(
+            statement("""
+            DELETE FROM room_directory
+            WHERE service_key = :service_key AND resource_id = :resource_id
+            """),
+            {"service_key": str(service_key), "resource_id": resource_id},
+        )
+    except Exception:
+        logger.warning(
+            "Failed to remove room from directory: service=%s resource_id=%s",
+            service_key,
+            resource_id,
+            exc_info=True,
+        )
+
+
+async def remove_service_rooms(service_key: str) -> None:
+    """サービス単位の全削除（管理画面の all_remove）に合わせて索引を空にする。"""
+    try:
+        await execute_query(
+            statement("DELETE FROM room_directory WHERE service_key = :service_key"),
+            {"service_key": str(service_key)},
+        )
+    except Exception:
+        logger.warning(
+            "Failed to clear room directory: service=%s", service_key, exc_info=True
+        )
+
+
+async def find_rooms(id_val: str, password: str) -> list[dict[str, Any]]:
+    """ID とパスワードに一致する有効なルームを全サービスから探す。
+
+    索引用 HMAC が一致する行に加え、移行直後で HMAC が未設定（NULL）の行も
+    候補にし、検証に成功した時点で HMAC を埋める。返り値は
+    ``{"service_key": ..., "resource_id": ...}`` のリスト。
+    """
+    lookup_hash = hash_directory_lookup(id_val, password)
+    rows = await fetch_all(
+        statement("""
+        SELECT suji, service_key, resource_id, password, password_lookup_hash
+        FROM room_directory
+        WHERE id = :id
+          AND (password_lookup_hash = :password_lookup_hash
+               OR password_lookup_hash IS NULL)
+          AND status = 'active'
+          AND expires_at > NOW()
+        """),
+        {"id": id_val, "password_lookup_hash": lookup_hash},
+    )
+    if not rows:
+        return []
+
+    verified = await asyncio.gather(
+        *(verify_password_async(row["password"], password) for row in rows)
+    )
+    matches = []
+    for row, ok in zip(rows, verified):
+        if not ok:
+            continue
+        if row.get("password_lookup_hash") is None:
+            await _backfill_lookup_hash(row["suji"], lookup_hash)
+        matches.append(
+            {"service_key": row["service_key"], "resource_id": row["resource_id"]}
+        )
+    return matches
+
+
+async def _backfill_lookup_hash(suji: int, lookup_hash: str) -> None:
+    try:
+        await execute_query(
+            statement("""
+            UPDATE room_directory SET password_lookup_hash = :password_lookup_hash
+            WHERE suji = :suji AND password_lookup_hash IS NULL
+            """),
+            {"suji": suji, "password_lookup_hash": lookup_hash},
+        )
+    except Exception:
+        logger.warning(
+            "Failed to backfill room directory lookup hash: suji=%s",
+            suji,
+            exc_info=True,
+        )
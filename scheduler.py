@@ -9,13 +9,17 @@ from apscheduler.schedulers.blocking import BlockingScheduler
 
 import log_config  # noqa: F401  (configure logging)
 from database import reset_db_connection
-from FSQR import fsqr_data
+from FSQR import fsqr_data, fsqr_upload_sessions
 from Group import group_data
 from migration_runner import run_migrations
 from Note import note_data
 from Task import task_data
 from Note.note_realtime import publish_room_expired
-from settings import REDIS_URL
+from settings import (
+    FSQR_UPLOAD_DIR,
+    FSQR_UPLOAD_SESSION_TTL_SECONDS,
+    REDIS_URL,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -59,6 +63,14 @@ def remove_expired_fsqr():
     asyncio.run(_remove_expired_fsqr_async())
 
 
+@exclusive_job
+def remove_stale_fsqr_uploads():
+    # 中断された分割アップロードと、受信途中で残った一時ファイルを消す。
+    fsqr_upload_sessions.remove_stale_upload_files(
+        FSQR_UPLOAD_DIR, FSQR_UPLOAD_SESSION_TTL_SECONDS
+    )
+
+
 async def _remove_expired_group_rooms_async():
     try:
         await group_data.remove_expired_rooms()
@@ -121,6 +133,13 @@ def run_scheduler():
         id="remove_expired_fsqr",
         replace_existing=True,
     )
+    scheduler.add_job(
+        remove_stale_fsqr_uploads,
+        trigger="interval",
+        minutes=15,
+        id="remove_stale_fsqr_uploads",
+        replace_existing=True,
+    )
     scheduler.add_job(
         remove_expired_group_rooms,
         trigger="interval",
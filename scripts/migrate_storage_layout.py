@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""FSQR / Group の保存ファイルを振り分け後の配置（storage_layout）へ移す。
+
+サービスを止めずに実行できるよう、2 段階で移す。
+
+1. 直下の各ファイルを振り分け後の位置へハードリンクする。以降の読み取りは
+   新しい位置で見つかる。
+2. ``--grace-seconds`` 待ってから直下の元のリンクを消す。直前に直下のパスを
+   解決したリクエストが、ファイルを開き終えるまでの猶予。
+
+猶予中に利用者が削除したファイル（新しい位置から消えたもの）は、直下も消す。
+既定は確認だけ行い、``--apply`` を付けたときに移す。
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+import storage_layout  # noqa: E402
+
+FSQR_SUFFIXES = (".enc", ".zip")
+
+Move = tuple[str, str]
+
+
+def _entries(root: str) -> list[os.DirEntry]:
+    try:
+        return sorted(os.scandir(root), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return []
+
+
+def plan_fsqr_moves(root: str) -> list[Move]:
+    """直下の ``<secure_id>.enc/.zip``（一時ファイルを除く）の移動先。"""
+    moves = []
+    for entry in _entries(root):
+        if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+            continue
+        secure_id, suffix = os.path.splitext(entry.name)
+        if suffix not in FSQR_SUFFIXES:
+            continue
+        moves.append(
+            (entry.path, storage_layout.sharded_path(root, secure_id, entry.name))
+        )
+    return moves
+
+
+def plan_group_moves(root: str) -> list[Move]:
+    """直下のルームフォルダにある各ファイルの移動先。"""
+    moves = []
+    for room in _entries(root):
+        if (
+            room.name.startswith(".")
+            or storage_layout.is_shard_dir_name(room.name)
+            or not room.is_dir(follow_symlinks=False)
+        ):
+            continue
+        target_dir = storage_layout.sharded_path(root, room.name, room.name)
+        for entry in _entries(room.path):
+            if entry.is_file(follow_symlinks=False):
+                moves.append((entry.path, os.path.join(target_dir, entry.name)))
+    return moves
+
+
+def link_into_layout(moves: list[Move]) -> list[Move]:
+    """新しい位置にハードリンクを張り、張れた（または張ってあった）ものを返す。"""
+    linked = []
+    for source, target in moves:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except FileNotFoundError:
+            # 計画後に削除された。
+            continue
+        except FileExistsError:
+            if not os.path.samefile(source, target):
+                print(f"skip (another file exists at {target}): {source}")
+                continue
+        linked.append((source, target))
+    return linked
+
+
+def unlink_sources(moves: list[Move]) -> int:
+    removed = 0
+    for source, target in moves:
+        try:
+            if os.path.exists(target) and not os.path.samefile(source, target):
+                print(f"skip (replaced during migration): {source}")
+                continue
+            os.remove(source)
+        except FileNotFoundError:
+            continue
+        removed += 1
+    return removed
+
+
+def remove_empty_room_folders(root: str) -> None:
+    for room in _entries(root):
+        if room.is_dir(follow_symlinks=False) and not storage_layout.is_shard_dir_name(
+            room.name
+        ):
+            try:
+                os.rmdir(room.path)
+            except OSError:
+                # 空でない（移行後に書かれた）フォルダは残す。
+                pass
+
+
+def migrate(
+    fsqr_root: str, group_root: str, *, grace_seconds: float, apply: bool
+) -> int:
+    fsqr_moves = plan_fsqr_moves(fsqr_root)
+    group_moves = plan_group_moves(group_root)
+    moves = fsqr_moves + group_moves
+    print(f"FSQR: {len(fsqr_moves)} file(s) in {fsqr_root}")
+    print(f"Group: {len(group_moves)} file(s) in {group_root}")
+    if not apply:
+        for source, target in moves:
+            print(f"{source} -> {target}")
+        print("dry-run only; pass --apply to migrate")
+        return 0
+
+    linked = link_into_layout(moves)
+    print(f"linked {len(linked)} file(s); waiting {grace_seconds:g}s before cleanup")
+    time.sleep(grace_seconds)
+    removed = unlink_sources(linked)
+    remove_empty_room_folders(group_root)
+    print(f"removed {removed} old path(s)")
+    return removed
+
+
+def main() -> None:
+    from settings import FSQR_UPLOAD_DIR, GROUP_UPLOAD_DIR
+
+    parser = argparse.ArgumentParser(
+        description="Move FSQR / Group uploads into the hash-sharded storage layout."
+    )
+    parser.add_argument("--fsqr-dir", default=FSQR_UPLOAD_DIR)
+    parser.add_argument("--group-dir", default=GROUP_UPLOAD_DIR)
+    parser.add_argument(
+        "--grace-seconds",
+        type=float,
+        default=60.0,
+        help="wait between linking new paths and removing old ones",
+    )
+    parser.add_argument("--apply", action="store_true", help="move the files")
+    args = parser.parse_args()
+    migrate(
+        args.fsqr_dir,
+        args.group_dir,
+        grace_seconds=args.grace_seconds,
+        apply=args.apply,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
+import logging
 import os
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 BASE_DIR = os.path.dirname(__file__)
 PUBLIC_SITE_URL = os.getenv("PUBLIC_SITE_URL", "https://fs-qr.net").rstrip("/")
 
@@ -70,6 +73,12 @@ GROUP_UPLOAD_DIR = os.getenv(
     "GROUP_UPLOAD_DIR",
     os.path.join(BASE_DIR, "storage", "group_uploads"),
 )
+# 分割アップロードの 1 チャンクの長さと、放置されたセッションを消すまでの時間。
+FSQR_UPLOAD_CHUNK_SIZE_MB = _env_int("FSQR_UPLOAD_CHUNK_SIZE_MB", default=8, minimum=1)
+FSQR_UPLOAD_CHUNK_SIZE_BYTES = FSQR_UPLOAD_CHUNK_SIZE_MB * 1024 * 1024
+FSQR_UPLOAD_SESSION_TTL_SECONDS = _env_int(
+    "FSQR_UPLOAD_SESSION_TTL_SECONDS", default=3600, minimum=60
+)
 
 # --- ファイル配信オフロード (nginx X-Accel-Redirect) ---------------------------
 # 有効化すると、ダウンロード時の実ファイル転送を nginx へ委譲し、Python ワーカーは
@@ -106,6 +115,140 @@ AUTH_SESSION_TIMEOUT_SECONDS = _env_int(
     "AUTH_SESSION_TIMEOUT_SECONDS", default=1800, minimum=60
 )
 
+# --- パスワードハッシュ (scrypt) のプロセスプール ---------------------------------
+# gunicorn ワーカーごとに持つ子プロセス数。0 ならプロセスを作らずスレッドで実行する。
+PASSWORD_HASH_WORKERS = _env_int("PASSWORD_HASH_WORKERS", default=2, minimum=0)
+# 実行中＋待機中の上限。超えた分は PasswordHashBusyError で即座に断る。
+PASSWORD_HASH_MAX_PENDING = _env_int("PASSWORD_HASH_MAX_PENDING", default=64, minimum=1)
+
+# --- DB 接続の遮断器（database.CircuitBreaker） -----------------------------------
+# 再試行可能な DB エラーがこの回数続いたら、一定時間は問い合わせずに 503 を返す。
+DB_BREAKER_FAILURE_THRESHOLD = _env_int(
+    "DB_BREAKER_FAILURE_THRESHOLD", default=5, minimum=1
+)
+# 遮断後、1 件だけ試行を通すまでの秒数。
+DB_BREAKER_RESET_SECONDS = _env_int("DB_BREAKER_RESET_SECONDS", default=5, minimum=1)
+
+# execute_many / execute_batches で 1 回に送る行数。
+DB_BULK_CHUNK_SIZE = _env_int("DB_BULK_CHUNK_SIZE", default=500, minimum=1)
+
+# --- DB 接続プール ------------------------------------------------------------------
+# 個別に指定しなければ、MySQL の max_connections から予備を引いた分を
+# 「gunicorn ワーカー数 × 同時に動くスロット数（Blue/Green 切替中は 2）」で割り、
+# 書き込み用（engine）に 2/3、読み取り用（read_engine）に 1/3 を配る。
+# 各プールはさらに 2/3 を常駐（pool_size）、残りを一時的な超過（max_overflow）にする。
+WEB_CONCURRENCY = _env_int("WEB_CONCURRENCY", default=4, minimum=1)
+DB_MAX_CONNECTIONS = _env_int("DB_MAX_CONNECTIONS", default=200, minimum=1)
+# scheduler・マイグレーション・管理用の接続として残しておく数。
+DB_RESERVED_CONNECTIONS = _env_int("DB_RESERVED_CONNECTIONS", default=20)
+DB_DEPLOY_SLOTS = _env_int("DB_DEPLOY_SLOTS", default=2, minimum=1)
+
+
+_MAX_CONNECTIONS_PER_WORKER = 24
+_MIN_CONNECTIONS_PER_WORKER = 2
+
+
+def _split_pool(total: int) -> tuple[int, int]:
+    size = max(1, total * 2 // 3)
+    return size, max(total - size, 0)
+
+
+def db_pool_sizes(
+    workers: int,
+    max_connections: int,
+    reserved: int,
+    slots: int,
+) -> dict[str, tuple[int, int]]:
+    """プールごとの (pool_size, max_overflow) を接続数の予算から求める。
+
+    非同期ワーカー 1 つでそれ以上使い切ることはまず無いので、1 ワーカーあたり
+    ``_MAX_CONNECTIONS_PER_WORKER`` で頭打ちにする。
+    """
+    budget = (max_connections - reserved) // (workers * slots)
+    if budget < _MIN_CONNECTIONS_PER_WORKER:
+        # 書き込み用・読み取り用に 1 本ずつは要るので、上限を超えても最低数で動かす。
+        needed = workers * slots * _MIN_CONNECTIONS_PER_WORKER + reserved
+        logger.warning(
+            "DB connection budget is too small: %d workers x %d slots need %d "
+            "connections (including %d reserved), but DB_MAX_CONNECTIONS is %d "
+            "(short by %d). Reduce WEB_CONCURRENCY or raise max_connections.",
+            workers,
+            slots,
+            needed,
+            reserved,
+            max_connections,
+            needed - max_connections,
+        )
+    per_worker = min(
+        max(_MIN_CONNECTIONS_PER_WORKER, budget), _MAX_CONNECTIONS_PER_WORKER
+    )
+    write_total = max(1, per_worker * 2 // 3)
+    read_total = max(1, per_worker - write_total)
+    return {"write": _split_pool(write_total), "read": _split_pool(read_total)}
+
+
+_DB_POOL_SIZES = db_pool_sizes(
+    WEB_CONCURRENCY, DB_MAX_CONNECTIONS, DB_RESERVED_CONNECTIONS, DB_DEPLOY_SLOTS
+)
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", default=_DB_POOL_SIZES["write"][0], minimum=1)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", default=_DB_POOL_SIZES["write"][1])
+DB_READ_POOL_SIZE = _env_int(
+    "DB_READ_POOL_SIZE", default=_DB_POOL_SIZES["read"][0], minimum=1
+)
+DB_READ_MAX_OVERFLOW = _env_int(
+    "DB_READ_MAX_OVERFLOW", default=_DB_POOL_SIZES["read"][1]
+)
+# 接続が空くのを待つ最大秒数。
+DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", default=10, minimum=1)
+# startup() で各プールに先に張っておく接続数（pool_size が上限）。0 なら張らない。
+DB_POOL_WARMUP = _env_int("DB_POOL_WARMUP", default=2)
+
+# --- DB 問い合わせの計測（query_profiler） ---------------------------------------
+# この時間（ミリ秒）以上かかった問い合わせを指紋付きでログに残す。0 なら無効。
+DB_SLOW_QUERY_MS = _env_int("DB_SLOW_QUERY_MS", default=500, minimum=0)
+# リクエストごとの件数・合計時間を Server-Timing ヘッダーで返す。誰にでも返るので、
+# 本番では無効のままにし、計測するときだけ一時的に有効にする。
+DB_SERVER_TIMING = _env_flag("DB_SERVER_TIMING", default=False)
+# 同じ内容を 1 リクエスト 1 行のログにも書く（件数の多いエンドポイント探し用）。
+DB_PROFILE_LOG = _env_flag("DB_PROFILE_LOG", default=False)
+
+# --- 読み取りレプリカ（SQL_REPLICA_HOSTS を設定したときだけ使う） -----------------
+# Seconds_Behind_Source がこの秒数を超えたレプリカには振り分けない。
+DB_REPLICA_MAX_LAG_SECONDS = _env_int("DB_REPLICA_MAX_LAG_SECONDS", default=5)
+# レプリカの遅延を確認し直す間隔（秒）。結果はワーカー内で共有する。
+DB_REPLICA_LAG_CHECK_SECONDS = _env_int(
+    "DB_REPLICA_LAG_CHECK_SECONDS", default=10, minimum=1
+)
+
+# --- cache_data のプロセス内キャッシュ (L1) ---------------------------------------
+# Redis の手前にワーカーごとの LRU を置く。0 件なら無効。
+CACHE_L1_MAX_ENTRIES = _env_int("CACHE_L1_MAX_ENTRIES", default=2048, minimum=0)
+# 保持する JSON 文字列の合計サイズ上限（バイト）。
+CACHE_L1_MAX_BYTES = _env_int("CACHE_L1_MAX_BYTES", default=8 * 1024 * 1024, minimum=1)
+# L1 の最大保持秒数。無効化通知を取りこぼした場合の古さの上限になる。
+CACHE_L1_TTL_SECONDS = _env_int("CACHE_L1_TTL_SECONDS", default=10, minimum=1)
+# キャッシュミス時にワーカー間で DB 読み込みを 1 回にまとめる Redis ロックの寿命。
+# 0 ならワーカー内の合流だけを行う。
+CACHE_FILL_LOCK_MS = _env_int("CACHE_FILL_LOCK_MS", default=3000, minimum=0)
+# ロックを取れなかった側が Redis に値が入るのを待つ最大時間。過ぎたら自分で引く。
+CACHE_FILL_WAIT_MS = _env_int("CACHE_FILL_WAIT_MS", default=1000, minimum=0)
+# cache_negative=True の関数で「該当なし」（None / 空リスト）を保持する秒数。
+CACHE_NEGATIVE_TTL_SECONDS = _env_int(
+    "CACHE_NEGATIVE_TTL_SECONDS", default=10, minimum=1
+)
+# キャッシュ値のコーデック。auto は orjson があればそれを、無ければ json を使う。
+# どちらも同じ保存形式なので、ワーカーごとに異なっても互いの値を読める。
+CACHE_CODEC = os.getenv("CACHE_CODEC", "auto")
+# prefix の無効化で、タグに登録されない旧形式のキー（db_cache:<prefix>:*）も SCAN で
+# 消す。Blue/Green の旧スロットが旧形式で書いている間は必要。撤去後は false にする。
+CACHE_LEGACY_PREFIX_SCAN = _env_flag("CACHE_LEGACY_PREFIX_SCAN", default=True)
+
+# --- トップページ検索 --------------------------------------------------------------
+# room_directory で見つからなかったサービスの表も並行して調べる（サービスごとに
+# scrypt の検証が走るため重い）。既存のルームは 0015 のマイグレーションで索引へ
+# 移してあるので既定では無効。索引の書き込み漏れを調べるときだけ有効にする。
+ROOM_DIRECTORY_FALLBACK = _env_flag("ROOM_DIRECTORY_FALLBACK", default=False)
+
 TRUSTED_PROXY_HOSTS = _env_csv(
     "TRUSTED_PROXY_HOSTS",
     ["127.0.0.1", "::1"],
@@ -11,10 +11,10 @@ from typing import Any, Mapping
 
 from cryptography.fernet import Fernet, InvalidToken
 from fastapi import Request
-from sqlalchemy import text
+from sql_statements import statement
 
-from database import execute_query
-from settings import SECRET_KEY
+from database import db_session, execute_query, fetch_one
+from settings import DB_BULK_CHUNK_SIZE, SECRET_KEY
 from web import build_url
 
 
@@ -123,7 +123,7 @@ async def create_share_link(
     metadata: Mapping[str, Any] | None = None,
 ) -> str:
     token = generate_token()
-    query = text("""
+    query = statement("""
         INSERT INTO share_links (
             service_key, resource_id, token_hash, scope,
             expires_at, metadata, created_at
@@ -154,7 +154,7 @@ async def resolve_share_link(
     if len(token) < 32:
         return None
 
-    query = text("""
+    query = statement("""
         SELECT service_key, resource_id, scope, expires_at, metadata
         FROM share_links
         WHERE token_hash = :token_hash
@@ -163,14 +163,10 @@ async def resolve_share_link(
           AND (expires_at IS NULL OR expires_at > NOW())
         LIMIT 1
     """)
-    rows = await execute_query(
-        query,
-        {"token_hash": hash_token(token), "scope": scope},
-        fetch=True,
-    )
-    if not rows:
+    found = await fetch_one(query, {"token_hash": hash_token(token), "scope": scope})
+    if not found:
         return None
-    row = dict(rows[0])
+    row = dict(found)
     if service_key and row.get("service_key") != service_key.value:
         return None
     return row
@@ -208,7 +204,7 @@ def share_link_password(link: Mapping[str, Any] | None) -> str:
 
 
 async def revoke_resource_links(*, service_key: ServiceKey, resource_id: str) -> None:
-    query = text("""
+    query = statement("""
         UPDATE share_links
         SET revoked_at = NOW()
         WHERE service_key = :service_key
@@ -219,3 +215,35 @@ async def revoke_resource_links(*, service_key: ServiceKey, resource_id: str) ->
         query,
         {"service_key": service_key.value, "resource_id": resource_id},
     )
+
+
+async def revoke_links_for_resources(
+    *, service_key: ServiceKey, resource_ids: list[str]
+) -> None:
+    """複数リソースの共有リンクをまとめて失効させる。
+
+    ID を DB_BULK_CHUNK_SIZE 件ずつの IN で更新し、全体を 1 トランザクションにする
+    （途中で失敗しても一部だけ失効した状態を残さない）。
+    """
+    query = statement(
+        """
+        UPDATE share_links
+        SET revoked_at = NOW()
+        WHERE service_key = :service_key
+          AND resource_id IN :resource_ids
+          AND revoked_at IS NULL
+    """,
+        "resource_ids",
+    )
+    ids = list(dict.fromkeys(resource_ids))
+    if not ids:
+        return
+    async with db_session.begin():
+        for start in range(0, len(ids), DB_BULK_CHUNK_SIZE):
+            await db_session.execute(
+                query,
+                {
+                    "service_key": service_key.value,
+                    "resource_ids": ids[start : start + DB_BULK_CHUNK_SIZE],
+                },
+            )
@@ -0,0 +1,40 @@
+"""データ層の生 SQL を、SQL 文字列ごとに 1 度だけ text() にして使い回す。
+
+text() は呼ぶたびに SQL を走査してバインド変数を取り出すため、同じ SQL を毎回
+包み直すと、そのぶん CPU を使う。ここで作った TextClause は同じオブジェクトを
+返し続けるので、SQLAlchemy のコンパイル済みキャッシュもそのまま当たる。
+
+IN 句は ``IN :ids`` と書いて ``expanding`` に名前を渡す。値の個数ごとに
+プレースホルダ名を生成せず、リストをそのままバインドで渡せる。
+"""
+
+from __future__ import annotations
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.sql.elements import TextClause
+
+# 動的に組み立てた SQL が紛れ込んでも際限なく増えないよう上限を設ける。
+_MAX_STATEMENTS = 2048
+
+_statements: dict[tuple[str, tuple[str, ...]], TextClause] = {}
+
+
+def statement(query: str, *expanding: str) -> TextClause:
+    """``query`` に対応する TextClause を返す。初回だけ作って登録する。
+
+    ``expanding`` に挙げたバインド名は IN 句用のリスト値として扱う。
+    """
+    key = (query, expanding)
+    stmt = _statements.get(key)
+    if stmt is not None:
+        return stmt
+    stmt = text(query)
+    if expanding:
+        stmt = stmt.bindparams(*(bindparam(name, expanding=True) for name in expanding))
+    if len(_statements) < _MAX_STATEMENTS:
+        _statements[key] = stmt
+    return stmt
+
+
+def registered_statement_count() -> int:
+    return len(_statements)
@@ -33,8 +33,17 @@
     var limits = validation.normalizeLimits(options.limits || {});
     var core = modules.core;
     var activeXhr = null;
+    var activeChunkRequests = [];
     var cancelRequested = false;
     var PASSWORD_DIGITS = '0123456789';
+    // 1 チャンクを超える暗号化データは分割アップロード（/upload/sessions）で送る。
+    // 各チャンクは並列に送り、失敗したものだけを再送するため、回線が途切れても
+    // 最初からやり直さずに済む。
+    var CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+    var CHUNK_CONCURRENCY = 3;
+    var CHUNK_MAX_ATTEMPTS = 5;
+    var CHUNK_RETRY_BASE_MS = 1000;
+    var RESUME_MAX_ROUNDS = 3;
 
     function parseJsonResponse(rawText, label) {
       return core.safeParseJson(rawText, logger, label);
@@ -89,22 +98,264 @@
       return true;
     }
 
+    function describePayload(files) {
+      if (files.length === 1) {
+        return { filename: `${files[0].name}.enc`, fileType: 'single', mimeType: 'application/octet-stream' };
+      }
+      return { filename: 'encrypted_files.zip', fileType: 'multiple', mimeType: 'application/zip' };
+    }
+
+    function buildUploadFields(files, id) {
+      return {
+        name: id,
+        download_password: encryptionService.getLastEncryptionKey(),
+        original_filename: files[0].name,
+        retention_hours: retentionSelect.value
+      };
+    }
+
     function buildUploadFormData(files, encryptedBlob, id) {
       var formData = new FormData();
-      if (files.length === 1) {
-        var encryptedFile = new File([encryptedBlob], `${files[0].name}.enc`, { type: 'application/octet-stream' });
-        formData.append('upfile', encryptedFile);
-        formData.append('file_type', 'single');
+      var payload = describePayload(files);
+      formData.append('upfile', new File([encryptedBlob], payload.filename, { type: payload.mimeType }));
+      formData.append('file_type', payload.fileType);
+      var fields = buildUploadFields(files, id);
+      Object.keys(fields).forEach(function (key) {
+        formData.append(key, fields[key]);
+      });
+      return formData;
+    }
+
+    function resetUploadButton() {
+      if (startUploadBtn) {
+        startUploadBtn.disabled = false;
+        startUploadBtn.innerHTML = uploadButtonLabel;
+      }
+      spinner.stopIconSwitching();
+    }
+
+    function showSendingProgress(progress) {
+      spinner.setUploadProgressScale(progress);
+      spinner.setSpinnerText(translate('upload.sending_progress', 'Sending... {percent}%').replace('{percent}', String(Math.round(progress * 100))));
+    }
+
+    function handleUploadResponse(status, responseText, shareKey) {
+      if (status === 200) {
+        var result = parseJsonResponse(responseText, 'fsqr upload response');
+        if (!isObjectPayload(result)) {
+          showFormError(translate('upload.error_response_format', 'Upload completed, but the response format is invalid. Please reload the page.'));
+          spinner.hideSpinner();
+        } else if (
+          result.status === 'ok'
+          && result.data
+          && typeof result.data.redirect_url === 'string'
+          && result.data.redirect_url
+        ) {
+          window.location.href = result.data.redirect_url
+            + (shareKey ? `#pw=${encodeURIComponent(shareKey)}` : '');
+        } else {
+          showFormError(translate('upload.error_no_redirect', 'Upload completed, but the redirect URL could not be retrieved. Please reload the page.'));
+          spinner.hideSpinner();
+        }
       } else {
-        var zipFile = new File([encryptedBlob], 'encrypted_files.zip', { type: 'application/zip' });
-        formData.append('upfile', zipFile);
-        formData.append('file_type', 'multiple');
+        var errorResult = parseJsonResponse(responseText, 'fsqr upload error');
+        if (isObjectPayload(errorResult) && typeof errorResult.error === 'string' && errorResult.error) {
+          showFormError(errorResult.error);
+        } else {
+          showFormError(translate('upload.error_failed', 'Upload failed. Please try again later.'));
+        }
+        spinner.hideSpinner();
+      }
+      resetUploadButton();
+    }
+
+    function uploadError(kind) {
+      var error = new Error(kind);
+      error.uploadErrorKind = kind;
+      return error;
+    }
+
+    function sleep(ms) {
+      return new Promise(function (resolve) {
+        setTimeout(resolve, ms);
+      });
+    }
+
+    function sendSessionRequest(method, url, body, headers, onProgress) {
+      return new Promise(function (resolve, reject) {
+        var xhr = new XMLHttpRequest();
+        activeChunkRequests.push(xhr);
+        function settle() {
+          activeChunkRequests = activeChunkRequests.filter(function (item) { return item !== xhr; });
+        }
+        xhr.open(method, url, true);
+        if (csrfToken) {
+          xhr.setRequestHeader('X-CSRF-Token', csrfToken);
+        }
+        xhr.setRequestHeader('Accept', 'application/json');
+        Object.keys(headers || {}).forEach(function (name) {
+          xhr.setRequestHeader(name, headers[name]);
+        });
+        if (onProgress) {
+          xhr.upload.onprogress = function (progressEvent) {
+            onProgress(progressEvent.loaded);
+          };
+        }
+        xhr.onload = function () {
+          settle();
+          resolve({
+            status: xhr.status,
+            responseText: xhr.responseText,
+            payload: parseJsonResponse(xhr.responseText, 'fsqr upload session response')
+          });
+        };
+        xhr.onerror = function () {
+          settle();
+          reject(uploadError('network'));
+        };
+        xhr.onabort = function () {
+          settle();
+          reject(uploadError('canceled'));
+        };
+        xhr.send(body === undefined ? null : body);
+      });
+    }
+
+    function sendSessionJson(method, url, data) {
+      return sendSessionRequest(method, url, JSON.stringify(data), { 'Content-Type': 'application/json' });
+    }
+
+    function sessionData(response) {
+      return isObjectPayload(response.payload) && response.payload.data ? response.payload.data : null;
+    }
+
+    async function sha256Hex(blob) {
+      var digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+      return Array.from(new Uint8Array(digest)).map(function (byte) {
+        return byte.toString(16).padStart(2, '0');
+      }).join('');
+    }
+
+    async function putChunk(session, encryptedBlob, index, onProgress) {
+      var start = index * session.chunk_size;
+      var chunk = encryptedBlob.slice(start, Math.min(start + session.chunk_size, encryptedBlob.size));
+      var digest = await sha256Hex(chunk);
+      var url = `/upload/sessions/${encodeURIComponent(session.session_id)}/chunks/${index}`;
+      for (var attempt = 1; ; attempt += 1) {
+        if (cancelRequested) {
+          throw uploadError('canceled');
+        }
+        var response = null;
+        try {
+          response = await sendSessionRequest('PUT', url, chunk, { 'X-Chunk-SHA256': digest }, onProgress);
+        } catch (error) {
+          if (error.uploadErrorKind === 'canceled') {
+            throw error;
+          }
+        }
+        if (response && response.status === 200) {
+          onProgress(chunk.size);
+          return;
+        }
+        // 422 は途中で壊れたチャンク。それ以外の 4xx は再送しても受け付けられない。
+        if (response && response.status >= 400 && response.status < 500 && response.status !== 422) {
+          throw uploadError('rejected');
+        }
+        onProgress(0);
+        if (attempt >= CHUNK_MAX_ATTEMPTS) {
+          throw uploadError('network');
+        }
+        await sleep(CHUNK_RETRY_BASE_MS * Math.pow(2, attempt - 1));
+      }
+    }
+
+    async function putChunks(session, encryptedBlob, indices, sentBytes) {
+      var queue = indices.slice();
+      var failure = null;
+      function reportProgress() {
+        var loaded = Object.keys(sentBytes).reduce(function (sum, key) { return sum + sentBytes[key]; }, 0);
+        showSendingProgress(Math.min(loaded / encryptedBlob.size, 1));
+      }
+      async function worker() {
+        while (queue.length > 0 && !failure) {
+          var index = queue.shift();
+          try {
+            await putChunk(session, encryptedBlob, index, function (loaded) {
+              sentBytes[index] = loaded;
+              reportProgress();
+            });
+          } catch (error) {
+            failure = failure || error;
+          }
+        }
+      }
+      var workers = [];
+      for (var i = 0; i < Math.min(CHUNK_CONCURRENCY, queue.length); i += 1) {
+        workers.push(worker());
+      }
+      await Promise.all(workers);
+      if (failure) {
+        throw failure;
+      }
+    }
+
+    async function sendInChunks(files, encryptedBlob, id) {
+      var payload = describePayload(files);
+      var created = await sendSessionJson('POST', '/upload/sessions', {
+        filename: payload.filename,
+        file_type: payload.fileType,
+        size: encryptedBlob.size
+      });
+      if (created.status === 404 || created.status === 405) {
+        // 分割アップロードに未対応のサーバー。従来の 1 リクエスト送信に切り替える。
+        return null;
+      }
+      var session = sessionData(created);
+      if (created.status !== 201 || !session) {
+        return created;
+      }
+      var sessionUrl = `/upload/sessions/${encodeURIComponent(session.session_id)}`;
+      var sentBytes = {};
+      var pending = [];
+      for (var i = 0; i < session.chunk_count; i += 1) {
+        pending.push(i);
+      }
+      try {
+        for (var round = 0; ; round += 1) {
+          try {
+            await putChunks(session, encryptedBlob, pending, sentBytes);
+          } catch (error) {
+            if (error.uploadErrorKind !== 'network' || round >= RESUME_MAX_ROUNDS) {
+              throw error;
+            }
+            // 回線が戻るのを待ってから、サーバーに届いていないチャンクだけを送り直す。
+            await sleep(CHUNK_RETRY_BASE_MS * Math.pow(2, CHUNK_MAX_ATTEMPTS - 1));
+            var status = sessionData(await sendSessionRequest('GET', sessionUrl));
+            if (!status || !Array.isArray(status.received)) {
+              throw error;
+            }
+            pending = [];
+            for (var index = 0; index < session.chunk_count; index += 1) {
+              if (status.received.indexOf(index) === -1) {
+                pending.push(index);
+                sentBytes[index] = 0;
+              }
+            }
+            continue;
+          }
+          var completed = await sendSessionJson('POST', `${sessionUrl}/complete`, buildUploadFields(files, id));
+          var completedData = completed.status === 409 ? sessionData(completed) : null;
+          if (completedData && Array.isArray(completedData.missing) && completedData.missing.length > 0 && round < RESUME_MAX_ROUNDS) {
+            pending = completedData.missing;
+            continue;
+          }
+          return completed;
+        }
+      } catch (error) {
+        // 中断したセッションの一時ファイルを早めに消す（届かなくても定期削除で消える）。
+        sendSessionRequest('DELETE', sessionUrl).catch(function () {});
+        throw error;
       }
-      formData.append('name', id);
-      formData.append('download_password', encryptionService.getLastEncryptionKey());
-      formData.append('original_filename', files[0].name);
-      formData.append('retention_hours', retentionSelect.value);
-      return formData;
     }
 
     function generateDownloadPassword() {
@@ -123,6 +374,9 @@
           if (activeXhr) {
             activeXhr.abort();
           }
+          activeChunkRequests.slice().forEach(function (xhr) {
+            xhr.abort();
+          });
           spinner.setSpinnerText(translate('upload.canceling', 'Canceling...'));
           spinner.setSpinnerDetail(translate('upload.cancel_detail', 'If encrypting, cancellation will happen after the current step completes.'));
         });
@@ -181,6 +435,26 @@
           spinner.setSpinnerDetail(translate('upload.sending_files', 'Sending {n} file(s)').replace('{n}', String(fileNames.length)));
           spinner.startUploadAnimation();
 
+          if (encryptedBlob.size > CHUNKED_UPLOAD_THRESHOLD) {
+            var chunkedResponse;
+            try {
+              chunkedResponse = await sendInChunks(files, encryptedBlob, id);
+            } catch (error) {
+              if (error.uploadErrorKind === 'canceled') {
+                showFormError(translate('upload.canceled', 'Upload canceled.'));
+              } else {
+                showFormError(translate('upload.send_error', 'An error occurred while sending. Check your connection and try again.'));
+              }
+              spinner.hideSpinner();
+              resetUploadButton();
+              return;
+            }
+            if (chunkedResponse) {
+              handleUploadResponse(chunkedResponse.status, chunkedResponse.responseText, shareKey);
+              return;
+            }
+          }
+
           var formData = buildUploadFormData(files, encryptedBlob, id);
           var xhr = new XMLHttpRequest();
           activeXhr = xhr;
@@ -193,66 +467,26 @@
 
           xhr.upload.onprogress = function (progressEvent) {
             if (progressEvent.lengthComputable) {
-              var uploadProgress = progressEvent.loaded / progressEvent.total;
-              spinner.setUploadProgressScale(uploadProgress);
-              spinner.setSpinnerText(translate('upload.sending_progress', 'Sending... {percent}%').replace('{percent}', String(Math.round(uploadProgress * 100))));
+              showSendingProgress(progressEvent.loaded / progressEvent.total);
             }
           };
 
           xhr.onload = function () {
-            if (xhr.status === 200) {
-              var result = parseJsonResponse(xhr.responseText, 'fsqr upload response');
-              if (!isObjectPayload(result)) {
-                showFormError(translate('upload.error_response_format', 'Upload completed, but the response format is invalid. Please reload the page.'));
-                spinner.hideSpinner();
-              } else if (
-                result.status === 'ok'
-                && result.data
-                && typeof result.data.redirect_url === 'string'
-                && result.data.redirect_url
-              ) {
-                window.location.href = result.data.redirect_url
-                  + (shareKey ? `#pw=${encodeURIComponent(shareKey)}` : '');
-              } else {
-                showFormError(translate('upload.error_no_redirect', 'Upload completed, but the redirect URL could not be retrieved. Please reload the page.'));
-                spinner.hideSpinner();
-              }
-            } else {
-              var errorResult = parseJsonResponse(xhr.responseText, 'fsqr upload error');
-              if (isObjectPayload(errorResult) && typeof errorResult.error === 'string' && errorResult.error) {
-                showFormError(errorResult.error);
-              } else {
-                showFormError(translate('upload.error_failed', 'Upload failed. Please try again later.'));
-              }
-              spinner.hideSpinner();
-            }
-            if (startUploadBtn) {
-              startUploadBtn.disabled = false;
-              startUploadBtn.innerHTML = uploadButtonLabel;
-            }
-            spinner.stopIconSwitching();
+            handleUploadResponse(xhr.status, xhr.responseText, shareKey);
             activeXhr = null;
           };
 
           xhr.onerror = function () {
             showFormError(translate('upload.send_error', 'An error occurred while sending. Check your connection and try again.'));
             spinner.hideSpinner();
-            if (startUploadBtn) {
-              startUploadBtn.disabled = false;
-              startUploadBtn.innerHTML = uploadButtonLabel;
-            }
-            spinner.stopIconSwitching();
+            resetUploadButton();
             activeXhr = null;
           };
 
           xhr.onabort = function () {
             showFormError(translate('upload.canceled', 'Upload canceled.'));
             spinner.hideSpinner();
-            if (startUploadBtn) {
-              startUploadBtn.disabled = false;
-              startUploadBtn.innerHTML = uploadButtonLabel;
-            }
-            spinner.stopIconSwitching();
+            resetUploadButton();
             activeXhr = null;
           };
 
@@ -0,0 +1,60 @@
+"""保存ファイルのディレクトリ配置（ID のハッシュによる振り分け）。
+
+FSQR_UPLOAD_DIR / GROUP_UPLOAD_DIR の直下に全ファイル・全ルームを並べると、件数が
+数万になったときにディレクトリの検索・一覧・バックアップが遅くなる。保存先は ID の
+SHA-256 の先頭 4 桁で ``<root>/ab/cd/<name>`` に振り分け、1 ディレクトリの項目数を
+抑える。
+
+振り分け前に保存したものは ``scripts/migrate_storage_layout.py`` で移すまで直下に
+残るため、読み取りは新しい位置 → 直下の順に探す。移行ツールは新しい位置へハード
+リンクを張ってから猶予を置いて直下のリンクを消すので、どちらの順で見ても途中で
+見失うことはない。
+
+nginx の X-Accel 配信は保存ルートからの相対パスをそのまま URI にするため、振り分け
+後のサブディレクトリもルートの ``alias`` で配信できる（X_ACCEL_LOCATIONS は変更不要）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Optional
+
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+
+def shard_dir(root: str, key: str) -> str:
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    parts = [
+        digest[level * SHARD_WIDTH : (level + 1) * SHARD_WIDTH]
+        for level in range(SHARD_LEVELS)
+    ]
+    return os.path.join(root, *parts)
+
+
+def sharded_path(root: str, key: str, name: str) -> str:
+    """``key`` で振り分けた ``name`` の保存先。新しく書くときはこちらを使う。"""
+    return os.path.join(shard_dir(root, key), name)
+
+
+def flat_path(root: str, name: str) -> str:
+    """振り分け前（ルート直下）の保存先。"""
+    return os.path.join(root, name)
+
+
+def candidate_paths(root: str, key: str, name: str) -> tuple[str, str]:
+    """読み取り・削除で確認する位置（新しい位置, 直下）。"""
+    return sharded_path(root, key, name), flat_path(root, name)
+
+
+def find_existing(root: str, key: str, name: str) -> Optional[str]:
+    for path in candidate_paths(root, key, name):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def is_shard_dir_name(name: str) -> bool:
+    """ルート直下の項目が振り分け用のディレクトリ名か。"""
+    return len(name) == SHARD_WIDTH and all(c in "0123456789abcdef" for c in name)
@@ -14,15 +14,35 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 mock_database = MagicMock()
 mock_database.db_session = MagicMock()
 mock_database.execute_query = AsyncMock(return_value=[])
+mock_database.fetch_all = AsyncMock(return_value=[])
+mock_database.fetch_one = AsyncMock(return_value=None)
+mock_database.fetch_rows = AsyncMock(return_value=[])
 # await db_session.remove() に対応するための非同期モック
 mock_database.db_session.remove = AsyncMock()
+mock_database.remove_db_session = AsyncMock()
 mock_database.engine = AsyncMock()
+mock_database.get_db_stats = MagicMock(return_value={"circuit": {"state": "closed"}})
+mock_database.warm_up_pools = AsyncMock(return_value={})
+
+
+class MockDatabaseUnavailableError(RuntimeError):
+    pass
+
+
+mock_database.DatabaseUnavailableError = MockDatabaseUnavailableError
 
 # redisモジュールもモック化
 mock_redis = MagicMock()
 mock_redis_asyncio = MagicMock()
 sys.modules["redis"] = mock_redis
 sys.modules["redis.asyncio"] = mock_redis_asyncio
+# ``import redis.asyncio as redis`` は親モジュールの属性を参照する。
+mock_redis.asyncio = mock_redis_asyncio
+# pipeline は積むコマンドが同期、execute だけが非同期（redis.asyncio と同じ形）。
+_mock_redis_pipeline = MagicMock()
+_mock_redis_pipeline.execute = AsyncMock(return_value=[])
+_mock_redis_pipeline.__aenter__.return_value = _mock_redis_pipeline
+mock_redis_asyncio.from_url.return_value.pipeline.return_value = _mock_redis_pipeline
 
 # starsessionsモジュールもモック化
 mock_starsessions = MagicMock()
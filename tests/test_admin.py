@@ -1,5 +1,5 @@
 import asyncio
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, patch
 
 import pytest
 from starlette.testclient import TestClient
@@ -122,32 +122,43 @@ def test_db_admin_safe_count_rejects_unknown_table():
     """想定外テーブル名はSQLを実行せず 0 を返す"""
     from Admin import db_admin
 
-    sess = MagicMock()
-    sess.execute = AsyncMock()
-
-    count = asyncio.run(db_admin.safe_count(sess, "fsqr; DROP TABLE fsqr;--"))
+    with patch("Admin.db_admin.fetch_one", new_callable=AsyncMock) as fetch_one:
+        count = asyncio.run(db_admin.safe_count("fsqr; DROP TABLE fsqr;--"))
 
     assert count == 0
-    sess.execute.assert_not_awaited()
+    fetch_one.assert_not_awaited()
+
+
+def test_db_admin_safe_count_reads_from_replica():
+    """件数はレプリカ可の読み取りで数える"""
+    from Admin import db_admin
+
+    with (
+        patch("Admin.db_admin.table_exists", new_callable=AsyncMock, return_value=True),
+        patch(
+            "Admin.db_admin.fetch_one", new_callable=AsyncMock, return_value={"cnt": 7}
+        ) as fetch_one,
+    ):
+        count = asyncio.run(db_admin.safe_count("fsqr"))
+
+    assert count == 7
+    fetch_one.assert_awaited_once_with(db_admin.COUNT_QUERIES["fsqr"], replica=True)
 
 
 def test_db_admin_safe_recent_rejects_unknown_identifier():
     """想定外の識別子はSQLを実行せず None を返す"""
     from Admin import db_admin
 
-    sess = MagicMock()
-    sess.execute = AsyncMock()
-
-    rows = asyncio.run(
-        db_admin.safe_recent(
-            sess,
-            "fsqr",
-            "time DESC; DROP TABLE fsqr;--",
+    with patch("Admin.db_admin.fetch_all", new_callable=AsyncMock) as fetch_all:
+        rows = asyncio.run(
+            db_admin.safe_recent(
+                "fsqr",
+                "time DESC; DROP TABLE fsqr;--",
+            )
         )
-    )
 
     assert rows is None
-    sess.execute.assert_not_awaited()
+    fetch_all.assert_not_awaited()
 
 
 def test_db_admin_safe_recent_uses_parameterized_limit():
@@ -155,23 +166,20 @@ def test_db_admin_safe_recent_uses_parameterized_limit():
     from Admin import db_admin
 
     expected_rows = [{"secure_id": "abc123-uid-file"}]
-    result_proxy = MagicMock()
-    mapping_result = MagicMock()
-    mapping_result.all.return_value = expected_rows
-    result_proxy.mappings.return_value = mapping_result
-
-    sess = MagicMock()
-    sess.execute = AsyncMock(return_value=result_proxy)
-    sess.rollback = AsyncMock()
 
-    with patch(
-        "Admin.db_admin.table_exists", new_callable=AsyncMock, return_value=True
+    with (
+        patch("Admin.db_admin.table_exists", new_callable=AsyncMock, return_value=True),
+        patch(
+            "Admin.db_admin.fetch_all",
+            new_callable=AsyncMock,
+            return_value=expected_rows,
+        ) as fetch_all,
     ):
-        rows = asyncio.run(db_admin.safe_recent(sess, "fsqr", "time", limit=10))
+        rows = asyncio.run(db_admin.safe_recent("fsqr", "time", limit=10))
 
     assert rows == expected_rows
-    sess.execute.assert_awaited_once_with(
-        db_admin.RECENT_QUERIES[("fsqr", "time")], {"limit": 10}
+    fetch_all.assert_awaited_once_with(
+        db_admin.RECENT_QUERIES[("fsqr", "time")], {"limit": 10}, replica=True
     )
 
 
@@ -179,15 +187,12 @@ def test_db_admin_safe_recent_rejects_invalid_limit():
     """0 以下の LIMIT は拒否する"""
     from Admin import db_admin
 
-    sess = MagicMock()
-    sess.execute = AsyncMock()
-    sess.rollback = AsyncMock()
-
     with (
         patch("Admin.db_admin.table_exists", new_callable=AsyncMock, return_value=True),
+        patch("Admin.db_admin.fetch_all", new_callable=AsyncMock),
         pytest.raises(ValueError),
     ):
-        asyncio.run(db_admin.safe_recent(sess, "fsqr", "time", limit=0))
+        asyncio.run(db_admin.safe_recent("fsqr", "time", limit=0))
 
 
 def test_db_admin_file_detail_requires_session(test_client):
@@ -286,6 +291,23 @@ def test_db_admin_room_detail_found(test_client):
     assert "files" in payload["data"]
 
 
+def test_db_admin_metrics_requires_session(test_client):
+    response = test_client.get("/admin/metrics")
+    assert response.status_code == 403
+
+
+def test_db_admin_metrics_reports_password_pool(test_client):
+    _login_db_admin(test_client)
+    response = test_client.get("/admin/metrics")
+
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert isinstance(data["pid"], int)
+    assert {"pending", "submitted", "rejected"} <= set(data["password_pool"])
+    assert {"hits", "misses", "entries", "listener_ready"} <= set(data["cache"])
+    assert data["database"]["circuit"]["state"] == "closed"
+
+
 def test_db_admin_dashboard_post_redirects_without_pw_query(test_client):
     """POST /admin/ はクエリ文字列なしでダッシュボードにリダイレクトする"""
     with patch("Admin.db_admin.ADMIN_DB_PW", "testpw"):
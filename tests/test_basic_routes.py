@@ -282,6 +282,7 @@ def test_search_all_fsqr_single_match_redirects(test_client: TestClient):
         patch(
             "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
         ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", True),
         patch(
             "top_search.fsqr_data.get_data_by_credentials",
             AsyncMock(return_value=[{"secure_id": "abc123-uid-file"}]),
@@ -303,6 +304,7 @@ def test_search_all_group_single_match_redirects(test_client: TestClient):
         patch(
             "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
         ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", True),
         patch(
             "top_search.fsqr_data.get_data_by_credentials", AsyncMock(return_value=[])
         ),
@@ -326,6 +328,7 @@ def test_search_all_note_single_match_redirects(test_client: TestClient):
         patch(
             "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
         ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", True),
         patch(
             "top_search.fsqr_data.get_data_by_credentials", AsyncMock(return_value=[])
         ),
@@ -345,11 +348,107 @@ def test_search_all_note_single_match_redirects(test_client: TestClient):
     assert response.headers["location"] == "/note/r/abc123"
 
 
+def test_search_all_directory_hit_skips_that_service_lookup(test_client: TestClient):
+    task_lookup = AsyncMock(return_value=None)
+    with (
+        patch(
+            "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
+        ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", True),
+        patch(
+            "top_search.room_directory.find_rooms",
+            AsyncMock(return_value=[{"service_key": "task", "resource_id": "t1"}]),
+        ),
+        patch(
+            "top_search.fsqr_data.get_data_by_credentials", AsyncMock(return_value=[])
+        ),
+        patch("top_search.group_data.pich_room_id", AsyncMock(return_value=None)),
+        patch("top_search.note_data.pick_room_id", AsyncMock(return_value=None)),
+        patch("top_search.task_data.pick_room_id", task_lookup),
+        patch(
+            "top_search.task_data.get_room_meta_direct",
+            AsyncMock(return_value={"room_id": "t1"}),
+        ),
+        patch("top_search.register_success", AsyncMock()),
+    ):
+        response = test_client.post(
+            "/search_all", data={"id": "abc123", "password": "654321"}
+        )
+
+    assert response.status_code == 302
+    assert response.headers["location"] == "/task/r/t1"
+    task_lookup.assert_not_awaited()
+
+
+def test_search_all_merges_rooms_missing_from_directory(test_client: TestClient):
+    # Group の索引登録に失敗したルームも、FSQR が索引で見つかった検索で拾う。
+    fsqr_lookup = AsyncMock(return_value=[])
+    with (
+        patch(
+            "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
+        ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", True),
+        patch(
+            "top_search.room_directory.find_rooms",
+            AsyncMock(
+                return_value=[{"service_key": "fsqr", "resource_id": "abc123-uid-file"}]
+            ),
+        ),
+        patch("top_search.fsqr_data.get_data_by_credentials", fsqr_lookup),
+        patch(
+            "top_search._get_active_data",
+            AsyncMock(return_value=[{"secure_id": "abc123-uid-file"}]),
+        ),
+        patch("top_search.group_data.pich_room_id", AsyncMock(return_value="abc123")),
+        patch(
+            "top_search.get_room_if_active", AsyncMock(return_value={"id": "abc123"})
+        ),
+        patch("top_search.note_data.pick_room_id", AsyncMock(return_value=None)),
+        patch("top_search.task_data.pick_room_id", AsyncMock(return_value=None)),
+        patch("top_search.register_success", AsyncMock()),
+    ):
+        response = test_client.post(
+            "/search_all", data={"id": "abc123", "password": "654321"}
+        )
+
+    assert response.status_code == 200
+    assert "/download/abc123-uid-file" in response.text
+    assert "/group/r/abc123" in response.text
+    fsqr_lookup.assert_not_awaited()
+
+
+def test_search_all_drops_directory_rows_for_removed_rooms(test_client: TestClient):
+    # 索引から外し損ねた削除済みルームへは案内せず、索引の行を消す。
+    remove_mock = AsyncMock()
+    with (
+        patch(
+            "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
+        ),
+        patch(
+            "top_search.room_directory.find_rooms",
+            AsyncMock(return_value=[{"service_key": "note", "resource_id": "n1"}]),
+        ),
+        patch("top_search.room_directory.remove_room", remove_mock),
+        patch(
+            "top_search.note_data.get_room_meta_direct", AsyncMock(return_value=None)
+        ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", False),
+        patch("top_search.register_failure", AsyncMock(return_value=(None, None))),
+    ):
+        response = test_client.post(
+            "/search_all", data={"id": "abc123", "password": "654321"}
+        )
+
+    assert response.status_code == 404
+    remove_mock.assert_awaited_once_with("note", "n1")
+
+
 def test_search_all_multiple_matches_returns_choice_page(test_client: TestClient):
     with (
         patch(
             "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
         ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", True),
         patch(
             "top_search.fsqr_data.get_data_by_credentials",
             AsyncMock(return_value=[{"secure_id": "abc123-uid-file"}]),
@@ -376,6 +475,7 @@ def test_search_all_no_match_returns_404(test_client: TestClient):
         patch(
             "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
         ),
+        patch("top_search.ROOM_DIRECTORY_FALLBACK", True),
         patch(
             "top_search.fsqr_data.get_data_by_credentials", AsyncMock(return_value=[])
         ),
@@ -391,6 +491,24 @@ def test_search_all_no_match_returns_404(test_client: TestClient):
     assert "見つかりません" in response.text
 
 
+def test_search_all_uses_only_directory_by_default(test_client: TestClient):
+    fsqr_lookup = AsyncMock(return_value=[])
+    with (
+        patch(
+            "top_search.check_rate_limit", AsyncMock(return_value=(True, None, None))
+        ),
+        patch("top_search.room_directory.find_rooms", AsyncMock(return_value=[])),
+        patch("top_search.fsqr_data.get_data_by_credentials", fsqr_lookup),
+        patch("top_search.register_failure", AsyncMock(return_value=(None, None))),
+    ):
+        response = test_client.post(
+            "/search_all", data={"id": "abc123", "password": "654321"}
+        )
+
+    assert response.status_code == 404
+    fsqr_lookup.assert_not_awaited()
+
+
 def test_search_all_invalid_input_returns_400(test_client: TestClient):
     with patch(
         "top_search.check_rate_limit",
@@ -1,11 +1,46 @@
 import asyncio
+import contextlib
+import importlib
+from datetime import date, datetime
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import pytest
+
 
 def run(coro):
     return asyncio.run(coro)
 
 
+@contextlib.contextmanager
+def patch_db(module_name, execute):
+    """偽の execute_query を、読み取り用の fetch_all / fetch_one にも差し込む。"""
+
+    async def fetch_all(query, params=None, replica=False):
+        return list(await execute(query, params, fetch=True) or [])
+
+    async def fetch_one(query, params=None, replica=False):
+        rows = await execute(query, params, fetch=True)
+        return rows[0] if rows else None
+
+    async def fetch_rows(query, params=None, replica=False):
+        # Row は列順のタプルなので、偽の dict 行も SELECT の列順で書いておく。
+        rows = await execute(query, params, fetch=True) or []
+        return [tuple(row.values()) if isinstance(row, dict) else row for row in rows]
+
+    module = importlib.import_module(module_name)
+    fakes = {
+        "execute_query": execute,
+        "fetch_all": fetch_all,
+        "fetch_one": fetch_one,
+        "fetch_rows": fetch_rows,
+    }
+    with contextlib.ExitStack() as stack:
+        for name, fake in fakes.items():
+            if hasattr(module, name):
+                stack.enter_context(patch(f"{module_name}.{name}", new=fake))
+        yield
+
+
 def test_fsqr_data_save_lookup_remove_and_expiration(tmp_path):
     import FSQR.fsqr_data as fd
     from password_security import hash_password
@@ -32,8 +67,8 @@ def test_fsqr_data_save_lookup_remove_and_expiration(tmp_path):
 
         with (
             patch("FSQR.fsqr_data.STATIC", str(tmp_path)),
-            patch("FSQR.fsqr_data.execute_query", new=execute),
-            patch("FSQR.fsqr_data.invalidate_cache_entry", new=AsyncMock()),
+            patch_db("FSQR.fsqr_data", execute),
+            patch("FSQR.fsqr_data.invalidate_cache_entries", new=AsyncMock()),
             patch("FSQR.fsqr_data.invalidate_cache_prefix", new=AsyncMock()),
             patch("share_links.revoke_resource_links", new=AsyncMock()) as revoke,
             patch("FSQR.fsqr_data.record_expiration_cleanup_status", new=AsyncMock()),
@@ -78,6 +113,43 @@ def test_fsqr_data_save_lookup_remove_and_expiration(tmp_path):
     assert any("DELETE FROM fsqr" in query for query, _, _ in calls)
 
 
+def test_fsqr_and_group_reads_select_only_the_columns_each_use_needs():
+    """SELECT * をやめ、秘密の列は照合・管理画面用の読み取りにだけ含める。"""
+    import FSQR.fsqr_data as fd
+    import Group.group_data as gd
+
+    queries = []
+
+    async def execute(query, params=None, fetch=False):
+        queries.append(" ".join(str(query).split()))
+        return []
+
+    async def scenario():
+        with patch_db("FSQR.fsqr_data", execute), patch_db("Group.group_data", execute):
+            await fd.get_data_direct("secure1", fd._META_COLUMNS)
+            await fd.get_data_direct("secure1")
+            await fd.get_all_direct()
+            await fd._find_record_by_credentials("public", "pw", fd._LOGIN_COLUMNS)
+            await gd.get_data_direct("roomA", gd._META_COLUMNS)
+            await gd.get_data_direct("roomA")
+            await gd.get_all_direct()
+
+    run(scenario())
+    assert not any("SELECT *" in query for query in queries)
+    meta, record, listing, login, *_ = queries
+    assert "password" not in meta and "secure_id, file_type" in meta
+    assert (
+        record.startswith("SELECT time, id, secure_id") and ", password FROM" in record
+    )
+    assert (
+        listing == "SELECT time, id, secure_id, expires_at FROM fsqr ORDER BY suji DESC"
+    )
+    assert login.startswith("SELECT secure_id, password FROM fsqr")
+    group_meta, group_record, group_listing = queries[-3:]
+    assert "password" not in group_meta and "password" not in group_listing
+    assert ", password FROM room" in group_record
+
+
 def test_group_data_room_lifecycle_and_expiration(tmp_path):
     import Group.group_data as gd
     from password_security import hash_password
@@ -104,9 +176,8 @@ def test_group_data_room_lifecycle_and_expiration(tmp_path):
         legacy_folder.mkdir(parents=True)
 
         with (
-            patch("Group.group_data.execute_query", new=execute),
-            patch("Group.group_data.invalidate_cache_entry", new=AsyncMock()),
-            patch("Group.group_data.invalidate_cache_prefix", new=AsyncMock()),
+            patch_db("Group.group_data", execute),
+            patch("Group.group_data.invalidate_cache_entries", new=AsyncMock()),
             patch("Group.group_data.iter_room_folders") as folders,
             patch("Group.group_data.notify_group_room_closed", new=AsyncMock()),
             patch("share_links.revoke_resource_links", new=AsyncMock()),
@@ -133,6 +204,144 @@ def test_group_data_room_lifecycle_and_expiration(tmp_path):
     assert any("DELETE FROM room" in query for query, _, _ in calls)
 
 
+@pytest.mark.parametrize(
+    ("module_name", "lookup"),
+    [
+        ("Group.group_data", "pich_room_id_direct"),
+        ("Note.note_data", "pick_room_id_direct"),
+        ("Task.task_data", "pick_room_id_direct"),
+    ],
+)
+def test_room_login_uses_lookup_hash_and_backfills_legacy_rows(module_name, lookup):
+    """索引用ハッシュで 1 行に絞り、旧行はログイン成功時にだけハッシュを埋める。"""
+    import importlib
+
+    from password_security import hash_password
+
+    module = importlib.import_module(module_name)
+    hashed = hash_password("123456")
+    calls = []
+
+    def fake_execute(indexed_rows, legacy_rows):
+        async def execute(query, params=None, fetch=False):
+            query_text = " ".join(str(query).split())
+            calls.append((query_text, params or {}, fetch))
+            if not fetch:
+                return 1
+            if "password_lookup_hash IS NULL" in query_text:
+                return legacy_rows
+            return indexed_rows
+
+        return execute
+
+    async def scenario():
+        legacy = [{"room_id": "old1", "password": hashed}]
+        with patch_db(module_name, fake_execute([], legacy)):
+            assert await getattr(module, lookup)("public", "123456") == "old1"
+        backfills = [call for call in calls if not call[2]]
+        assert len(backfills) == 1
+        assert "password_lookup_hash IS NULL" in backfills[0][0]
+        assert module.hash_password_lookup("public", "123456") in (
+            backfills[0][1].values()
+        )
+
+        calls.clear()
+        indexed = [{"room_id": "new1", "password": hashed}]
+        with patch_db(module_name, fake_execute(indexed, [])):
+            assert await getattr(module, lookup)("public", "123456") == "new1"
+        assert len(calls) == 1
+        assert "LIMIT 1" in calls[0][0]
+
+    run(scenario())
+
+
+def test_room_directory_find_rooms_verifies_each_match_and_backfills():
+    """索引 1 回の検索で全サービスの候補を引き、検証に通った行だけ返す。"""
+    import room_directory
+
+    from password_security import hash_password
+
+    hashed = hash_password("123456")
+    other = hash_password("999999")
+    calls = []
+
+    async def execute(query, params=None, fetch=False):
+        query_text = " ".join(str(query).split())
+        calls.append((query_text, params or {}, fetch))
+        if fetch:
+            return [
+                {
+                    "suji": 1,
+                    "service_key": "note",
+                    "resource_id": "noteA",
+                    "password": hashed,
+                    "password_lookup_hash": "x",
+                },
+                {
+                    "suji": 2,
+                    "service_key": "fsqr",
+                    "resource_id": "fileA",
+                    "password": hashed,
+                    "password_lookup_hash": None,
+                },
+                {
+                    "suji": 3,
+                    "service_key": "task",
+                    "resource_id": "taskA",
+                    "password": other,
+                    "password_lookup_hash": None,
+                },
+            ]
+        return 1
+
+    async def scenario():
+        with patch_db("room_directory", execute):
+            return await room_directory.find_rooms("public", "123456")
+
+    matches = run(scenario())
+    assert matches == [
+        {"service_key": "note", "resource_id": "noteA"},
+        {"service_key": "fsqr", "resource_id": "fileA"},
+    ]
+    assert sum(1 for call in calls if call[2]) == 1
+    backfills = [call for call in calls if not call[2]]
+    assert len(backfills) == 1
+    assert backfills[0][1] == {
+        "suji": 2,
+        "password_lookup_hash": room_directory.hash_directory_lookup(
+            "public", "123456"
+        ),
+    }
+
+
+def test_task_data_room_lifecycle_updates_room_directory():
+    import Task.task_data as td
+
+    async def execute(query, params=None, fetch=False):
+        return [] if fetch else 1
+
+    async def scenario():
+        with (
+            patch_db("Task.task_data", execute),
+            patch("Task.task_data.invalidate_cache_tag", new=AsyncMock()),
+            patch("Task.task_data.invalidate_cache_entries", new=AsyncMock()),
+            patch("share_links.revoke_resource_links", new=AsyncMock()),
+            patch("room_directory.register_room", new=AsyncMock()) as register,
+            patch("room_directory.remove_room", new=AsyncMock()) as remove,
+        ):
+            await td.create_room("public", "123456", "taskA", retention_hours=6)
+            await td.remove_room("taskA")
+        return register, remove
+
+    register, remove = run(scenario())
+    kwargs = register.await_args.kwargs
+    assert kwargs["service_key"] == "task"
+    assert kwargs["resource_id"] == "taskA"
+    assert kwargs["retention_hours"] == 6
+    assert kwargs["hashed_password"].startswith("scrypt:")
+    remove.assert_awaited_once_with("task", "taskA")
+
+
 def test_group_data_remove_data_keeps_record_when_delete_fails(tmp_path):
     import Group.group_data as gd
 
@@ -145,7 +354,7 @@ def test_group_data_remove_data_keeps_record_when_delete_fails(tmp_path):
         room_folder = tmp_path / "roomA"
         room_folder.mkdir()
         with (
-            patch("Group.group_data.execute_query", new=execute),
+            patch_db("Group.group_data", execute),
             patch(
                 "Group.group_data.iter_room_folders",
                 return_value=(("current", str(room_folder)),),
@@ -218,9 +427,10 @@ def test_task_data_room_item_and_expiration_lifecycle():
 
     async def scenario():
         with (
-            patch("Task.task_data.execute_query", new=execute),
+            patch_db("Task.task_data", execute),
             patch("Task.task_data.db_session", TaskDbSession()),
-            patch("Task.task_data.invalidate_cache_prefix", new=AsyncMock()),
+            patch("Task.task_data.invalidate_cache_tag", new=AsyncMock()),
+            patch("Task.task_data.invalidate_cache_entries", new=AsyncMock()),
             patch("share_links.revoke_resource_links", new=AsyncMock()) as revoke,
         ):
             await td.create_room("public", "123456", "taskA", retention_hours=24)
@@ -338,6 +548,108 @@ def test_task_data_create_rechecks_room_limit_inside_transaction():
     assert not any("INSERT INTO task_item" in query for query in calls)
 
 
+def test_task_data_create_items_inserts_in_bulk_within_the_room_limit():
+    """インポートは 1 transaction で、上限に収まる分だけ複数行 INSERT する。"""
+    import Task.task_data as td
+
+    calls = []
+
+    class Result:
+        def __init__(self, rows):
+            self.rows = rows
+
+        def mappings(self):
+            return self
+
+        def first(self):
+            return self.rows[0] if self.rows else None
+
+        def __iter__(self):
+            return iter(self.rows)
+
+    class TaskDbSession:
+        def begin(self):
+            return FakeBegin()
+
+        async def execute(self, query, params):
+            query_text = str(query)
+            calls.append(query_text)
+            if "COUNT(*)" in query_text:
+                return Result([{"count": 198}])
+            if "GROUP BY board_status" in query_text:
+                return Result([{"board_status": "todo", "last_position": 300}])
+            if "SELECT item_id, board_status, position" in query_text:
+                return Result(
+                    [
+                        {"item_id": 7, "board_status": "todo", "position": 300},
+                        {"item_id": 41, "board_status": "todo", "position": 400},
+                        {"item_id": 42, "board_status": "done", "position": 100},
+                    ]
+                )
+            return Result([{"room_id": "taskA"}])
+
+    values = [
+        {"title": "a", "board_status": "todo", "tag_ids": [5, 5]},
+        {"title": "b", "board_status": "done", "tag_ids": [6]},
+        {"title": "c", "board_status": "todo", "tag_ids": []},
+    ]
+
+    async def scenario():
+        with (
+            patch("Task.task_data.db_session", TaskDbSession()),
+            patch("Task.task_data.execute_batches", new=AsyncMock()) as batches,
+        ):
+            count = await td.create_items("taskA", values, max_items=200)
+            return count, batches
+
+    count, batches = run(scenario())
+
+    assert count == 2
+    insert_rows = batches.await_args_list[0].args[1]
+    assert [(row["title"], row["position"]) for row in insert_rows] == [
+        ("a", 400),
+        ("b", 100),
+    ]
+    # ID は (board_status, position) で引き直し、タグの重複は除く
+    assert batches.await_args_list[1].args[1] == [
+        {"item_id": 41, "tag_id": 5},
+        {"item_id": 42, "tag_id": 6},
+    ]
+    assert not any("INSERT" in query for query in calls)
+
+
+def test_task_data_reorder_items_updates_all_cards_in_one_statement():
+    import Task.task_data as td
+
+    calls = []
+
+    class Result:
+        def mappings(self):
+            return [{"item_id": 3}, {"item_id": 1}]
+
+    class TaskDbSession:
+        def begin(self):
+            return FakeBegin()
+
+        async def execute(self, query, params):
+            calls.append((str(query), params))
+            return Result()
+
+    async def scenario():
+        with (
+            patch("Task.task_data.db_session", TaskDbSession()),
+            patch("Task.task_data.list_items", new=AsyncMock(return_value=[])),
+        ):
+            return await td.reorder_items("taskA", "todo", [3, 1])
+
+    assert run(scenario()) == []
+    assert len(calls) == 2
+    update_query, update_params = calls[1]
+    assert "FIND_IN_SET(item_id, :ordered_ids) * 100" in update_query
+    assert update_params["ordered_ids"] == "3,1"
+    assert update_params["item_ids"] == [3, 1]
+
+
 class FakeBegin:
     async def __aenter__(self):
         return self
@@ -387,10 +699,9 @@ def test_note_data_tables_meta_content_and_cleanup():
     async def scenario():
         db_session = FakeDbSession()
         with (
-            patch("Note.note_data.execute_query", new=execute),
+            patch_db("Note.note_data", execute),
             patch("Note.note_data.db_session", db_session),
-            patch("Note.note_data.invalidate_cache_entry", new=AsyncMock()),
-            patch("Note.note_data.invalidate_cache_prefix", new=AsyncMock()),
+            patch("Note.note_data.invalidate_cache_entries", new=AsyncMock()),
             patch("share_links.revoke_resource_links", new=AsyncMock()),
         ):
             await nd.ensure_index(
@@ -571,12 +882,72 @@ def test_scheduler_run_scheduler_registers_jobs_with_redis_store():
     assert schedulers[0].jobstores == {"default": jobstores[0]}
     assert [job["id"] for job in schedulers[0].jobs] == [
         "remove_expired_fsqr",
+        "remove_stale_fsqr_uploads",
         "remove_expired_group_rooms",
         "remove_expired_note_rooms",
         "remove_expired_task_rooms",
     ]
     assert all(job["replace_existing"] for job in schedulers[0].jobs)
-    assert all(job["minutes"] == 5 for job in schedulers[0].jobs)
+    assert {job["id"]: job["minutes"] for job in schedulers[0].jobs} == {
+        "remove_expired_fsqr": 5,
+        "remove_stale_fsqr_uploads": 15,
+        "remove_expired_group_rooms": 5,
+        "remove_expired_note_rooms": 5,
+        "remove_expired_task_rooms": 5,
+    }
+
+
+def test_task_data_list_items_builds_items_and_tags_from_row_tuples():
+    """一覧は fetch_rows の Row（タプル）から直接 dict を組み立てる。"""
+    import Task.task_data as td
+
+    async def execute(query, params=None, fetch=False):
+        query_text = str(query)
+        if "FROM task_item WHERE room_id" in query_text:
+            return [
+                {
+                    "item_id": 12,
+                    "title": "task",
+                    "note": "",
+                    "board_status": "todo",
+                    "priority": "normal",
+                    "start_date": date(2026, 8, 18),
+                    "due_date": None,
+                    "position": 100,
+                    "version": 0,
+                    "created_at": datetime(2026, 8, 16, 10, 0, 0),
+                    "updated_at": None,
+                }
+            ]
+        if "FROM task_item_tag it" in query_text:
+            assert params["item_ids"] == [12]
+            return [{"item_id": 12, "tag_id": 5, "name": "デザイン"}]
+        if "COUNT(it.item_id) AS item_count" in query_text:
+            return [{"tag_id": 5, "name": "デザイン", "item_count": None}]
+        return []
+
+    async def scenario():
+        with patch_db("Task.task_data", execute):
+            return await td.list_items("taskA"), await td.list_tags("taskA")
+
+    items, tags = run(scenario())
+    assert items == [
+        {
+            "item_id": 12,
+            "title": "task",
+            "note": "",
+            "board_status": "todo",
+            "priority": "normal",
+            "start_date": "2026-08-18",
+            "due_date": None,
+            "position": 100,
+            "version": 0,
+            "created_at": "2026-08-16 10:00:00.000000",
+            "updated_at": None,
+            "tags": [{"tag_id": 5, "name": "デザイン"}],
+        }
+    ]
+    assert tags == [{"tag_id": 5, "name": "デザイン", "item_count": 0}]
 
 
 def test_task_data_tags_are_room_scoped_and_reusable():
@@ -690,8 +1061,9 @@ def test_task_data_replace_item_tags_filters_by_room():
     # 他ルームのタグ ID を渡されても room_id 条件で弾かれる
     assert "WHERE room_id = :room_id" in insert_query
     assert insert_params["room_id"] == "taskA"
-    assert insert_params["tag_0"] == 5
-    assert insert_params["tag_1"] == 9
+    # IN 句は expanding bindparam にリストのまま渡す
+    assert "tag_id IN (__[POSTCOMPILE_tag_ids])" in insert_query
+    assert insert_params["tag_ids"] == [5, 9]
 
 
 def test_task_data_update_item_bumps_version_for_tag_only_change():
@@ -783,7 +1155,7 @@ def test_task_data_update_item_returns_tags_on_version_conflict():
     async def scenario():
         with (
             patch("Task.task_data.db_session", TaskDbSession()),
-            patch("Task.task_data.execute_query", new=execute),
+            patch_db("Task.task_data", execute),
         ):
             return await td.update_item("taskA", 12, {"title": "新しい題名"}, version=0)
 
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
 from datetime import datetime
+from pathlib import Path
 from unittest.mock import AsyncMock, patch
 
+import storage_layout
 from share_links import encrypt_share_password
 
 
@@ -88,7 +90,10 @@ def test_e2e_fsqr_upload_search_share_download_and_delete(test_client, tmp_path)
         assert upload_response.json()["data"]["redirect_url"] == (
             f"/upload_complete/{secure_id}"
         )
-        assert (tmp_path / f"{secure_id}.enc").read_bytes() == b"encrypted-by-browser"
+        stored = storage_layout.sharded_path(
+            str(tmp_path), secure_id, f"{secure_id}.enc"
+        )
+        assert Path(stored).read_bytes() == b"encrypted-by-browser"
         save_mock.assert_awaited_once()
 
         complete_response = test_client.get(f"/upload_complete/{secure_id}")
@@ -3,6 +3,7 @@
 X-Accel-Redirect オフロードと FileResponse フォールバックの両分岐を検証する。
 """
 
+import asyncio
 import importlib
 import os
 
@@ -101,6 +102,108 @@ def test_build_file_response_falls_back_when_path_outside_scope(monkeypatch, tmp
     assert isinstance(resp, FileResponse)
 
 
+def _serve(response, method="GET", headers=None):
+    """ASGI で 1 回応答させ、(status, headers, body) を返す。"""
+    messages = []
+    scope = {
+        "type": "http",
+        "method": method,
+        "headers": [
+            (key.lower().encode(), value.encode())
+            for key, value in (headers or {}).items()
+        ],
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    start = messages[0]
+    response_headers = {
+        key.decode().lower(): value.decode() for key, value in start["headers"]
+    }
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], response_headers, body
+
+
+def test_fallback_response_supports_ranges_and_conditional_get(monkeypatch, tmp_path):
+    fs = _reload_with(
+        monkeypatch, enabled=False, fsqr_root=str(tmp_path), group_root=str(tmp_path)
+    )
+    target = tmp_path / "file.bin"
+    target.write_bytes(b"0123456789")
+
+    def serve(method="GET", **headers):
+        resp = fs.build_file_response(
+            str(target),
+            media_type="application/octet-stream",
+            # 呼び出し側の Content-Length は stat の値で置き換わる
+            headers={"Content-Length": "999"},
+        )
+        return _serve(resp, method, headers)
+
+    status, headers, body = serve()
+    assert (status, body) == (200, b"0123456789")
+    assert headers["content-length"] == "10"
+    assert headers["accept-ranges"] == "bytes"
+    etag = headers["etag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+
+    assert serve(**{"If-None-Match": f'"other", W/{etag}'})[0] == 304
+    status, headers, body = serve(**{"If-Modified-Since": headers["last-modified"]})
+    assert (status, body) == (304, b"")
+    assert headers["etag"] == etag and "content-length" not in headers
+    # If-None-Match が一致しなければ If-Modified-Since より優先して本文を返す
+    assert (
+        serve(
+            **{
+                "If-None-Match": '"other"',
+                "If-Modified-Since": headers["last-modified"],
+            }
+        )[0]
+        == 200
+    )
+
+    status, headers, body = serve(Range="bytes=2-4")
+    assert (status, body) == (206, b"234")
+    assert headers["content-range"] == "bytes 2-4/10"
+    # FSQR は POST で配信するため、POST でも範囲指定を受け付ける
+    assert serve("POST", Range="bytes=-3")[2] == b"789"
+
+    status, headers, body = serve(Range="bytes=0-1,8-9")
+    assert status == 206
+    assert headers["content-type"].startswith("multipart/byteranges")
+    assert b"01" in body and b"89" in body
+
+    assert serve(Range="bytes=0-1", **{"If-Range": etag})[0] == 206
+    assert serve(Range="bytes=0-1", **{"If-Range": '"stale"'})[0] == 200
+    # 解釈できない指定・多すぎる範囲は無視して全体を返し、範囲外は 416
+    assert serve(Range="items=0-1")[0:3:2] == (200, b"0123456789")
+    many = ",".join(f"{i}-{i}" for i in range(fs.MAX_RANGES + 1))
+    assert serve(Range=f"bytes={many}")[0] == 200
+    assert serve(Range="bytes=20-30")[0] == 416
+
+
+def test_fallback_etag_changes_when_file_is_replaced(monkeypatch, tmp_path):
+    fs = _reload_with(
+        monkeypatch, enabled=False, fsqr_root=str(tmp_path), group_root=str(tmp_path)
+    )
+    target = tmp_path / "file.bin"
+    target.write_bytes(b"first")
+    stat_before = os.stat(target)
+    first = _serve(fs.build_file_response(str(target), media_type="text/plain"))
+    replacement = tmp_path / "replacement.bin"
+    replacement.write_bytes(b"other")
+    os.utime(replacement, ns=(stat_before.st_atime_ns, stat_before.st_mtime_ns))
+    os.replace(replacement, target)
+    second = _serve(fs.build_file_response(str(target), media_type="text/plain"))
+    # サイズと更新時刻が同じでも、置き換えたファイルは別の ETag になる
+    assert first[1]["etag"] != second[1]["etag"]
+
+
 @pytest.fixture(autouse=True)
 def _restore_file_serving():
     """テスト後に本番設定で file_serving を読み戻し、他テストへの影響を防ぐ。"""
@@ -1,10 +1,18 @@
+import hashlib
 import os
+import time
 from html.parser import HTMLParser
 from pathlib import Path
 from unittest.mock import AsyncMock, patch
 
 from starlette.testclient import TestClient
 
+import storage_layout
+
+
+def _stored_path(root, secure_id, suffix):
+    return Path(storage_layout.sharded_path(str(root), secure_id, secure_id + suffix))
+
 
 class OwnerDeletePanelScanner(HTMLParser):
     def __init__(self):
@@ -218,7 +226,7 @@ def test_upload_single_encrypted_file_returns_redirect_url(
     assert payload["data"]["id"] == "abc123"
     assert payload["data"]["password"] == "123456"
     assert payload["data"]["retention_hours"] == 24
-    assert (tmp_path / "abc123-1234567890-report.pdf.enc").exists()
+    assert _stored_path(tmp_path, "abc123-1234567890-report.pdf", ".enc").exists()
     save_mock.assert_awaited_once_with(
         uid="1234567890",
         id="abc123",
@@ -270,13 +278,290 @@ def test_upload_single_filename_with_enc_keeps_download_path_consistent(
     assert response.status_code == 200
     secure_id = "abc123-1234567890-memo.enc.txt"
     assert response.json()["data"]["redirect_url"] == f"/upload_complete/{secure_id}"
-    assert os.path.exists(tmp_path / f"{secure_id}.enc")
+    assert _stored_path(tmp_path, secure_id, ".enc").exists()
     save_mock.assert_awaited_once()
     assert save_mock.await_args.kwargs["secure_id"] == secure_id
     assert save_mock.await_args.kwargs["password"] == "123456"
     assert "share_token" not in save_mock.await_args.kwargs
 
 
+def test_upload_streams_payload_into_upload_dir_and_enforces_size_limit(
+    test_client: TestClient, tmp_path
+):
+    """本文は保存先に直接書き、上限を超えたら受信を止めて一時ファイルを残さない"""
+    payload = b"x" * 4096
+    request_kwargs = {
+        "files": {"upfile": ("data.zip", payload, "application/zip")},
+        "data": {"name": "abc123", "file_type": "multiple"},
+        "headers": {"Accept": "application/json"},
+    }
+    with (
+        patch("FSQR.fsqr_app.STATIC", str(tmp_path)),
+        patch("FSQR.fsqr_app.FSQR_MAX_STORED_PAYLOAD_BYTES", 1024),
+        patch("FSQR.fsqr_data.save_file", AsyncMock()) as save_mock,
+    ):
+        too_large = test_client.post("/upload", **request_kwargs)
+        assert too_large.status_code == 400
+        assert "MB" in too_large.json()["error"]
+        assert list(tmp_path.iterdir()) == []
+        save_mock.assert_not_awaited()
+
+    with (
+        patch("FSQR.fsqr_app.STATIC", str(tmp_path)),
+        patch("FSQR.fsqr_app.uuid.uuid4", return_value="1234567890abcdef"),
+        patch("FSQR.fsqr_data.save_file", AsyncMock()),
+        patch("upload_streaming.open", create=True, wraps=open) as opened,
+    ):
+        response = test_client.post("/upload", **request_kwargs)
+
+    assert response.status_code == 200
+    # 一時ファイルは保存先ディレクトリに作られ、確定後は完成品だけが残る
+    assert os.path.dirname(opened.call_args.args[0]) == str(tmp_path)
+    stored = _stored_path(tmp_path, "abc123-1234567890-data", ".zip")
+    assert [path for path in tmp_path.rglob("*") if path.is_file()] == [stored]
+    assert stored.read_bytes() == payload
+
+
+def test_receive_upload_form_closes_and_removes_temp_files_on_limit(tmp_path):
+    """受信中に上限を超えたら、書きかけの一時ファイルを閉じて消す"""
+    import asyncio
+
+    import pytest
+    from starlette.requests import Request
+
+    from upload_streaming import UploadLimitError, receive_upload_form
+
+    boundary = "testboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="upfile"; filename="a.zip"\r\n'
+        "Content-Type: application/zip\r\n\r\n" + "x" * 64 + f"\r\n--{boundary}--\r\n"
+    ).encode()
+    opened = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    def tracking_open(*args, **kwargs):
+        handle = open(*args, **kwargs)
+        opened.append(handle)
+        return handle
+
+    request = Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "headers": [
+                (b"content-type", f"multipart/form-data; boundary={boundary}".encode())
+            ],
+        },
+        receive,
+    )
+    with (
+        patch("upload_streaming.open", create=True, side_effect=tracking_open),
+        pytest.raises(UploadLimitError),
+    ):
+        asyncio.run(
+            receive_upload_form(
+                request,
+                upload_dir=str(tmp_path),
+                max_files=1,
+                max_total_bytes=16,
+                too_many_files_message="too many",
+                too_large_message="too large",
+            )
+        )
+
+    assert len(opened) == 1
+    assert opened[0].closed
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_chunked_upload_session_resends_bad_chunks_and_publishes(
+    test_client: TestClient, tmp_path
+):
+    """分割アップロードは順不同で受け、壊れたチャンクと欠けたチャンクを再送させる"""
+    payload = b"0123456789"
+
+    def put_chunk(session_id, index, data, digest=None):
+        return test_client.request(
+            "PUT",
+            f"/upload/sessions/{session_id}/chunks/{index}",
+            content=data,
+            headers={"X-Chunk-SHA256": digest or hashlib.sha256(data).hexdigest()},
+        )
+
+    with (
+        patch("FSQR.fsqr_app.STATIC", str(tmp_path)),
+        patch("FSQR.fsqr_app.FSQR_UPLOAD_CHUNK_SIZE_BYTES", 4),
+        patch("FSQR.fsqr_app.uuid.uuid4", return_value="1234567890abcdef"),
+        patch("FSQR.fsqr_data.save_file", AsyncMock()) as save_mock,
+    ):
+        created = test_client.post(
+            "/upload/sessions",
+            json={"filename": "data.zip", "file_type": "multiple", "size": 10},
+        )
+        assert created.status_code == 201
+        session = created.json()["data"]
+        session_id = session["session_id"]
+        assert session["chunk_count"] == 3
+
+        assert put_chunk(session_id, 2, payload[8:]).status_code == 200
+        corrupted = put_chunk(
+            session_id, 0, b"XXXX", digest=hashlib.sha256(payload[:4]).hexdigest()
+        )
+        assert corrupted.status_code == 422
+        assert put_chunk(session_id, 0, payload[:4]).status_code == 200
+        assert put_chunk(session_id, 3, b"x").status_code == 400
+
+        fields = {"name": "abc123", "retention_hours": "24"}
+        incomplete = test_client.post(
+            f"/upload/sessions/{session_id}/complete", json=fields
+        )
+        assert incomplete.status_code == 409
+        assert incomplete.json()["data"]["missing"] == [1]
+        save_mock.assert_not_awaited()
+
+        status = test_client.get(f"/upload/sessions/{session_id}")
+        assert status.json()["data"]["received"] == [0, 2]
+
+        # 受信済みのチャンクも、壊れた再送で上書きされたら受信済みでなくなる
+        assert (
+            put_chunk(
+                session_id, 2, b"XX", digest=hashlib.sha256(payload[8:]).hexdigest()
+            ).status_code
+            == 422
+        )
+        status = test_client.get(f"/upload/sessions/{session_id}")
+        assert status.json()["data"]["received"] == [0]
+        assert put_chunk(session_id, 2, payload[8:]).status_code == 200
+
+        assert put_chunk(session_id, 1, payload[4:8]).status_code == 200
+        completed = test_client.post(
+            f"/upload/sessions/{session_id}/complete", json=fields
+        )
+
+    assert completed.status_code == 200
+    assert completed.json()["data"]["id"] == "abc123"
+    save_mock.assert_awaited_once()
+    # 確定後は完成品だけが残り、セッションの一時ファイルは消える
+    stored = _stored_path(tmp_path, "abc123-1234567890-data", ".zip")
+    assert [path for path in tmp_path.rglob("*") if path.is_file()] == [stored]
+    assert stored.read_bytes() == payload
+
+
+def test_chunked_upload_session_rejects_oversized_and_foreign_sessions(
+    test_client: TestClient, tmp_path
+):
+    from FSQR import fsqr_upload_sessions
+
+    with (
+        patch("FSQR.fsqr_app.STATIC", str(tmp_path)),
+        patch("FSQR.fsqr_app.FSQR_MAX_STORED_PAYLOAD_BYTES", 1024),
+    ):
+        too_large = test_client.post(
+            "/upload/sessions",
+            json={"filename": "data.zip", "file_type": "multiple", "size": 2048},
+        )
+        wrong_suffix = test_client.post(
+            "/upload/sessions",
+            json={"filename": "data.txt", "file_type": "multiple", "size": 10},
+        )
+        foreign = fsqr_upload_sessions.create_session(
+            str(tmp_path),
+            filename="data.zip",
+            file_type="multiple",
+            size=10,
+            chunk_size=4,
+            owner="someone-else",
+        )
+        status = test_client.get(f"/upload/sessions/{foreign['session_id']}")
+
+    assert too_large.status_code == 413
+    assert wrong_suffix.status_code == 400
+    assert status.status_code == 404
+
+
+def test_upload_session_completion_waits_for_chunk_writes(tmp_path):
+    """確定処理は書き込み中のチャンクを待ち、確保後のチャンクは受け付けない"""
+    import threading
+
+    from FSQR import fsqr_upload_sessions
+
+    upload_dir = str(tmp_path)
+    session = fsqr_upload_sessions.create_session(
+        upload_dir,
+        filename="data.zip",
+        file_type="multiple",
+        size=8,
+        chunk_size=4,
+        owner="owner",
+    )
+    session_id = session["session_id"]
+    first = fsqr_upload_sessions.open_chunk(upload_dir, session, 0)
+    first.write(b"0123", 0)
+    first.mark_received()
+    first.close()
+    writer = fsqr_upload_sessions.open_chunk(upload_dir, session, 1)
+    writer.write(b"45", 4)
+
+    outcome = []
+    completion = threading.Thread(
+        target=lambda: outcome.append(
+            fsqr_upload_sessions.claim_complete_session(upload_dir, session_id)
+        )
+    )
+    completion.start()
+    completion.join(timeout=0.2)
+    assert completion.is_alive()
+    # 確保後に来たチャンクは書かせない
+    assert fsqr_upload_sessions.open_chunk(upload_dir, session, 0) is None
+
+    writer.write(b"67", 6)
+    writer.mark_received()
+    writer.close()
+    completion.join(timeout=5)
+
+    claimed, missing = outcome[0]
+    assert claimed["session_id"] == session_id
+    assert missing == []
+    data_path = fsqr_upload_sessions.data_path(upload_dir, session_id)
+    with open(data_path, "rb") as handle:
+        assert handle.read() == b"01234567"
+
+
+def test_remove_stale_upload_files_keeps_active_sessions(tmp_path):
+    from FSQR import fsqr_upload_sessions
+
+    def create(owner):
+        return fsqr_upload_sessions.create_session(
+            str(tmp_path),
+            filename="data.zip",
+            file_type="multiple",
+            size=10,
+            chunk_size=4,
+            owner=owner,
+        )
+
+    stale = create("a")
+    active = create("b")
+    leftover = tmp_path / ".0123456789abcdef.uploading"
+    leftover.write_bytes(b"partial")
+    unrelated = tmp_path / "abc123-1234567890-data.zip"
+    unrelated.write_bytes(b"published")
+    old = time.time() - 7200
+    for path in tmp_path.iterdir():
+        if path.name.startswith((f".{stale['session_id']}", leftover.name)):
+            os.utime(path, (old, old))
+    os.utime(unrelated, (old, old))
+
+    assert fsqr_upload_sessions.remove_stale_upload_files(str(tmp_path), 3600) == 2
+    assert fsqr_upload_sessions.load_session(str(tmp_path), stale["session_id"]) is None
+    assert fsqr_upload_sessions.load_session(str(tmp_path), active["session_id"])
+    assert not leftover.exists()
+    assert unrelated.exists()
+
+
 def test_upload_succeeds_when_share_link_creation_fails(
     test_client: TestClient, tmp_path
 ):
@@ -320,7 +605,7 @@ def test_upload_succeeds_when_share_link_creation_fails(
         payload["data"]["redirect_url"]
         == "/upload_complete/abc123-1234567890-report.pdf"
     )
-    assert (tmp_path / "abc123-1234567890-report.pdf.enc").exists()
+    assert _stored_path(tmp_path, "abc123-1234567890-report.pdf", ".enc").exists()
     save_mock.assert_awaited_once()
 
 
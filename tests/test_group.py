@@ -1,10 +1,12 @@
 import asyncio
 import re
+from pathlib import Path
 from unittest.mock import AsyncMock, mock_open, patch
 
 from starlette.testclient import TestClient
 
 from Group import group_data
+from Group.group_storage import room_folder
 from share_links import encrypt_share_password
 
 
@@ -430,7 +432,8 @@ def test_group_upload_succeeds_when_realtime_notification_fails(
     payload = response.json()
     assert payload["status"] == "ok"
     assert payload["data"]["saved_files"] == ["notes.txt"]
-    assert (tmp_path / "abc123" / "notes.txt").read_bytes() == b"hello"
+    room_path = Path(room_folder("abc123", root=str(tmp_path)))
+    assert (room_path / "notes.txt").read_bytes() == b"hello"
 
 
 # --- check (list_files): 認証失敗 → 404 ---
@@ -43,6 +43,34 @@ def test_gunicorn_conf_reads_environment_with_safe_defaults(monkeypatch):
         importlib.reload(gunicorn_conf)
 
 
+def test_db_pool_sizes_follow_worker_count_and_connection_budget():
+    from settings import db_pool_sizes
+
+    # 既定（4 ワーカー × Blue/Green 2 スロット、200 接続から予備 20）
+    assert db_pool_sizes(4, 200, 20, 2) == {"write": (9, 5), "read": (5, 3)}
+    # ワーカーを増やすと 1 ワーカーあたりの接続を減らして上限内に収める
+    sizes = db_pool_sizes(16, 200, 20, 2)
+    per_worker = sum(size + overflow for size, overflow in sizes.values())
+    assert per_worker * 16 * 2 <= 200 - 20
+    # 予算が大きくても 1 ワーカーで使い切れない数は持たない
+    assert db_pool_sizes(1, 1000, 20, 1) == {"write": (10, 6), "read": (5, 3)}
+
+
+def test_db_pool_sizes_warn_when_workers_exceed_connection_budget(caplog):
+    from settings import db_pool_sizes
+
+    # 60 ワーカー × 2 スロットでは 1 ワーカー 1 本にも満たない
+    with caplog.at_level("WARNING", logger="settings"):
+        sizes = db_pool_sizes(60, 100, 20, 2)
+
+    assert sizes == {"write": (1, 0), "read": (1, 0)}
+    assert "short by 160" in caplog.text
+    caplog.clear()
+    with caplog.at_level("WARNING", logger="settings"):
+        db_pool_sizes(4, 200, 20, 2)
+    assert caplog.text == ""
+
+
 def test_migration_runner_env_urls_and_disabled_startup(monkeypatch):
     import migration_runner
 
@@ -1,7 +1,7 @@
 import asyncio
 import hashlib
 import hmac
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import share_links
 from share_links import ServiceKey
@@ -117,16 +117,16 @@ def test_create_share_link_inserts_hashed_token():
 
 
 def test_resolve_share_link_rejects_short_token_without_query():
-    execute_mock = AsyncMock()
-    with patch("share_links.execute_query", execute_mock):
+    fetch_mock = AsyncMock()
+    with patch("share_links.fetch_one", fetch_mock):
         result = asyncio.run(share_links.resolve_share_link("short"))
 
     assert result is None
-    execute_mock.assert_not_awaited()
+    fetch_mock.assert_not_awaited()
 
 
 def test_resolve_share_link_returns_none_for_missing_or_service_mismatch():
-    with patch("share_links.execute_query", AsyncMock(return_value=[])):
+    with patch("share_links.fetch_one", AsyncMock(return_value=None)):
         assert (
             asyncio.run(
                 share_links.resolve_share_link("a" * 32, service_key=ServiceKey.NOTE)
@@ -135,8 +135,8 @@ def test_resolve_share_link_returns_none_for_missing_or_service_mismatch():
         )
 
     with patch(
-        "share_links.execute_query",
-        AsyncMock(return_value=[{"service_key": "group", "resource_id": "abc123"}]),
+        "share_links.fetch_one",
+        AsyncMock(return_value={"service_key": "group", "resource_id": "abc123"}),
     ):
         assert (
             asyncio.run(
@@ -153,7 +153,7 @@ def test_resolve_share_link_returns_matching_row():
         "scope": "read",
         "metadata": "{}",
     }
-    with patch("share_links.execute_query", AsyncMock(return_value=[row])):
+    with patch("share_links.fetch_one", AsyncMock(return_value=row)):
         result = asyncio.run(
             share_links.resolve_share_link("a" * 32, service_key=ServiceKey.NOTE)
         )
@@ -174,3 +174,36 @@ def test_revoke_resource_links_marks_active_links_revoked():
         "service_key": "group",
         "resource_id": "abc123",
     }
+
+
+def test_revoke_links_for_resources_runs_chunks_in_one_transaction():
+    class Transaction:
+        entered = 0
+
+        async def __aenter__(self):
+            Transaction.entered += 1
+            return self
+
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
+
+    db_session = MagicMock()
+    db_session.begin.return_value = Transaction()
+    db_session.execute = AsyncMock()
+    with (
+        patch("share_links.db_session", db_session),
+        patch("share_links.DB_BULK_CHUNK_SIZE", 2),
+    ):
+        asyncio.run(
+            share_links.revoke_links_for_resources(
+                service_key=ServiceKey.FSQR, resource_ids=["a", "b", "a", "c"]
+            )
+        )
+
+    assert Transaction.entered == 1
+    assert [
+        call.args[1]["resource_ids"] for call in db_session.execute.await_args_list
+    ] == [
+        ["a", "b"],
+        ["c"],
+    ]
@@ -0,0 +1,102 @@
+"""storage_layout と scripts/migrate_storage_layout.py のテスト。"""
+
+import importlib.util
+import os
+from pathlib import Path
+
+import storage_layout
+from Group import group_storage
+
+
+def _load_migration_script():
+    path = Path(__file__).resolve().parents[1] / "scripts" / "migrate_storage_layout.py"
+    spec = importlib.util.spec_from_file_location("migrate_storage_layout", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_sharded_path_fans_out_by_key_hash(tmp_path):
+    path = storage_layout.sharded_path(str(tmp_path), "abc123-uid-file", "x.zip")
+    first, second, name = Path(path).relative_to(tmp_path).parts
+    assert storage_layout.is_shard_dir_name(first)
+    assert storage_layout.is_shard_dir_name(second)
+    assert name == "x.zip"
+    # 同じキーは常に同じ位置になる
+    assert path == storage_layout.sharded_path(
+        str(tmp_path), "abc123-uid-file", "x.zip"
+    )
+
+
+def test_find_existing_prefers_sharded_and_falls_back_to_flat(tmp_path):
+    root = str(tmp_path)
+    assert storage_layout.find_existing(root, "sid", "sid.zip") is None
+    flat = tmp_path / "sid.zip"
+    flat.write_bytes(b"old")
+    assert storage_layout.find_existing(root, "sid", "sid.zip") == str(flat)
+    sharded = storage_layout.sharded_path(root, "sid", "sid.zip")
+    os.makedirs(os.path.dirname(sharded))
+    Path(sharded).write_bytes(b"new")
+    assert storage_layout.find_existing(root, "sid", "sid.zip") == sharded
+
+
+def test_group_room_folders_include_flat_layout(tmp_path):
+    flat = tmp_path / "room01"
+    flat.mkdir()
+    (flat / "old.txt").write_bytes(b"old")
+    sharded = Path(group_storage.room_folder("room01", root=str(tmp_path)))
+    sharded.mkdir(parents=True)
+    (sharded / "new.txt").write_bytes(b"new")
+
+    files = group_storage.collect_room_files(
+        "room01", primary_root=str(tmp_path), include_legacy=False
+    )
+    assert files == {
+        "new.txt": str(sharded / "new.txt"),
+        "old.txt": str(flat / "old.txt"),
+    }
+
+
+def test_migration_moves_files_and_drops_ones_deleted_during_grace(tmp_path):
+    migration = _load_migration_script()
+    fsqr_root = tmp_path / "fsqr"
+    group_root = tmp_path / "group"
+    fsqr_root.mkdir()
+    (fsqr_root / "abc123-uid-a.zip").write_bytes(b"a")
+    (fsqr_root / "abc123-uid-b.enc").write_bytes(b"b")
+    (fsqr_root / ".0123456789abcdef.uploading").write_bytes(b"temp")
+    room = group_root / "room01"
+    room.mkdir(parents=True)
+    (room / "notes.txt").write_bytes(b"notes")
+
+    assert (
+        migration.migrate(str(fsqr_root), str(group_root), grace_seconds=0, apply=False)
+        == 0
+    )
+    assert (fsqr_root / "abc123-uid-a.zip").exists()
+
+    moves = migration.plan_fsqr_moves(str(fsqr_root))
+    moves += migration.plan_group_moves(str(group_root))
+    linked = migration.link_into_layout(moves)
+    assert len(linked) == 3
+    # 猶予中は新旧どちらの位置からも読める。利用者が消したものは旧位置も消す
+    deleted = storage_layout.sharded_path(
+        str(fsqr_root), "abc123-uid-b", "abc123-uid-b.enc"
+    )
+    os.remove(deleted)
+    assert migration.unlink_sources(linked) == 3
+    migration.remove_empty_room_folders(str(group_root))
+
+    assert not (fsqr_root / "abc123-uid-a.zip").exists()
+    assert not (fsqr_root / "abc123-uid-b.enc").exists()
+    assert (fsqr_root / ".0123456789abcdef.uploading").exists()
+    assert storage_layout.find_existing(
+        str(fsqr_root), "abc123-uid-a", "abc123-uid-a.zip"
+    ) == storage_layout.sharded_path(str(fsqr_root), "abc123-uid-a", "abc123-uid-a.zip")
+    assert (
+        storage_layout.find_existing(str(fsqr_root), "abc123-uid-b", "abc123-uid-b.enc")
+        is None
+    )
+    assert not room.exists()
+    moved = Path(group_storage.room_folder("room01", root=str(group_root)))
+    assert (moved / "notes.txt").read_bytes() == b"notes"
@@ -97,9 +97,7 @@ def test_import_tasks_success(test_client):
             new_callable=AsyncMock,
             return_value=0,
         ),
-        patch(
-            "Task.task_routes_io.task_data.create_item", new_callable=AsyncMock
-        ) as create_item,
+        patch("Task.task_routes_io.task_data.create_items", new_callable=AsyncMock),
     ):
         # By passing an empty CSRF token we bypass web.py CSRF but we also need to mock enforce_csrf if it fails
         pass
@@ -118,8 +116,10 @@ def test_import_tasks_success(test_client):
             return_value=0,
         ),
         patch(
-            "Task.task_routes_io.task_data.create_item", new_callable=AsyncMock
-        ) as create_item,
+            "Task.task_routes_io.task_data.create_items",
+            new_callable=AsyncMock,
+            return_value=2,
+        ) as create_items,
         patch(
             "Task.task_routes_io.task_data.resolve_tag_names",
             new_callable=AsyncMock,
@@ -136,11 +136,62 @@ def test_import_tasks_success(test_client):
     assert data["status"] == "ok"
     assert data["data"]["imported_count"] == 2
     assert data["data"]["skipped_count"] == 0
-    assert create_item.call_count == 2
-    # タグ名はルームのタグへ解決してから紐づける
-    assert resolve_tag_names.await_args_list[1].args[1] == ["設計", "調査"]
-    assert create_item.call_args_list[1].args[1]["tag_ids"] == [7, 8]
-    assert "category" not in create_item.call_args_list[1].args[1]
+    # タスクは 1 回の呼び出しでまとめて追加する
+    create_items.assert_awaited_once()
+    values_list = create_items.await_args.args[1]
+    assert len(values_list) == 2
+    # タグ名はファイル全体で 1 回だけ、ルームのタグへ解決してから紐づける
+    resolve_tag_names.assert_awaited_once()
+    assert resolve_tag_names.await_args.args[1] == ["設計", "調査"]
+    assert values_list[0]["tag_ids"] == []
+    assert values_list[1]["tag_ids"] == [7, 8]
+    assert "category" not in values_list[1]
+
+
+def test_import_tasks_counts_items_over_the_limit_as_skipped(test_client):
+    import_data = {
+        "version": 2,
+        "tasks": [
+            {"title": "ok", "board_status": "todo"},
+            {"title": "", "board_status": "todo"},
+            {"title": "over", "board_status": "todo"},
+        ],
+    }
+    ROOM_META = {"room_id": "abc123", "id": "abc123", "retention_hours": 24}
+
+    with (
+        patch("Task.task_authorize.enforce_csrf", new_callable=AsyncMock),
+        patch("Task.task_authorize.has_task_room_access", return_value=True),
+        patch(
+            "Task.task_routes_io.task_data.get_room_meta_direct",
+            new_callable=AsyncMock,
+            return_value=ROOM_META,
+        ),
+        patch(
+            "Task.task_routes_io.task_data.count_items",
+            new_callable=AsyncMock,
+            return_value=0,
+        ),
+        patch(
+            "Task.task_routes_io.task_data.create_items",
+            new_callable=AsyncMock,
+            return_value=1,
+        ) as create_items,
+        patch(
+            "Task.task_routes_io.task_data.resolve_tag_names", new_callable=AsyncMock
+        ) as resolve_tag_names,
+    ):
+        files = {
+            "file": ("tasks.json", json.dumps(import_data).encode(), "application/json")
+        }
+        response = test_client.post("/api/task/abc123/import", files=files)
+
+    assert response.status_code == 200
+    data = response.json()["data"]
+    # 入力不正の 1 件と、上限で追加されなかった 1 件を数える
+    assert data == {"imported_count": 1, "skipped_count": 2}
+    assert len(create_items.await_args.args[1]) == 2
+    resolve_tag_names.assert_not_awaited()
 
 
 def test_import_tasks_invalid_json(test_client):
@@ -248,8 +299,10 @@ def test_import_tasks_accepts_legacy_category_files(test_client):
             return_value=0,
         ),
         patch(
-            "Task.task_routes_io.task_data.create_item", new_callable=AsyncMock
-        ) as create_item,
+            "Task.task_routes_io.task_data.create_items",
+            new_callable=AsyncMock,
+            return_value=1,
+        ) as create_items,
         patch(
             "Task.task_routes_io.task_data.resolve_tag_names",
             new_callable=AsyncMock,
@@ -265,4 +318,4 @@ def test_import_tasks_accepts_legacy_category_files(test_client):
     assert response.json()["data"]["imported_count"] == 1
     resolve_tag_names.assert_awaited_once()
     assert resolve_tag_names.await_args.args[1] == ["機能開発"]
-    assert create_item.call_args.args[1]["tag_ids"] == [21]
+    assert create_items.await_args.args[1][0]["tag_ids"] == [21]
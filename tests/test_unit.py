@@ -3,7 +3,7 @@
 import asyncio
 import re
 from datetime import datetime
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
@@ -302,7 +302,7 @@ def test_remove_expired_files_returns_stats_and_records_status():
     expired_rows = [{"secure_id": "old-file-1"}, {"secure_id": "old-file-2"}]
     with (
         patch(
-            "FSQR.fsqr_data.execute_query",
+            "FSQR.fsqr_data.fetch_all",
             new_callable=AsyncMock,
             return_value=expired_rows,
         ),
@@ -370,6 +370,563 @@ def test_get_client_ip_uses_client_host_when_header_present():
     assert get_client_ip(req) == "10.1.2.3"
 
 
+# ---------------------------------------------------------------------------
+# database – 読み取り専用の fetch_all / fetch_one
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def real_database():
+    """conftest のモックではなく database.py 本体を読み込む（エンジンは作らない）。"""
+    import importlib
+    import sys
+
+    mocked = sys.modules.pop("database")
+    try:
+        with patch("sqlalchemy.ext.asyncio.create_async_engine"):
+            yield importlib.import_module("database")
+    finally:
+        sys.modules["database"] = mocked
+
+
+class _FakeReadConnection:
+    def __init__(self, results):
+        self.results = results
+        self.executed = []
+        self.rollback = AsyncMock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    async def execute(self, stmt, params=None):
+        self.executed.append((str(stmt), params))
+        outcome = self.results.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        result = MagicMock()
+        result.mappings.return_value.all.return_value = outcome
+        result.mappings.return_value.first.return_value = (
+            outcome[0] if outcome else None
+        )
+        result.all.return_value = [tuple(row.values()) for row in outcome]
+        return result
+
+
+def test_fetch_all_and_fetch_one_read_without_session(real_database):
+    conn = _FakeReadConnection([[{"id": 1}, {"id": 2}], []])
+    read_engine = MagicMock()
+    read_engine.connect.return_value = conn
+
+    with (
+        patch.object(real_database, "read_engine", read_engine),
+        patch.object(real_database, "db_session") as session,
+    ):
+        rows = asyncio.run(real_database.fetch_all("SELECT id FROM t"))
+        row = asyncio.run(real_database.fetch_one("SELECT id FROM t WHERE id = :i"))
+
+    assert rows == [{"id": 1}, {"id": 2}]
+    assert row is None
+    assert conn.executed[1][1] == {}
+    # 読み取りは db_session を使わず、ROLLBACK も送らない
+    session.execute.assert_not_called()
+    session.rollback.assert_not_called()
+    conn.rollback.assert_not_awaited()
+
+
+def test_fetch_rows_returns_row_tuples(real_database):
+    conn = _FakeReadConnection([[{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]])
+    read_engine = MagicMock()
+    read_engine.connect.return_value = conn
+
+    with patch.object(real_database, "read_engine", read_engine):
+        rows = asyncio.run(real_database.fetch_rows("SELECT id, name FROM t"))
+
+    assert rows == [(1, "a"), (2, "b")]
+
+
+def test_fetch_one_retries_retryable_errors(real_database):
+    from sqlalchemy.exc import OperationalError
+
+    lost = OperationalError("SELECT 1", {}, Exception(2013, "Lost connection"))
+    conn = _FakeReadConnection([lost, [{"id": 7}]])
+    read_engine = MagicMock()
+    read_engine.connect.return_value = conn
+
+    with (
+        patch.object(real_database, "read_engine", read_engine),
+        patch("asyncio.sleep", new=AsyncMock()) as sleep,
+    ):
+        row = asyncio.run(real_database.fetch_one("SELECT 1", {"i": 7}))
+
+    assert row == {"id": 7}
+    assert len(conn.executed) == 2
+    sleep.assert_awaited_once()
+
+
+def test_circuit_breaker_fails_fast_while_open_and_probes_once(real_database):
+    breaker = real_database.CircuitBreaker(failure_threshold=2, reset_seconds=5)
+    clock = [100.0]
+
+    with patch("database.time.monotonic", side_effect=lambda: clock[0]):
+        breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        with pytest.raises(real_database.DatabaseUnavailableError):
+            breaker.before_call()
+
+        # 経過後は 1 件だけ試行を通し、同時の呼び出しは断る
+        clock[0] += 6
+        breaker.before_call()
+        assert breaker.state == "half_open"
+        with pytest.raises(real_database.DatabaseUnavailableError):
+            breaker.before_call()
+        breaker.record_success()
+
+    assert breaker.state == "closed"
+    assert breaker.stats["opened"] == 1
+    assert breaker.stats["rejected"] == 2
+
+
+def test_execute_query_shares_one_probe_and_keeps_the_pool(real_database):
+    from sqlalchemy.exc import OperationalError
+
+    lost = OperationalError("SELECT 1", {}, Exception(2013, "Lost connection"))
+    calls = {"n": 0}
+
+    async def execute(stmt, params):
+        calls["n"] += 1
+        if calls["n"] <= 3:
+            raise lost
+        return MagicMock(rowcount=1)
+
+    session = MagicMock()
+    session.execute = AsyncMock(side_effect=execute)
+    session.commit = AsyncMock()
+    session.rollback = AsyncMock()
+    session.invalidate = AsyncMock()
+    session.remove = AsyncMock()
+    engine = MagicMock()
+    engine.dispose = AsyncMock()
+    probe = AsyncMock()
+    breaker = real_database.CircuitBreaker(failure_threshold=5, reset_seconds=5)
+
+    async def scenario():
+        return await asyncio.gather(
+            *(real_database.execute_query("UPDATE t SET a = 1") for _ in range(3))
+        )
+
+    with (
+        patch.object(real_database, "db_session", session),
+        patch.object(real_database, "engine", engine),
+        patch.object(real_database, "db_breaker", breaker),
+        patch.object(real_database, "_ping", probe),
+        patch("asyncio.sleep", new=AsyncMock()),
+    ):
+        results = asyncio.run(scenario())
+
+    assert results == [1, 1, 1]
+    # 3 つの失敗は 1 回の疎通確認を共有し、プール全体は破棄しない
+    probe.assert_awaited_once()
+    engine.dispose.assert_not_awaited()
+    assert session.invalidate.await_count == 3
+    assert breaker.state == "closed"
+
+
+def test_execute_many_runs_chunks_in_one_transaction_and_retries(real_database):
+    from sqlalchemy.exc import OperationalError
+
+    lost = OperationalError("INSERT", {}, Exception(2013, "Lost connection"))
+    batches = []
+
+    async def execute(stmt, params):
+        if lost and not batches:
+            batches.append("lost")
+            raise lost
+        batches.append(list(params))
+        return MagicMock(rowcount=len(params))
+
+    session = MagicMock()
+    session.execute = AsyncMock(side_effect=execute)
+    session.commit = AsyncMock()
+    session.rollback = AsyncMock()
+    session.invalidate = AsyncMock()
+    session.remove = AsyncMock()
+    rows = [{"id": index} for index in range(5)]
+
+    with (
+        patch.object(real_database, "db_session", session),
+        patch.object(real_database, "_ping", AsyncMock()),
+        patch("asyncio.sleep", new=AsyncMock()),
+    ):
+        total = asyncio.run(
+            real_database.execute_many(
+                "INSERT INTO t (id) VALUES (:id)", rows, chunk_size=2
+            )
+        )
+        assert asyncio.run(real_database.execute_many("INSERT", [])) == 0
+
+    assert total == 5
+    # 接続断のあとはトランザクションごとやり直し、2 件ずつ送る
+    assert batches[1:] == [rows[0:2], rows[2:4], rows[4:5]]
+    session.commit.assert_awaited_once()
+    session.invalidate.assert_awaited_once()
+
+
+def test_statement_registry_reuses_clauses_and_expands_in_lists():
+    from sqlalchemy.dialects import mysql
+
+    from sql_statements import statement
+
+    sql = "SELECT tag_id FROM task_tag WHERE room_id = :room_id AND tag_id IN :ids"
+    stmt = statement(sql, "ids")
+
+    assert statement(sql, "ids") is stmt
+    assert statement(sql) is not stmt
+    # リストの長さが違っても同じ文を使い、IN 句はバインド時に展開される
+    assert "IN (__[POSTCOMPILE_ids])" in str(stmt)
+    compiled = stmt.compile(dialect=mysql.dialect())
+    expanded = compiled.construct_expanded_state({"room_id": "r", "ids": [1, 2, 3]})
+    assert "tag_id IN (%s, %s, %s)" in expanded.statement
+
+
+def test_instrumented_pool_reports_checkouts_and_overflow(real_database):
+    pool = real_database.InstrumentedQueuePool(
+        lambda: MagicMock(), pool_size=2, max_overflow=1, timeout=1
+    )
+
+    held = [pool.connect() for _ in range(3)]
+    gauges = pool.gauges()
+    for conn in held:
+        conn.close()
+
+    assert gauges["size"] == 2
+    assert gauges["checked_out"] == 3
+    assert gauges["overflow"] == 1
+    assert gauges["waiting"] == 0
+    assert gauges["checkouts"] == 3
+    assert gauges["wait_ms_max"] >= gauges["wait_ms_avg"] >= 0
+    assert pool.gauges()["checked_out"] == 0
+
+
+def test_warm_up_pools_holds_connections_concurrently(real_database):
+    opened = []
+
+    def fake_engine(size):
+        pool_engine = MagicMock()
+        pool_engine.pool.size.return_value = size
+
+        def connect():
+            conn = _FakeReadConnection([[{"1": 1}]])
+            opened.append(conn)
+            return conn
+
+        pool_engine.connect.side_effect = connect
+        return pool_engine
+
+    failing = MagicMock()
+    failing.pool.size.return_value = 5
+    failing.connect.side_effect = OSError("refused")
+
+    with (
+        patch.object(real_database, "engine", fake_engine(2)),
+        patch.object(real_database, "read_engine", fake_engine(1)),
+        patch.object(real_database, "replica_engines", [failing]),
+    ):
+        result = asyncio.run(real_database.warm_up_pools(3))
+
+    # pool_size を超えては張らず、失敗したプールがあっても起動は止めない
+    assert result == {"primary": 2, "read": 1, "replica_0": 0}
+    assert len(opened) == 3
+
+
+def _replica_setup(real_database, replica_results, primary_results, max_lag=5):
+    replica_conn = _FakeReadConnection(replica_results)
+    replica = MagicMock()
+    replica.connect.return_value = replica_conn
+    primary_conn = _FakeReadConnection(primary_results)
+    primary = MagicMock()
+    primary.connect.return_value = primary_conn
+    router = real_database.ReplicaRouter([replica], max_lag, check_interval=10)
+    patches = (
+        patch.object(real_database, "read_engine", primary),
+        patch.object(real_database, "replica_router", router),
+    )
+    return replica_conn, primary_conn, router, patches
+
+
+def test_replica_reads_use_replica_and_cache_the_lag_check(real_database):
+    replica_conn, primary_conn, router, patches = _replica_setup(
+        real_database,
+        [[{"Seconds_Behind_Source": 1}], [{"id": 1}], [{"id": 2}]],
+        [[{"id": 3}]],
+    )
+
+    async def scenario():
+        return (
+            await real_database.fetch_all("SELECT id FROM t", replica=True),
+            await real_database.fetch_one("SELECT id FROM t", replica=True),
+            await real_database.fetch_one("SELECT id FROM t WHERE id = 3"),
+        )
+
+    with patches[0], patches[1]:
+        rows, row, primary_row = asyncio.run(scenario())
+
+    assert rows == [{"id": 1}]
+    assert row == {"id": 2}
+    # replica=True を付けない読み取りは primary のまま
+    assert primary_row == {"id": 3}
+    assert [sql for sql, _ in replica_conn.executed].count("SHOW REPLICA STATUS") == 1
+    assert router.stats["replica_reads"] == 2
+
+
+def test_replica_reads_stay_on_primary_after_a_write_in_the_request(real_database):
+    replica_conn, primary_conn, router, patches = _replica_setup(
+        real_database, [[{"Seconds_Behind_Source": 0}], [{"id": 1}]], [[{"id": 2}]]
+    )
+
+    async def request():
+        token = real_database.begin_request_db_scope()
+        try:
+            before = await real_database.fetch_one("SELECT id FROM t", replica=True)
+            # db_session のコミット（after_commit）で記録される
+            real_database.mark_primary_write()
+            after = await real_database.fetch_one("SELECT id FROM t", replica=True)
+            return before, after
+        finally:
+            real_database.end_request_db_scope(token)
+
+    with patches[0], patches[1]:
+        before, after = asyncio.run(request())
+
+    assert before == {"id": 1}
+    assert after == {"id": 2}
+    assert real_database.wrote_in_request() is False
+    assert router.stats["primary_reads"] == 1
+
+
+def test_lagging_or_stopped_replica_falls_back_to_primary(real_database):
+    replica_conn, primary_conn, router, patches = _replica_setup(
+        real_database,
+        [[{"Seconds_Behind_Source": 30}]],
+        [[{"id": 1}]],
+    )
+
+    with patches[0], patches[1]:
+        row = asyncio.run(real_database.fetch_one("SELECT id FROM t", replica=True))
+
+    assert row == {"id": 1}
+    assert router.snapshot()["healthy"] == 0
+    assert router.stats["unhealthy"] == 1
+
+
+# ---------------------------------------------------------------------------
+# request_memo
+# ---------------------------------------------------------------------------
+
+
+def test_request_memo_reuses_results_only_inside_a_request():
+    from request_memo import (
+        begin_request_memo,
+        clear_request_memo,
+        end_request_memo,
+        request_memo,
+    )
+
+    calls = []
+
+    @request_memo
+    async def lookup(room_id, password=None):
+        calls.append((room_id, password))
+        if room_id == "broken":
+            raise RuntimeError("db down")
+        return {"room_id": room_id}
+
+    async def scenario():
+        await lookup("outside")
+        await lookup("outside")
+        token = begin_request_memo()
+        try:
+            first = await lookup("r1")
+            again, other = await asyncio.gather(lookup("r1"), lookup("r1", "pw"))
+            for _ in range(2):
+                with pytest.raises(RuntimeError):
+                    await lookup("broken")
+            # コミット後（database.mark_primary_write）は引き直す
+            clear_request_memo()
+            await lookup("r1")
+            return first, again, other
+        finally:
+            end_request_memo(token)
+
+    first, again, other = asyncio.run(scenario())
+
+    assert first is again
+    assert other == {"room_id": "r1"}
+    assert calls == [
+        ("outside", None),
+        ("outside", None),
+        ("r1", None),
+        ("r1", "pw"),
+        ("broken", None),
+        ("broken", None),
+        ("r1", None),
+    ]
+
+
+# ---------------------------------------------------------------------------
+# query_profiler
+# ---------------------------------------------------------------------------
+
+
+def test_query_fingerprint_hides_values_and_folds_in_lists():
+    from query_profiler import fingerprint
+
+    sql = """
+        SELECT * FROM task_item
+        WHERE room_id = 'abc' AND item_id IN (%s, %s, %s) AND position > 100
+    """
+
+    assert fingerprint(sql) == (
+        "SELECT * FROM task_item WHERE room_id = ? AND item_id IN (?+) AND position > ?"
+    )
+
+
+def test_query_profiler_counts_request_queries_and_logs_slow_ones(caplog):
+    import logging
+
+    from sqlalchemy import create_engine, text
+
+    import query_profiler
+
+    engine = create_engine("sqlite://")
+
+    def run_queries():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT :v"), {"v": 2})
+
+    token = query_profiler.begin_request_profile()
+    with (
+        patch.object(query_profiler, "DB_SLOW_QUERY_MS", 0.000001),
+        caplog.at_level(logging.WARNING, logger="database.slow_query"),
+    ):
+        run_queries()
+    profile = query_profiler.end_request_profile(token)
+    # リクエストの外の問い合わせは数えない
+    run_queries()
+
+    assert profile.count == 2
+    assert profile.total_ms >= profile.slowest_ms > 0
+    assert profile.server_timing().startswith("db;dur=")
+    assert 'desc="2 queries"' in profile.server_timing()
+    assert profile.as_log_fields()["slowest"] == "SELECT ?"
+    assert any("Slow query" in record.message for record in caplog.records)
+
+
+# ---------------------------------------------------------------------------
+# api_response
+# ---------------------------------------------------------------------------
+
+
+def test_api_json_response_renders_bytes_and_falls_back_to_json():
+    import json
+
+    from api_response import ApiJSONResponse, api_ok_response
+
+    response = api_ok_response({"items": [{"title": "タスク", 1: None}]})
+    assert isinstance(response.body, bytes)
+    assert json.loads(response.body) == {
+        "status": "ok",
+        "data": {"items": [{"title": "タスク", "1": None}]},
+        "error": None,
+    }
+    assert "タスク".encode() in response.body
+
+    # orjson が扱えない 64bit 超の整数は標準の json で書き出す
+    assert json.loads(ApiJSONResponse({"n": 2**70}).body) == {"n": 2**70}
+
+
+# ---------------------------------------------------------------------------
+# cache_codec
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("codec_name", ["json", "orjson"])
+def test_cache_codec_round_trips_typed_values(codec_name):
+    from datetime import date, datetime, time, timedelta
+    from decimal import Decimal
+
+    import cache_codec
+
+    if codec_name == "orjson" and cache_codec.orjson is None:
+        pytest.skip("orjson is not installed")
+    codec = cache_codec.get_codec(codec_name)
+    rows = [
+        {
+            "time": datetime(2026, 1, 1, 12, 0, 0, 123456),
+            "due_date": date(2026, 1, 2),
+            "start": time(9, 30),
+            "elapsed": timedelta(days=1, seconds=5),
+            "size": Decimal("3.14"),
+            "title": "ノート",
+            "meta": {"nested": [date(2026, 3, 4)]},
+        }
+    ]
+
+    payload = codec.encode(rows)
+
+    assert isinstance(payload, str)
+    assert codec.decode(payload) == rows
+    # バックエンドが違っても同じ形式なので互いに読める
+    assert cache_codec.JsonCodec().decode(payload) == rows
+
+
+def test_cache_codec_unknown_name_falls_back_to_json():
+    import cache_codec
+
+    assert cache_codec.get_codec("msgpack").name == "json"
+
+
+def test_cache_keys_include_format_version():
+    from cache_codec import FORMAT_VERSION
+    from cache_utils import _build_cache_key
+
+    key = _build_cache_key("get_data", ("room123",), {})
+
+    assert key.startswith(f"db_cache:{FORMAT_VERSION}:get_data:")
+
+
+def test_cache_data_hit_returns_same_types_as_miss():
+    from datetime import datetime
+
+    from cache_utils import cache_data
+
+    row = {"id": "abc", "time": datetime(2026, 1, 1, 12, 0, 0)}
+    stored = {}
+    pipeline = FakeRedisPipeline()
+    pipeline.setex = MagicMock(side_effect=lambda k, t, p: stored.update({k: p}))
+    mock_redis = _redis_with_pipeline(pipeline)
+    mock_redis.get = AsyncMock(side_effect=lambda key: stored.get(key))
+    mock_redis.set = AsyncMock(return_value=True)
+
+    @cache_data(ttl=60, key_prefix="typed_rows")
+    async def _load():
+        return dict(row)
+
+    with patch("cache_utils.redis_client", mock_redis):
+        first = asyncio.run(_load())
+        second = asyncio.run(_load())
+
+    assert first == second == row
+    assert isinstance(second["time"], datetime)
+
+
 # ---------------------------------------------------------------------------
 # cache_utils – CustomJSONEncoder
 # ---------------------------------------------------------------------------
@@ -422,13 +979,42 @@ def test_custom_json_encoder_decimal():
 # ---------------------------------------------------------------------------
 
 
+class FakeRedisPipeline:
+    """redis.asyncio の pipeline 相当。積んだコマンドを記録し、結果を順に返す。"""
+
+    def __init__(self, results=None):
+        self.commands = []
+        self.results = results or []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return _queue
+
+    async def execute(self):
+        return self.results
+
+
+def _redis_with_pipeline(pipeline):
+    mock_redis = AsyncMock()
+    mock_redis.pipeline = MagicMock(return_value=pipeline)
+    return mock_redis
+
+
 def test_cache_data_miss_calls_function():
     """キャッシュミス時は関数を呼び出して結果を返す"""
     from cache_utils import cache_data
 
-    mock_redis = AsyncMock()
+    mock_redis = _redis_with_pipeline(FakeRedisPipeline())
     mock_redis.get = AsyncMock(return_value=None)
-    mock_redis.setex = AsyncMock()
 
     @cache_data(ttl=60, key_prefix="test")
     async def my_func():
@@ -470,7 +1056,7 @@ def test_cache_data_redis_error_still_calls_function():
     """Redis エラー時も関数を呼び出して結果を返す"""
     from cache_utils import cache_data
 
-    mock_redis = AsyncMock()
+    mock_redis = _redis_with_pipeline(FakeRedisPipeline())
     mock_redis.get = AsyncMock(side_effect=Exception("Connection refused"))
 
     @cache_data(ttl=60, key_prefix="test")
@@ -486,34 +1072,513 @@ def test_cache_data_redis_error_still_calls_function():
 def test_invalidate_cache_entry_deletes_expected_key():
     from cache_utils import _build_cache_key, invalidate_cache_entry
 
-    mock_redis = AsyncMock()
-    mock_redis.delete = AsyncMock()
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
     expected_key = _build_cache_key("get_data", ("room123",), {})
+    key_hash = expected_key.rsplit(":", 1)[1]
 
     with patch("cache_utils.redis_client", mock_redis):
         asyncio.run(invalidate_cache_entry("get_data", "room123"))
 
-    mock_redis.delete.assert_awaited_once_with(expected_key)
+    # 旧スロットが書いたバージョン無しのキーも一緒に消す
+    assert pipeline.commands[0] == (
+        "unlink",
+        (expected_key, f"db_cache:get_data:{key_hash}"),
+        {},
+    )
+
 
+def test_invalidate_cache_entries_batches_keys_tags_and_broadcast():
+    """複数キーとタグの削除・通知を 1 つのパイプラインにまとめる。"""
+    import json
+
+    from cache_utils import (
+        _build_cache_key,
+        cache_entry,
+        invalidate_cache_entries,
+    )
 
-def test_invalidate_cache_prefix_deletes_matching_keys():
+    first = _build_cache_key("get_data", ("s1",), {})
+    second = _build_cache_key("get_all", (), {})
+    tagged = _build_cache_key("try_login", ("id", "pw"), {})
+
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    with patch("cache_utils.redis_client", mock_redis):
+        asyncio.run(
+            invalidate_cache_entries(
+                cache_entry("get_data", "s1"), cache_entry("get_all")
+            )
+        )
+
+    assert [name for name, _, _ in pipeline.commands] == ["unlink", "publish"]
+    unlinked = pipeline.commands[0][1]
+    assert first in unlinked and second in unlinked
+    assert json.loads(pipeline.commands[1][1][1])["keys"] == list(unlinked)
+    mock_redis.unlink.assert_not_awaited()
+    mock_redis.publish.assert_not_awaited()
+
+    pipeline = FakeRedisPipeline(results=[4, {tagged, first}, 1])
+    mock_redis = _redis_with_pipeline(pipeline)
+    with patch("cache_utils.redis_client", mock_redis):
+        asyncio.run(
+            invalidate_cache_entries(cache_entry("get_data", "s1"), tags=["fsqr:s1"])
+        )
+
+    assert [name for name, _, _ in pipeline.commands] == [
+        "unlink",
+        "smembers",
+        "unlink",
+    ]
+    # タグ側で見つかったキーのうち、削除済みのものは再度消さない
+    mock_redis.unlink.assert_awaited_once_with(tagged)
+    channel, message = mock_redis.publish.await_args.args
+    assert tagged in json.loads(message)["keys"]
+
+
+def test_invalidate_cache_prefix_unlinks_registered_keys_without_scan():
+    from cache_utils import invalidate_cache_prefix
+
+    keys = {"db_cache:get_data:aaa", "db_cache:get_data:bbb"}
+    pipeline = FakeRedisPipeline(results=[keys, 1])
+    mock_redis = _redis_with_pipeline(pipeline)
+
+    with (
+        patch("cache_utils.redis_client", mock_redis),
+        patch("cache_utils.CACHE_LEGACY_PREFIX_SCAN", False),
+    ):
+        asyncio.run(invalidate_cache_prefix("get_data"))
+
+    assert pipeline.commands == [
+        ("smembers", ("db_cache_tag:prefix:get_data",), {}),
+        ("unlink", ("db_cache_tag:prefix:get_data",), {}),
+    ]
+    mock_redis.unlink.assert_awaited_once_with(*sorted(keys))
+    mock_redis.scan_iter.assert_not_called()
+
+
+def test_invalidate_cache_prefix_also_scans_legacy_keys_of_old_slot():
+    """旧スロットが書くタグ無しの旧形式キーも、移行中は SCAN で消す。"""
     from cache_utils import invalidate_cache_prefix
 
-    keys = ["db_cache:get_data:aaa", "db_cache:get_data:bbb"]
+    pipeline = FakeRedisPipeline(results=[set(), 1])
+    mock_redis = _redis_with_pipeline(pipeline)
+    scanned = []
+
+    async def scan_iter(match, count):
+        scanned.append(match)
+        yield "db_cache:get_data:legacy"
+
+    mock_redis.scan_iter = scan_iter
+    with (
+        patch("cache_utils.redis_client", mock_redis),
+        patch("cache_utils.CACHE_LEGACY_PREFIX_SCAN", True),
+    ):
+        asyncio.run(invalidate_cache_prefix("get_data"))
+
+    assert scanned == ["db_cache:get_data:*"]
+    mock_redis.unlink.assert_awaited_once_with("db_cache:get_data:legacy")
+
+
+def test_cache_data_registers_keys_under_prefix_and_resource_tags():
+    from cache_utils import (
+        _build_cache_key,
+        cache_data,
+        invalidate_cache_tag,
+        tag_results_by,
+    )
+
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    mock_redis.get = AsyncMock(return_value=None)
+
+    @cache_data(
+        ttl=60, key_prefix="test_tags", tags=tag_results_by("fsqr", "secure_id")
+    )
+    async def lookup(id_val):
+        return [{"secure_id": "s1"}, {"secure_id": "s2"}]
+
+    cache_key = _build_cache_key("test_tags", ("room1",), {})
+    with patch("cache_utils.redis_client", mock_redis):
+        asyncio.run(lookup("room1"))
+        registered = {args[0] for name, args, _ in pipeline.commands if name == "sadd"}
+        assert registered == {
+            "db_cache_tag:prefix:test_tags",
+            "db_cache_tag:fsqr:s1",
+            "db_cache_tag:fsqr:s2",
+        }
+
+        pipeline.commands.clear()
+        pipeline.results = [{cache_key}, 1]
+        asyncio.run(invalidate_cache_tag("fsqr:s2"))
+
+    assert pipeline.commands[0] == ("smembers", ("db_cache_tag:fsqr:s2",), {})
+    mock_redis.unlink.assert_awaited_once_with(cache_key)
+
+
+def test_cache_tag_sets_use_plain_expire_with_longest_entry_ttl():
+    """EXPIRE の NX / GT（Redis 7 以降）は使わず、最長の TTL を付け直す。"""
+    import cache_utils
+    from cache_utils import cache_data
+
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    mock_redis.get = AsyncMock(return_value=None)
+
+    @cache_data(ttl=30, key_prefix="test_tag_ttl")
+    async def lookup():
+        return [{"v": 1}]
+
+    with (
+        patch("cache_utils.redis_client", mock_redis),
+        patch("cache_utils._max_entry_ttl", 600),
+    ):
+        asyncio.run(lookup())
+
+    expires = [
+        (args, kwargs) for name, args, kwargs in pipeline.commands if name == "expire"
+    ]
+    assert expires == [(("db_cache_tag:prefix:test_tag_ttl", 600), {})]
+    assert cache_utils._max_entry_ttl >= 30
+
+
+def test_cache_data_negative_results_use_sentinel_and_short_ttl():
+    """cache_negative=True の関数は「該当なし」も短い TTL で保持する。"""
+    from cache_utils import NEGATIVE_SENTINEL, cache_data
+
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    mock_redis.get = AsyncMock(return_value=None)
+    calls = 0
+
+    async def lookup_direct(id_val, password):
+        nonlocal calls
+        calls += 1
+        return None
+
+    with (
+        patch("cache_utils.redis_client", mock_redis),
+        patch("cache_utils.CACHE_NEGATIVE_TTL_SECONDS", 5),
+    ):
+        lookup = cache_data(ttl=60, key_prefix="test_negative", cache_negative=True)(
+            lookup_direct
+        )
+        assert asyncio.run(lookup("room1", "bad")) is None
+        setex = [args for name, args, _ in pipeline.commands if name == "setex"]
+        assert setex[0][1:] == (5, NEGATIVE_SENTINEL)
+
+        mock_redis.get = AsyncMock(return_value=NEGATIVE_SENTINEL)
+        assert asyncio.run(lookup("room1", "bad")) is None
+
+    assert calls == 1
+
+
+def test_cache_data_without_opt_in_does_not_cache_none():
+    from cache_utils import cache_data
+
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    mock_redis.get = AsyncMock(return_value=None)
+
+    @cache_data(ttl=60, key_prefix="test_no_negative")
+    async def lookup():
+        return None
+
+    with patch("cache_utils.redis_client", mock_redis):
+        assert asyncio.run(lookup()) is None
+
+    assert pipeline.commands == []
+
+
+def test_cache_data_serves_stale_value_and_refreshes_once_in_background():
+    """soft TTL を過ぎた値はすぐ返し、キーごとに 1 回だけ裏で取り直す。"""
+    import time as time_module
+
+    import cache_utils
+    from cache_utils import (
+        begin_request_cache_status,
+        cache_data,
+        end_request_cache_status,
+    )
+
+    expired = f"swr:{time_module.time() - 1:.3f}:" + '[{"v": "old"}]'
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    mock_redis.get = AsyncMock(return_value=expired)
+    mock_redis.set = AsyncMock(return_value=True)
+    calls = 0
+
+    @cache_data(ttl=60, stale_ttl=240, key_prefix="test_swr")
+    async def listing():
+        nonlocal calls
+        calls += 1
+        return [{"v": "new"}]
+
+    async def scenario():
+        token = begin_request_cache_status()
+        results = await asyncio.gather(listing(), listing())
+        status = end_request_cache_status(token)
+        await asyncio.gather(*list(cache_utils._refresh_tasks.values()))
+        return results, status
+
+    with patch("cache_utils.redis_client", mock_redis):
+        results, status = asyncio.run(scenario())
+
+    assert results == [[{"v": "old"}], [{"v": "old"}]]
+    assert status == "stale"
+    assert calls == 1
+    setex = [args for name, args, _ in pipeline.commands if name == "setex"]
+    assert setex[0][1] == 300
+    assert setex[0][2].startswith("swr:")
+    assert setex[0][2].endswith('[{"v":"new"}]')
+
+
+def test_cache_refresh_reuses_value_another_worker_just_stored():
+    """古い L1 を持つワーカーが順に更新しても、DB を読むのはクラスタで 1 回。"""
+    import time as time_module
+
+    import cache_utils
+    from cache_utils import _CacheSpec
+
+    cache_key = "db_cache:test_swr_cluster"
+    shared = {cache_key: f"swr:{time_module.time() - 1:.3f}:" + '[{"v": "old"}]'}
+
+    class SharedPipeline(FakeRedisPipeline):
+        async def execute(self):
+            for name, args, _ in self.commands:
+                if name == "setex":
+                    shared[args[0]] = args[2]
+            self.commands.clear()
+            return self.results
+
     mock_redis = AsyncMock()
-    mock_redis.delete = AsyncMock()
+    mock_redis.pipeline = MagicMock(side_effect=lambda **_: SharedPipeline())
+    mock_redis.get = AsyncMock(side_effect=lambda key: shared.get(key))
+    mock_redis.set = AsyncMock(return_value=True)
+    spec = _CacheSpec(
+        prefix="test_swr_cluster",
+        ttl=60,
+        strip_set=frozenset(),
+        tags=None,
+        stale_ttl=240,
+    )
+    calls = 0
 
-    async def _scan_iter(match=None):
-        del match
-        for key in keys:
-            yield key
+    async def listing():
+        nonlocal calls
+        calls += 1
+        return [{"v": "new"}]
 
-    mock_redis.scan_iter = _scan_iter
+    async def worker():
+        # 各ワーカーは自分の L1 にある古い値を見て更新を始める。
+        await cache_utils._refresh(spec, listing, (), {}, cache_key)
 
     with patch("cache_utils.redis_client", mock_redis):
-        asyncio.run(invalidate_cache_prefix("get_data"))
+        asyncio.run(worker())
+        asyncio.run(worker())
+
+    assert calls == 1
+    assert shared[cache_key].endswith('[{"v":"new"}]')
+
+
+def test_request_cache_status_reports_worst_swr_status_only():
+    from cache_utils import (
+        _CacheSpec,
+        _record_status,
+        begin_request_cache_status,
+        end_request_cache_status,
+    )
+
+    swr = _CacheSpec(prefix="a", ttl=60, strip_set=frozenset(), tags=None, stale_ttl=5)
+    plain = _CacheSpec(prefix="b", ttl=60, strip_set=frozenset(), tags=None)
+
+    token = begin_request_cache_status()
+    _record_status(plain, "miss")
+    _record_status(swr, "fresh")
+    assert end_request_cache_status(token) == "fresh"
+
+    token = begin_request_cache_status()
+    _record_status(swr, "fresh")
+    _record_status(swr, "miss")
+    assert end_request_cache_status(token) == "miss"
+
+
+def test_cache_data_serves_repeat_reads_from_local_cache():
+    """L1 が有効なら 2 回目以降は Redis を引かない。"""
+    import cache_utils
+    from cache_utils import LocalCache, cache_data
+
+    mock_redis = AsyncMock()
+    mock_redis.get = AsyncMock(return_value='[{"name": "cached"}]')
+
+    @cache_data(ttl=60, key_prefix="test_l1")
+    async def my_func():
+        return []
+
+    async def scenario():
+        first = await my_func()
+        first[0]["name"] = "mutated"
+        return await my_func()
+
+    with (
+        patch("cache_utils.redis_client", mock_redis),
+        patch("cache_utils.local_cache", LocalCache(16, 1024, 10)),
+        patch("cache_utils._listener_ready", True),
+    ):
+        result = asyncio.run(scenario())
+        stats = cache_utils.get_cache_stats()
+
+    # 呼び出し側が書き換えても L1 の値は変わらない
+    assert result == [{"name": "cached"}]
+    mock_redis.get.assert_awaited_once()
+    assert stats["hits"] == 1
+
+
+def test_local_cache_applies_remote_invalidations_and_evicts_by_size():
+    import json
+
+    import cache_utils
+    from cache_utils import LocalCache
+
+    cache = LocalCache(max_entries=10, max_bytes=10, max_ttl=10)
+    with patch("cache_utils.local_cache", cache):
+        cache.set("db_cache:a:1", "1234", 60, cache.generation)
+        cache.set("db_cache:b:1", "5678", 60, cache.generation)
+        cache.set("db_cache:b:2", "9012", 60, cache.generation)
+        # 合計 10 バイトを超えた分は古い順に追い出す
+        assert cache.get("db_cache:a:1") is None
+        assert cache.stats["evictions"] == 1
+
+        cache_utils._apply_invalidation(
+            json.dumps({"prefix": "db_cache:b:", "source": "other-worker"})
+        )
+        assert cache.get("db_cache:b:1") is None
+        assert cache.get("db_cache:b:2") is None
+
+        # 読み込み中に無効化が届いた値は保存しない
+        generation = cache.generation
+        cache_utils._apply_invalidation(
+            json.dumps({"keys": ["db_cache:c:1"], "source": "other-worker"})
+        )
+        cache.set("db_cache:c:1", "old", 60, generation)
+        assert cache.get("db_cache:c:1") is None
+
+
+def test_invalidate_cache_entry_broadcasts_to_other_workers():
+    import json
+
+    from cache_utils import (
+        INVALIDATION_CHANNEL,
+        _build_cache_key,
+        invalidate_cache_entry,
+    )
+
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    with patch("cache_utils.redis_client", mock_redis):
+        asyncio.run(invalidate_cache_entry("get_data", "room123"))
+
+    name, (channel, message), _ = pipeline.commands[-1]
+    assert name == "publish"
+    assert channel == INVALIDATION_CHANNEL
+    assert json.loads(message)["keys"][0] == _build_cache_key(
+        "get_data", ("room123",), {}
+    )
+
+
+def test_cache_data_coalesces_concurrent_misses_in_worker():
+    """同じキーの同時ミスは 1 回の関数呼び出しにまとめる。"""
+    import cache_utils
+    from cache_utils import cache_data
+
+    pipeline = FakeRedisPipeline()
+    mock_redis = _redis_with_pipeline(pipeline)
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.set = AsyncMock(return_value=True)
+    calls = 0
+
+    @cache_data(ttl=60, key_prefix="test_single_flight")
+    async def my_func(room_id):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return [{"room_id": room_id}]
+
+    async def scenario():
+        return await asyncio.gather(*(my_func("roomA") for _ in range(5)))
+
+    with (
+        patch("cache_utils.redis_client", mock_redis),
+        patch.dict(cache_utils._single_flight_stats, {"coalesced_local": 0}),
+    ):
+        results = asyncio.run(scenario())
+        saved = cache_utils.get_cache_stats()["single_flight"]["db_calls_saved"]
+
+    assert calls == 1
+    assert results == [[{"room_id": "roomA"}]] * 5
+    # 後続には別オブジェクトを返す
+    assert len({id(result) for result in results}) == 5
+    assert saved >= 4
+    assert [name for name, _, _ in pipeline.commands].count("setex") == 1
+    mock_redis.delete.assert_awaited_once()
+
+
+def test_single_flight_waiters_survive_cancelled_leader():
+    """先行呼び出しが取り消されても、待っていた呼び出しは自分で読み直す。"""
+    from cache_utils import _single_flight
+
+    loads = 0
+
+    async def load():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.01)
+        # 保存できなかった結果（payload なし）も、待ち手には複製を渡す。
+        return None, [{"room_id": "roomA"}]
+
+    async def scenario():
+        leader = asyncio.create_task(_single_flight("k", load))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(_single_flight("k", load)) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        return leader, results
+
+    leader, results = asyncio.run(scenario())
+
+    assert leader.cancelled()
+    assert results == [[{"room_id": "roomA"}]] * 2
+    assert results[0] is not results[1]
+    assert loads == 2
+
+
+def test_cache_data_waits_for_other_worker_holding_fill_lock():
+    import cache_utils
+    from cache_utils import cache_data
+
+    mock_redis = AsyncMock()
+    mock_redis.get = AsyncMock(side_effect=[None, None, '[{"room_id": "roomA"}]'])
+    mock_redis.set = AsyncMock(return_value=None)
+    called = False
+
+    @cache_data(ttl=60, key_prefix="test_fill_lock")
+    async def my_func():
+        nonlocal called
+        called = True
+        return []
+
+    with (
+        patch("cache_utils.redis_client", mock_redis),
+        patch("cache_utils._FILL_POLL_SECONDS", 0),
+        patch.dict(cache_utils._single_flight_stats, {"coalesced_remote": 0}),
+    ):
+        result = asyncio.run(my_func())
+        coalesced = cache_utils._single_flight_stats["coalesced_remote"]
 
-    mock_redis.delete.assert_awaited_once_with(*keys)
+    assert result == [{"room_id": "roomA"}]
+    assert called is False
+    assert coalesced == 1
 
 
 def test_session_auth_marks_and_validates_session():
@@ -562,6 +1627,51 @@ def test_build_session_middleware_kwargs_uses_strict_and_max_age():
     assert kwargs["https_only"] is True
 
 
+# ---------------------------------------------------------------------------
+# password_security – offloaded scrypt
+# ---------------------------------------------------------------------------
+
+
+def test_password_hash_async_round_trip_in_process_pool():
+    """プロセスプール経由でもハッシュ化と検証が往復できる"""
+    import password_security
+
+    async def scenario():
+        hashed = await password_security.hash_password_async("123456")
+        assert hashed.startswith("scrypt:")
+        assert await password_security.verify_password_async(hashed, "123456")
+        assert not await password_security.verify_password_async(hashed, "654321")
+
+    try:
+        with patch("password_security.PASSWORD_HASH_WORKERS", 1):
+            asyncio.run(scenario())
+    finally:
+        password_security.shutdown_password_pool()
+
+    stats = password_security.get_password_pool_stats()
+    assert stats["completed"] >= 3
+    assert stats["pending"] == 0
+
+
+def test_verify_password_async_skips_pool_for_plaintext_legacy_rows():
+    import password_security
+
+    with patch("password_security._run_offloaded") as offloaded:
+        assert asyncio.run(password_security.verify_password_async("abc", "abc"))
+        assert not asyncio.run(password_security.verify_password_async(None, "abc"))
+    offloaded.assert_not_called()
+
+
+def test_password_hash_async_rejects_when_queue_is_full():
+    import password_security
+
+    with (
+        patch("password_security.PASSWORD_HASH_MAX_PENDING", 0),
+        pytest.raises(password_security.PasswordHashBusyError),
+    ):
+        asyncio.run(password_security.hash_password_async("123456"))
+
+
 # ---------------------------------------------------------------------------
 # rate_limit – async functions
 # ---------------------------------------------------------------------------
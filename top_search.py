@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-from typing import Any
+import asyncio
+from typing import Any, Awaitable, Callable, Collection
 
 from fastapi import APIRouter, Request
 from starlette.responses import RedirectResponse
 
+import room_directory
+from database import remove_db_session
 from FSQR import fsqr_data
-from FSQR.fsqr_app import _remember_fsqr_access
+from FSQR.fsqr_app import _get_active_data, _remember_fsqr_access
 from Group import group_data
 from Group.group_common import get_room_if_active, remember_group_room_access
 from Note import note_data
@@ -22,11 +25,145 @@ from rate_limit import (
     register_success,
 )
 from room_credentials import validate_room_credentials
+from settings import ROOM_DIRECTORY_FALLBACK
 from share_links import ServiceKey, build_room_url
 from web import build_url, enforce_csrf, render_template
 
 router = APIRouter()
 
+# 結果ページでの表示順
+_SERVICES = (
+    (ServiceKey.FSQR, "FSQR", "ファイル共有のダウンロードページを開きます。"),
+    (ServiceKey.GROUP, "Group", "グループファイル共有ルームを開きます。"),
+    (ServiceKey.NOTE, "Note", "リアルタイムノートルームを開きます。"),
+    (ServiceKey.TASK, "Task", "タスクボードを開きます。"),
+)
+
+_SERVICE_KEYS = frozenset(service_key.value for service_key, _, _ in _SERVICES)
+
+_REMEMBER_ROOM_ACCESS = {
+    ServiceKey.GROUP: remember_group_room_access,
+    ServiceKey.NOTE: remember_note_room_access,
+    ServiceKey.TASK: remember_task_room_access,
+}
+
+
+async def _fsqr_is_active(secure_id: str) -> bool:
+    return bool(await _get_active_data(secure_id))
+
+
+async def _group_is_active(room_id: str) -> bool:
+    return bool(await get_room_if_active(room_id))
+
+
+async def _note_is_active(room_id: str) -> bool:
+    return bool(await note_data.get_room_meta_direct(room_id))
+
+
+async def _task_is_active(room_id: str) -> bool:
+    return bool(await task_data.get_room_meta_direct(room_id))
+
+
+# room_directory の一致が、各サービスの表でまだ有効かを確かめる。
+_ACTIVE_CHECKS: dict[ServiceKey, Callable[[str], Awaitable[bool]]] = {
+    ServiceKey.FSQR: _fsqr_is_active,
+    ServiceKey.GROUP: _group_is_active,
+    ServiceKey.NOTE: _note_is_active,
+    ServiceKey.TASK: _task_is_active,
+}
+
+
+async def _find_fsqr(id_val: str, password: str) -> str | None:
+    rows = await fsqr_data.get_data_by_credentials(id_val, password)
+    return rows[0].get("secure_id") if rows else None
+
+
+async def _find_group(id_val: str, password: str) -> str | None:
+    room_id = await group_data.pich_room_id(id_val, password)
+    if room_id and await _group_is_active(room_id):
+        return room_id
+    return None
+
+
+async def _find_note(id_val: str, password: str) -> str | None:
+    room_id = await note_data.pick_room_id(id_val, password)
+    if room_id and await _note_is_active(room_id):
+        return room_id
+    return None
+
+
+async def _find_task(id_val: str, password: str) -> str | None:
+    room_id = await task_data.pick_room_id(id_val, password)
+    if room_id and await _task_is_active(room_id):
+        return room_id
+    return None
+
+
+_SERVICE_FINDERS: dict[ServiceKey, Callable[[str, str], Awaitable[str | None]]] = {
+    ServiceKey.FSQR: _find_fsqr,
+    ServiceKey.GROUP: _find_group,
+    ServiceKey.NOTE: _find_note,
+    ServiceKey.TASK: _find_task,
+}
+
+
+async def _in_own_session(awaitable):
+    # gather の子タスクはそれぞれ別の DB セッションを持つため、終了時に返却する。
+    try:
+        return await awaitable
+    finally:
+        await remove_db_session()
+
+
+async def _find_directory_rooms(id_val: str, password: str) -> dict[str, str]:
+    """room_directory の一致のうち、各サービスの表でまだ有効なものを返す。
+
+    索引の削除は失敗しても止めないため、削除・期限切れのルームが残っていることが
+    ある。そうした行はここで索引から外す。
+    """
+    entries = [
+        entry
+        for entry in await room_directory.find_rooms(id_val, password)
+        if entry["service_key"] in _SERVICE_KEYS
+    ]
+    active = await asyncio.gather(
+        *(
+            _in_own_session(
+                _ACTIVE_CHECKS[ServiceKey(entry["service_key"])](entry["resource_id"])
+            )
+            for entry in entries
+        )
+    )
+    found = {}
+    for entry, is_active in zip(entries, active):
+        if is_active:
+            found[entry["service_key"]] = entry["resource_id"]
+        else:
+            await room_directory.remove_room(entry["service_key"], entry["resource_id"])
+    return found
+
+
+async def _search_services(
+    id_val: str, password: str, *, skip: Collection[str] = ()
+) -> dict[str, str]:
+    """room_directory に無いルームを各サービスの表から並行して探す。
+
+    ``skip`` のサービス（room_directory で見つかったもの）は調べない。
+    """
+    finders = {
+        service_key: finder
+        for service_key, finder in _SERVICE_FINDERS.items()
+        if service_key.value not in skip
+    }
+    results = await asyncio.gather(
+        *(_in_own_session(finder(id_val, password)) for finder in finders.values())
+    )
+    return {
+        service_key.value: resource_id
+        for service_key, resource_id in zip(finders, results)
+        if resource_id
+    }
+
 
 def _render_result(
     request: Request,
@@ -74,68 +211,31 @@ async def search_all(request: Request):
             searched_id=id_val,
         )
 
-    matches = []
+    found = await _find_directory_rooms(id_val, password)
+    if ROOM_DIRECTORY_FALLBACK and len(found) < len(_SERVICE_FINDERS):
+        # 索引への登録は失敗しても作成を止めないため、索引で見つからなかった
+        # サービスは個別に調べる（他のサービスが索引で見つかった場合も）。
+        found.update(await _search_services(id_val, password, skip=found))
 
-    fsqr_rows = await fsqr_data.get_data_by_credentials(id_val, password)
-    if fsqr_rows:
-        record = fsqr_rows[0]
-        secure_id = record.get("secure_id")
-        if secure_id:
-            _remember_fsqr_access(request, secure_id, id_val, password)
-            matches.append(
-                {
-                    "service_key": "fsqr",
-                    "service_name": "FSQR",
-                    "description": "ファイル共有のダウンロードページを開きます。",
-                    "url": build_url(request, "fsqr.download", secure_id=secure_id),
-                }
+    matches = []
+    for service_key, service_name, description in _SERVICES:
+        resource_id = found.get(service_key.value)
+        if not resource_id:
+            continue
+        if service_key == ServiceKey.FSQR:
+            _remember_fsqr_access(request, resource_id, id_val, password)
+            url = build_url(request, "fsqr.download", secure_id=resource_id)
+        else:
+            _REMEMBER_ROOM_ACCESS[service_key](request, resource_id, password=password)
+            url = build_room_url(
+                request, service_key=service_key, resource_id=resource_id
             )
-
-    group_room_id = await group_data.pich_room_id(id_val, password)
-    if group_room_id and await get_room_if_active(group_room_id):
-        remember_group_room_access(request, group_room_id, password=password)
-        matches.append(
-            {
-                "service_key": "group",
-                "service_name": "Group",
-                "description": "グループファイル共有ルームを開きます。",
-                "url": build_room_url(
-                    request, service_key=ServiceKey.GROUP, resource_id=group_room_id
-                ),
-            }
-        )
-
-    note_room_id = await note_data.pick_room_id(id_val, password)
-    note_meta = (
-        await note_data.get_room_meta_direct(note_room_id) if note_room_id else None
-    )
-    if note_room_id and note_meta:
-        remember_note_room_access(request, note_room_id, password=password)
-        matches.append(
-            {
-                "service_key": "note",
-                "service_name": "Note",
-                "description": "リアルタイムノートルームを開きます。",
-                "url": build_room_url(
-                    request, service_key=ServiceKey.NOTE, resource_id=note_room_id
-                ),
-            }
-        )
-
-    task_room_id = await task_data.pick_room_id(id_val, password)
-    task_meta = (
-        await task_data.get_room_meta_direct(task_room_id) if task_room_id else None
-    )
-    if task_room_id and task_meta:
-        remember_task_room_access(request, task_room_id, password=password)
         matches.append(
             {
-                "service_key": "task",
-                "service_name": "Task",
-                "description": "タスクボードを開きます。",
-                "url": build_room_url(
-                    request, service_key=ServiceKey.TASK, resource_id=task_room_id
-                ),
+                "service_key": service_key.value,
+                "service_name": service_name,
+                "description": description,
+                "url": url,
             }
         )
 
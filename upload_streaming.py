@@ -0,0 +1,151 @@
+"""multipart のアップロードを、本文を読みながら保存先ディレクトリへ直接書き込む。
+
+Starlette の ``request.form()`` はファイル部分を SpooledTemporaryFile（1MB を
+超えるとシステムの一時ディレクトリ）へ書き出すため、保存先へもう 1 度コピーすると
+同じ内容を 2 回書くことになる。ここではファイル部分を最初から保存先と同じ
+ディレクトリの ``.<ランダム>.uploading`` に書き、呼び出し側は ``os.replace`` で
+確定させるだけにする。サイズ・ファイル数の上限は受信中に確かめ、超えた時点で
+読み取りをやめる。
+
+FormData の組み立ては Starlette の MultiPartParser をそのまま使い、ファイル部分の
+書き込み先だけを差し替える。
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import secrets
+
+from starlette.datastructures import FormData, UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+UPLOADING_SUFFIX = ".uploading"
+
+
+class UploadLimitError(MultiPartException):
+    """受信中にファイル数・サイズの上限を超えた。message は利用者向けの文言。"""
+
+
+class _DiskMultiPartParser(MultiPartParser):
+    def __init__(
+        self,
+        request: Request,
+        *,
+        upload_dir: str,
+        max_files: int,
+        max_total_bytes: int,
+        too_many_files_message: str,
+        too_large_message: str,
+    ) -> None:
+        # ファイル数は利用者向けの文言で断るため、親クラスの上限は使わない。
+        super().__init__(request.headers, request.stream(), max_files=float("inf"))
+        self.upload_dir = upload_dir
+        self.limit_files = max_files
+        self.max_total_bytes = max_total_bytes
+        self.too_many_files_message = too_many_files_message
+        self.too_large_message = too_large_message
+        self.file_count = 0
+        self.total_bytes = 0
+        self.paths: list[str] = []
+        # 差し替えた一時ファイル。失敗時は親クラスの後始末に頼らずここで閉じる。
+        self.handles: list = []
+
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is None:
+            return
+        self.file_count += 1
+        if self.file_count > self.limit_files:
+            raise UploadLimitError(self.too_many_files_message)
+        # 親クラスが用意した SpooledTemporaryFile を、保存先の一時ファイルに差し替える。
+        spooled = upload.file
+        path = os.path.join(
+            self.upload_dir, f".{secrets.token_hex(8)}{UPLOADING_SUFFIX}"
+        )
+        upload.file = open(path, "w+b")  # noqa: SIM115 - FormData.close で閉じる
+        self.paths.append(path)
+        self.handles.append(upload.file)
+        spooled.close()
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._current_part.file is not None:
+            self.total_bytes += end - start
+            if self.total_bytes > self.max_total_bytes:
+                raise UploadLimitError(self.too_large_message)
+        super().on_part_data(data, start, end)
+
+    def discard(self) -> None:
+        for handle in self.handles:
+            handle.close()
+        remove_upload_files(self.paths)
+
+
+async def receive_upload_form(
+    request: Request,
+    *,
+    upload_dir: str,
+    max_files: int,
+    max_total_bytes: int,
+    too_many_files_message: str,
+    too_large_message: str,
+) -> FormData:
+    """フォームを読み、ファイル部分は ``upload_dir`` の一時ファイルに書いて返す。
+
+    ファイル部分の UploadFile は ``upload.file.name`` が一時ファイルのパスになる。
+    呼び出し側は確定させなかった一時ファイルを discard_upload_form で消すこと。
+    上限超過は UploadLimitError、壊れた本文は MultiPartException を送出し、
+    その時点までに書いた一時ファイルはここで消す。
+    """
+    content_type = request.headers.get("content-type", "")
+    if "multipart/form-data" not in content_type:
+        return await request.form()
+    parser = _DiskMultiPartParser(
+        request,
+        upload_dir=upload_dir,
+        max_files=max_files,
+        max_total_bytes=max_total_bytes,
+        too_many_files_message=too_many_files_message,
+        too_large_message=too_large_message,
+    )
+    try:
+        return await parser.parse()
+    except BaseException:
+        parser.discard()
+        raise
+
+
+def uploaded_files(form: FormData, field: str) -> list[UploadFile]:
+    return [value for value in form.getlist(field) if isinstance(value, UploadFile)]
+
+
+def upload_temp_path(upload: UploadFile) -> str | None:
+    """receive_upload_form が書いた一時ファイルのパス。それ以外は None。"""
+    name = getattr(upload.file, "name", None)
+    if isinstance(name, str) and name.endswith(UPLOADING_SUFFIX):
+        return name
+    return None
+
+
+async def discard_upload_form(form: FormData) -> None:
+    """ファイルを閉じ、確定されずに残った一時ファイルを消す。"""
+    paths = [
+        path
+        for _, value in form.multi_items()
+        if isinstance(value, UploadFile) and (path := upload_temp_path(value))
+    ]
+    await form.close()
+    remove_upload_files(paths)
+
+
+def remove_upload_files(paths) -> None:
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            logger.warning("Failed to remove upload temp file: %s", path)
@@ -343,11 +343,24 @@ async def _extract_csrf_token(request: Request) -> str:
 
 
 async def validate_csrf(request: Request) -> bool:
-    expected = get_or_create_csrf_token(request)
-    provided = await _extract_csrf_token(request)
+    return _csrf_token_matches(request, await _extract_csrf_token(request))
+
+
+def _csrf_token_matches(request: Request, provided: str) -> bool:
     if not provided:
         return False
-    return hmac.compare_digest(provided, expected)
+    return hmac.compare_digest(provided, get_or_create_csrf_token(request))
+
+
+def has_csrf_header(request: Request) -> bool:
+    return bool(_normalize_csrf_token(request.headers.get(CSRF_HEADER_NAME)))
+
+
+def enforce_csrf_form_token(request: Request, form: Any) -> None:
+    """読み取り済みのフォームの csrf_token で検証する（本文を自前で読む経路向け）。"""
+    if _csrf_token_matches(request, _normalize_csrf_token(form.get(CSRF_FORM_FIELD))):
+        return
+    raise HTTPException(status_code=403, detail="CSRF token missing or invalid")
 
 
 async def enforce_csrf(request: Request) -> None: